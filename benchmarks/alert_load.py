@@ -0,0 +1,113 @@
+"""
+Load benchmark for the alert service /subscribe and /users endpoints.
+
+Start the alert service (and the config service it depends on), then run:
+
+    uv run --package alert python benchmarks/alert_load.py --url http://localhost:8007
+
+Each endpoint is hit `--requests` times with `--concurrency` requests in flight.
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+
+import httpx
+
+
+def summarize(name: str, latencies: list[float], elapsed: float, errors: int) -> dict:
+    latencies = sorted(latencies)
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        "endpoint": name,
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "throughput_rps": len(latencies) / elapsed,
+        "p50_ms": quantiles[49] * 1000,
+        "p95_ms": quantiles[94] * 1000,
+        "p99_ms": quantiles[98] * 1000,
+    }
+
+
+async def run(
+    name: str,
+    client: httpx.AsyncClient,
+    make_request,
+    requests: int,
+    concurrency: int,
+) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+    errors = 0
+
+    async def one(i: int):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                r = await make_request(client, i)
+                r.raise_for_status()
+            except httpx.HTTPError:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return summarize(name, latencies, time.perf_counter() - start, errors)
+
+
+def subscribe(client: httpx.AsyncClient, i: int):
+    return client.post(
+        "/subscribe",
+        json={
+            "name": f"bench-{i}",
+            "mail": f"{uuid.uuid4().hex}@example.org",
+            "ip": f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}",
+            "segments_ids": [i % 10],
+            "departements": [31],
+        },
+    )
+
+
+def users(client: httpx.AsyncClient, i: int):
+    return client.get("/users")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8007")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument(
+        "--users-requests",
+        type=int,
+        default=200,
+        help="/users returns every subscriber, so it is hit fewer times",
+    )
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=60) as client:
+        results = [
+            await run("/subscribe", client, subscribe, args.requests, args.concurrency),
+            await run("/users", client, users, args.users_requests, args.concurrency),
+        ]
+
+    for r in results:
+        print(
+            f"{r['endpoint']:<12} {r['throughput_rps']:8.1f} req/s  "
+            f"p50 {r['p50_ms']:7.1f} ms  p95 {r['p95_ms']:7.1f} ms  "
+            f"p99 {r['p99_ms']:7.1f} ms  errors {r['errors']}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
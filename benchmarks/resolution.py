@@ -0,0 +1,160 @@
+"""
+Latency, memory and accuracy of flow-prediction at each watershed resolution.
+
+Build the coarser levels with `just pyramid` in models/watershed, then run:
+
+    uv run --package flow-prediction python benchmarks/resolution.py
+
+Every level is fed the same synthetic AROME-like rainfall (0.01° grid), and its
+flow is compared with the full resolution one.
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from floodcast_common.raster_codec import RasterArray
+from rasterio.transform import from_origin
+from rasterio.warp import transform_bounds
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "services" / "flow-prediction"))
+
+from app.predict import watershed  # noqa: E402
+from app.predict.predict_flow_rate import BIN_SIZE, MAX_TRAVEL_TIME  # noqa: E402
+from app.predict.reproject import reproject_to_match  # noqa: E402
+
+RESOLUTIONS = [watershed.FULL_RESOLUTION, 100, 250, 500, 1000]
+RAIN_CELL_DEGREES = 0.01
+
+
+def synthetic_rainfall(bounds: tuple[float, float, float, float], seed: int) -> RasterArray:
+    """
+    Smooth random rainfall (kg/m²) in EPSG:4326 covering bounds.
+    """
+    rng = np.random.default_rng(seed)
+    west, south, east, north = bounds
+    width = int((east - west) / RAIN_CELL_DEGREES) + 3
+    height = int((north - south) / RAIN_CELL_DEGREES) + 3
+    y, x = np.mgrid[0:height, 0:width]
+    rain = np.zeros((height, width), dtype=np.float32)
+    for _ in range(8):
+        cy, cx = rng.uniform(0, height), rng.uniform(0, width)
+        radius = rng.uniform(5, 30)
+        rain += rng.uniform(1, 15) * np.exp(-((y - cy) ** 2 + (x - cx) ** 2) / radius**2)
+
+    return RasterArray(
+        array=rain,
+        transform=tuple(
+            from_origin(
+                west - RAIN_CELL_DEGREES,
+                north + RAIN_CELL_DEGREES,
+                RAIN_CELL_DEGREES,
+                RAIN_CELL_DEGREES,
+            )
+        )[:6],
+        crs="EPSG:4326",
+        nodata=None,
+    )
+
+
+def predict(model: watershed.WatershedModel, rainfall: list[RasterArray]) -> float:
+    """
+    Rainfall flow rate (m³/h), as estimate_outlet_flow_rate computes it.
+    """
+    total_volume = 0.0
+    for bin_start, raster in zip(range(0, MAX_TRAVEL_TIME, BIN_SIZE), rainfall):
+        rain = reproject_to_match(raster, model)
+        total_volume += model.volume_m3(rain, bin_start, bin_start + BIN_SIZE)
+    return total_volume / BIN_SIZE
+
+
+def benchmark_level(resolution: int, rainfall: list[RasterArray], repeats: int) -> dict:
+    start = time.perf_counter()
+    model = watershed.load_watershed(resolution)
+    load_s = time.perf_counter() - start
+
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        flow = predict(model, rainfall)
+        latencies.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    predict(model, rainfall)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "resolution_m": resolution,
+        "grid": [model.width, model.height],
+        "cells": int(model.cell_index.size),
+        "area_km2": model.area_m2 / 1e6,
+        "load_s": load_s,
+        "model_mb": (
+            model.cell_index.nbytes + model.cell_area.nbytes + model.hour_offsets.nbytes
+        )
+        / 1e6,
+        "peak_predict_mb": peak / 1e6,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "flow_m3s": flow / 3600,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--dist",
+        type=Path,
+        default=watershed.WATERSHED_PATH,
+        help="Full resolution travel time raster, with its pyramid next to it",
+    )
+    parser.add_argument("--resolutions", type=int, nargs="+", default=RESOLUTIONS)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    watershed.WATERSHED_PATH = args.dist
+    with rasterio.open(args.dist) as ds:
+        bounds = transform_bounds(ds.crs, "EPSG:4326", *ds.bounds)
+    rainfall = [
+        synthetic_rainfall(bounds, args.seed + i)
+        for i in range(len(range(0, MAX_TRAVEL_TIME, BIN_SIZE)))
+    ]
+
+    results = []
+    for resolution in args.resolutions:
+        if not watershed.watershed_path(resolution).exists():
+            print(f"Skipping {resolution}m: {watershed.watershed_path(resolution)} not found")
+            continue
+        results.append(benchmark_level(resolution, rainfall, args.repeats))
+
+    reference = next(
+        (r for r in results if r["resolution_m"] == watershed.FULL_RESOLUTION), None
+    )
+    for r in results:
+        r["flow_error_pct"] = (
+            abs(r["flow_m3s"] - reference["flow_m3s"]) / reference["flow_m3s"] * 100
+            if reference and reference["flow_m3s"]
+            else None
+        )
+        error = f"{r['flow_error_pct']:6.2f}%" if r["flow_error_pct"] is not None else "     -"
+        print(
+            f"{r['resolution_m']:>5}m  load {r['load_s']:6.2f} s  "
+            f"predict p50 {r['p50_ms']:8.1f} ms  model {r['model_mb']:7.1f} MB  "
+            f"peak {r['peak_predict_mb']:7.1f} MB  flow {r['flow_m3s']:9.2f} m³/s  "
+            f"error {error}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+"""
+End-to-end benchmark of the floodcast services against local stand-ins.
+
+Starts the stubs (benchmarks/stubs.py), the config server and the weather-data,
+flow-data, flow-prediction and alert services, then measures:
+- /flow latency percentiles on flow-prediction
+- /rainfall throughput on weather-data, at several cache hit ratios
+- /alertUsers fan-out time, until every alert reached the stub receiver
+- estimate_outlet_flow_rate CPU time, in this process
+
+All services must be installed in the current environment:
+
+    uv sync --all-packages
+    uv run python benchmarks/run.py --output results.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Iterator
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import httpx
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+from alert_load import run as run_load
+
+ROOT = Path(__file__).parents[1]
+SERVICES = ROOT / "services"
+
+# Synthetic watershed, upstream of Portet-sur-Garonne
+WATERSHED_SHAPE = (2000, 1600)
+WATERSHED_ORIGIN = (520000.0, 6290000.0)
+WATERSHED_CELL = 25.0
+# Flow velocity used to turn distance into travel time, in m/s
+WATERSHED_VELOCITY = 0.6
+
+CACHE_HIT_RATIOS = [0.0, 0.5, 0.9]
+# Periods kept in the weather-data cache during a /rainfall run. Together with
+# the misses of a run, must stay under its MAX_CACHE_FILES to avoid evictions.
+WARM_PERIODS = 10
+
+
+def synthetic_watershed(directory: Path):
+    """
+    Write a travel time raster: a half ellipse draining to its bottom middle.
+    """
+    height, width = WATERSHED_SHAPE
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    dist = np.hypot(y - height, x - width / 2) * WATERSHED_CELL / WATERSHED_VELOCITY
+    outside = ((x - width / 2) / (width / 2)) ** 2 + ((y - height) / height) ** 2 > 1
+    dist[outside] = -32768
+    (directory / "garonne").mkdir(parents=True, exist_ok=True)
+    with rasterio.open(
+        directory / "garonne" / "dist.tiff",
+        "w",
+        driver="GTiff",
+        width=width,
+        height=height,
+        count=1,
+        dtype="float32",
+        crs="EPSG:2154",
+        transform=from_origin(*WATERSHED_ORIGIN, WATERSHED_CELL, WATERSHED_CELL),
+        nodata=-32768,
+    ) as dst:
+        dst.write(dist, 1)
+
+
+class Services:
+    """
+    The stubs and services, each a uvicorn subprocess on its own port.
+    """
+
+    def __init__(self, workdir: Path, base_port: int) -> None:
+        self.workdir = workdir
+        self.base_port = base_port
+        self.env = dict(os.environ)
+        self.processes: list[subprocess.Popen] = []
+
+    def url(self, offset: int) -> str:
+        return f"http://127.0.0.1:{self.base_port + offset}"
+
+    def start(self, name: str, args: list[str], offset: int):
+        log = open(self.workdir / f"{name}.log", "w")
+        self.processes.append(
+            subprocess.Popen(
+                [sys.executable, *args, "--port", str(self.base_port + offset)],
+                cwd=self.workdir,
+                env=self.env,
+                stdout=log,
+                stderr=subprocess.STDOUT,
+            )
+        )
+
+    def start_service(self, name: str, offset: int):
+        self.start(
+            name,
+            [
+                "-m",
+                "uvicorn",
+                "app.main:app",
+                "--app-dir",
+                str(SERVICES / name),
+                "--log-level",
+                "warning",
+            ],
+            offset,
+        )
+
+    async def wait_ready(self, offset: int, timeout: float = 60.0):
+        deadline = time.monotonic() + timeout
+        async with httpx.AsyncClient(base_url=self.url(offset)) as client:
+            while True:
+                try:
+                    (await client.get("/")).raise_for_status()
+                    return
+                except httpx.HTTPError:
+                    if time.monotonic() > deadline:
+                        raise RuntimeError(
+                            f"{self.url(offset)} not ready, see logs in {self.workdir}"
+                        )
+                    await asyncio.sleep(0.2)
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+STUBS, CONFIG, WEATHER, FLOW_DATA, PREDICTION, ALERT = range(6)
+
+
+async def bench_flow(url: str, requests: int, concurrency: int) -> dict:
+    now = datetime.now().replace(minute=0, second=0, microsecond=0)
+    async with httpx.AsyncClient(base_url=url, timeout=300) as client:
+
+        def flow(client: httpx.AsyncClient, i: int):
+            return client.get(
+                "/flow", params={"prediction_time": (now + timedelta(hours=i % 24)).isoformat()}
+            )
+
+        return await run_load("/flow", client, flow, requests, concurrency)
+
+
+def unique_periods() -> Iterator[dict]:
+    """
+    Rainfall periods that the stub WCS can serve, never the same twice.
+    """
+    now = datetime.now().replace(minute=0, second=0, microsecond=0)
+    for span in (1, 2, 3, 6):
+        for hours in range(-90, 40):
+            yield {"start": (now + timedelta(hours=hours)).isoformat(), "span": f"PT{span}H"}
+
+
+async def bench_rainfall(
+    url: str,
+    requests: int,
+    concurrency: int,
+    hit_ratio: float,
+    periods: Iterator[dict],
+) -> dict:
+    """
+    hit_ratio of the requests ask for periods already in the cache, the others
+    for periods never asked before.
+    """
+    rng = random.Random(0)
+    warm = [next(periods) for _ in range(WARM_PERIODS)]
+    async with httpx.AsyncClient(base_url=url, timeout=300) as client:
+        for params in warm:
+            (await client.get("/rainfall", params=params)).raise_for_status()
+
+        def rainfall(client: httpx.AsyncClient, i: int):
+            if rng.random() < hit_ratio:
+                params = rng.choice(warm)
+            else:
+                params = next(periods)
+            return client.get("/rainfall", params=params)
+
+        result = await run_load("/rainfall", client, rainfall, requests, concurrency)
+    result["hit_ratio"] = hit_ratio
+    return result
+
+
+async def bench_alert(url: str, stubs_url: str, users: int) -> dict:
+    async with httpx.AsyncClient(base_url=url, timeout=300) as client:
+        body = "\n".join(
+            json.dumps(
+                {
+                    "name": f"bench-{i}",
+                    "mail": f"bench-{i}@example.org",
+                    "ip": "127.0.0.1",
+                    "segments_ids": [1],
+                }
+            )
+            for i in range(users)
+        )
+        r = await client.post(
+            "/subscribe/bulk",
+            content=body,
+            headers={"content-type": "application/x-ndjson"},
+        )
+        r.raise_for_status()
+
+        async with httpx.AsyncClient(base_url=stubs_url) as stubs:
+            received_before = (await stubs.get("/alert/count")).json()["received"]
+            now = datetime.now()
+            start = time.perf_counter()
+            r = await client.post(
+                "/alertUsers",
+                json={
+                    "id": int(time.time()),
+                    "segment_id": 1,
+                    "severity": 1.0,
+                    "probability": 0.9,
+                    "start_date": now.isoformat(),
+                    "end_date": (now + timedelta(hours=6)).isoformat(),
+                },
+            )
+            r.raise_for_status()
+            enqueued = time.perf_counter() - start
+            queued = r.json()["alerts_queued"]
+
+            while True:
+                stats = (await client.get("/outbox/stats")).json()
+                if stats["pending"] == 0:
+                    break
+                await asyncio.sleep(0.05)
+            elapsed = time.perf_counter() - start
+            received = (await stubs.get("/alert/count")).json()["received"] - received_before
+
+    return {
+        "users": users,
+        "alerts_queued": queued,
+        "enqueue_ms": enqueued * 1000,
+        "fanout_s": elapsed,
+        "received": received,
+        "failed": stats["failed"],
+        "alerts_per_s": queued / elapsed,
+    }
+
+
+async def bench_estimate(repeats: int) -> dict:
+    """
+    CPU time of estimate_outlet_flow_rate in this process, rainfall fetches
+    excluded as far as possible since they mostly wait on the network.
+    """
+    sys.path.insert(0, str(SERVICES / "flow-prediction"))
+    from app.predict.compute_flow_rate import estimate_outlet_flow_rate
+    from app.predict.predict_flow_rate import BIN_SIZE, MAX_TRAVEL_TIME
+
+    now = datetime.now().replace(minute=0, second=0, microsecond=0)
+    cpu, wall = [], []
+    async with httpx.AsyncClient(timeout=300) as client:
+        for i in range(repeats):
+            cpu_start, wall_start = time.process_time(), time.perf_counter()
+            await estimate_outlet_flow_rate(
+                outlet_time=now + timedelta(hours=i),
+                bin_size_hours=BIN_SIZE,
+                max_travel_time_hours=MAX_TRAVEL_TIME,
+                client=client,
+            )
+            cpu.append(time.process_time() - cpu_start)
+            wall.append(time.perf_counter() - wall_start)
+    return {
+        "repeats": repeats,
+        "cpu_ms_mean": sum(cpu) / len(cpu) * 1000,
+        "cpu_ms_min": min(cpu) * 1000,
+        "wall_ms_mean": sum(wall) / len(wall) * 1000,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--base-port", type=int, default=8100)
+    parser.add_argument("--wcs-latency-ms", type=float, default=200.0)
+    parser.add_argument("--hubeau-latency-ms", type=float, default=100.0)
+    parser.add_argument("--alert-latency-ms", type=float, default=20.0)
+    parser.add_argument("--recordings", type=Path, help="Recorded responses for the stubs")
+    parser.add_argument(
+        "--watershed-dir",
+        type=Path,
+        help="Directory with garonne/dist.tiff, a synthetic watershed is used if unset",
+    )
+    parser.add_argument("--flow-requests", type=int, default=50)
+    parser.add_argument(
+        "--rainfall-requests",
+        type=int,
+        default=60,
+        help="Per hit ratio, more than 80 makes weather-data evict cached periods",
+    )
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--alert-users", type=int, default=1000)
+    parser.add_argument("--estimate-repeats", type=int, default=5)
+    parser.add_argument("--keep-workdir", action="store_true")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="floodcast-bench-"))
+    watershed_dir = args.watershed_dir
+    if watershed_dir is None:
+        watershed_dir = workdir / "watershed"
+        synthetic_watershed(watershed_dir)
+
+    services = Services(workdir, args.base_port)
+    stubs_url = services.url(STUBS)
+    services.env.update({
+        "CONFIG_SERVER_URL": services.url(CONFIG),
+        "CONFIG_CACHE_DIR": str(workdir / "config"),
+        "METEO_FRANCE_AROME_BASE_URL": f"{stubs_url}/wcs",
+        "METEO_FRANCE_AROME_API_KEY": os.environ.get("METEO_FRANCE_AROME_API_KEY", "benchmark"),
+        "CACHE_DIR": str(workdir / "weather-cache"),
+        "HUBEAU_BASE_URL": f"{stubs_url}/hubeau",
+        "WEATHER_DATA_URL": services.url(WEATHER),
+        "FLOW_DATA_URL": services.url(FLOW_DATA),
+        "WATERSHED_DIR": str(watershed_dir),
+        "ALERT_RECEIVER_PORT": str(args.base_port + STUBS),
+    })
+    # estimate_outlet_flow_rate runs in this process
+    os.environ.update(services.env)
+
+    stub_args = [
+        str(Path(__file__).parent / "stubs.py"),
+        "--wcs-latency-ms", str(args.wcs_latency_ms),
+        "--hubeau-latency-ms", str(args.hubeau_latency_ms),
+        "--alert-latency-ms", str(args.alert_latency_ms),
+    ]
+    if args.recordings:
+        stub_args += ["--recordings", str(args.recordings)]
+
+    results: dict = {
+        "date": datetime.now().isoformat(),
+        "machine": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "parameters": {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()},
+    }
+    try:
+        services.start("stubs", stub_args, STUBS)
+        await services.wait_ready(STUBS)
+        services.start_service("config-server", CONFIG)
+        await services.wait_ready(CONFIG)
+        for name, offset in (
+            ("weather-data", WEATHER),
+            ("flow-data", FLOW_DATA),
+            ("flow-prediction", PREDICTION),
+            ("alert", ALERT),
+        ):
+            services.start_service(name, offset)
+        for offset in (WEATHER, FLOW_DATA, PREDICTION, ALERT):
+            await services.wait_ready(offset)
+
+        results["flow"] = await bench_flow(
+            services.url(PREDICTION), args.flow_requests, args.concurrency
+        )
+        periods = unique_periods()
+        results["rainfall"] = [
+            await bench_rainfall(
+                services.url(WEATHER),
+                args.rainfall_requests,
+                args.concurrency,
+                ratio,
+                periods,
+            )
+            for ratio in CACHE_HIT_RATIOS
+        ]
+        results["alert"] = await bench_alert(
+            services.url(ALERT), stubs_url, args.alert_users
+        )
+        results["estimate_outlet_flow_rate"] = await bench_estimate(args.estimate_repeats)
+    finally:
+        services.stop()
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
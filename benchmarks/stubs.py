@@ -0,0 +1,207 @@
+"""
+Local stand-ins for the external services, for benchmarks.
+
+Serves on a single port:
+- /wcs/GetCapabilities and /wcs/GetCoverage, like Météo-France's AROME WCS
+- /hubeau/referentiel/sites and /hubeau/observations_tr, like Hub'Eau hydrometrie
+- /alert, an alert receiver counting what it gets
+
+Responses are synthetic, or replayed from --recordings, and delayed by the
+configured latencies. Run on its own with:
+
+    uv run --package flow-prediction python benchmarks/stubs.py --port 8090
+"""
+
+import argparse
+import asyncio
+import hashlib
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from rasterio.io import MemoryFile
+from rasterio.transform import from_origin
+
+# Forecast runs advertised by GetCapabilities: every RUN_INTERVAL over RUN_HISTORY
+RUN_INTERVAL = timedelta(hours=3)
+RUN_HISTORY = timedelta(days=4)
+# Accumulation periods advertised for each run
+PERIODS = [1, 2, 3, 6, 12, 24]
+
+# Rainfall grid, roughly the Garonne basin at AROME's 0.025° resolution
+GRID_WEST, GRID_NORTH = -1.0, 45.5
+GRID_STEP = 0.025
+GRID_WIDTH, GRID_HEIGHT = 240, 160
+# Distinct synthetic rainfall fields, picked by a hash of the request
+COVERAGE_VARIANTS = 16
+
+# Garonne at Portet-sur-Garonne
+SITE = {
+    "code_site": "O200004001",
+    "longitude_site": 1.411743,
+    "latitude_site": 43.520681,
+    "libelle_cours_eau": "La Garonne",
+}
+
+WCS_NAMESPACE = "http://www.opengis.net/wcs/2.0"
+COVERAGE_ID = "TOTAL_WATER_PRECIPITATION__GROUND_OR_WATER_SURFACE___{run}_PT{hours}H"
+
+
+def capabilities_xml(now: datetime) -> bytes:
+    latest = now.replace(minute=0, second=0, microsecond=0)
+    latest -= timedelta(hours=latest.hour % 3)
+    ids = []
+    run = latest - RUN_HISTORY
+    while run <= latest:
+        for hours in PERIODS:
+            coverage_id = COVERAGE_ID.format(
+                run=run.strftime("%Y-%m-%dT%H.%M.%SZ"), hours=hours
+            )
+            ids.append(
+                f"<wcs:CoverageSummary><wcs:CoverageId>{coverage_id}</wcs:CoverageId></wcs:CoverageSummary>"
+            )
+        run += RUN_INTERVAL
+    return (
+        f'<?xml version="1.0" encoding="UTF-8"?>'
+        f'<wcs:Capabilities xmlns:wcs="{WCS_NAMESPACE}"><wcs:Contents>'
+        + "".join(ids)
+        + "</wcs:Contents></wcs:Capabilities>"
+    ).encode()
+
+
+def coverage_tiff(seed: int) -> bytes:
+    """
+    Smooth random rainfall (kg/m²) as an EPSG:4326 GeoTIFF.
+    """
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:GRID_HEIGHT, 0:GRID_WIDTH]
+    rain = np.zeros((GRID_HEIGHT, GRID_WIDTH), dtype=np.float32)
+    for _ in range(6):
+        cy, cx = rng.uniform(0, GRID_HEIGHT), rng.uniform(0, GRID_WIDTH)
+        radius = rng.uniform(5, 40)
+        rain += rng.uniform(0.5, 10) * np.exp(
+            -((y - cy) ** 2 + (x - cx) ** 2) / radius**2
+        )
+    with MemoryFile() as memfile:
+        with memfile.open(
+            driver="GTiff",
+            width=GRID_WIDTH,
+            height=GRID_HEIGHT,
+            count=1,
+            dtype="float32",
+            crs="EPSG:4326",
+            transform=from_origin(GRID_WEST, GRID_NORTH, GRID_STEP, GRID_STEP),
+        ) as ds:
+            ds.write(rain, 1)
+        return memfile.read()
+
+
+def observations(now: datetime, measure: str | None) -> dict:
+    data = []
+    for grandeur, value in (("Q", 180_000.0), ("H", 1_450.0)):
+        if measure is not None and measure != grandeur:
+            continue
+        for minutes in (5, 10, 15):
+            data.append(
+                {
+                    "code_site": SITE["code_site"],
+                    "longitude": SITE["longitude_site"],
+                    "latitude": SITE["latitude_site"],
+                    "date_obs": (now - timedelta(minutes=minutes)).isoformat() + "Z",
+                    "grandeur_hydro": grandeur,
+                    "resultat_obs": value,
+                }
+            )
+    return {"count": len(data), "data": data}
+
+
+def create_app(
+    wcs_latency: float = 0.0,
+    hubeau_latency: float = 0.0,
+    alert_latency: float = 0.0,
+    recordings: Path | None = None,
+) -> FastAPI:
+    """
+    Latencies are in seconds. Files in recordings replace the synthetic
+    responses: capabilities.xml, coverage.tiff and observations_tr.json.
+    """
+    app = FastAPI()
+    latencies = {"/wcs": wcs_latency, "/hubeau": hubeau_latency, "/alert": alert_latency}
+    recorded = {}
+    if recordings is not None:
+        for name in ("capabilities.xml", "coverage.tiff", "observations_tr.json"):
+            if (recordings / name).is_file():
+                recorded[name] = (recordings / name).read_bytes()
+    coverages = [coverage_tiff(seed) for seed in range(COVERAGE_VARIANTS)]
+    app.state.alerts_received = 0
+
+    @app.middleware("http")
+    async def add_latency(request: Request, call_next):
+        for prefix, latency in latencies.items():
+            if request.url.path.startswith(prefix) and latency:
+                await asyncio.sleep(latency)
+        return await call_next(request)
+
+    @app.get("/")
+    async def root():
+        return {"message": "Hello from benchmark stubs!"}
+
+    @app.get("/wcs/GetCapabilities")
+    async def get_capabilities():
+        body = recorded.get("capabilities.xml") or capabilities_xml(datetime.now())
+        return Response(body, media_type="application/xml")
+
+    @app.get("/wcs/GetCoverage")
+    async def get_coverage(request: Request):
+        body = recorded.get("coverage.tiff")
+        if body is None:
+            digest = hashlib.sha256(str(request.url.query).encode()).digest()
+            body = coverages[digest[0] % COVERAGE_VARIANTS]
+        return Response(body, media_type="image/tiff")
+
+    @app.get("/hubeau/referentiel/sites")
+    async def get_sites():
+        return {"count": 1, "data": [SITE]}
+
+    @app.get("/hubeau/observations_tr")
+    async def get_observations(grandeur_hydro: str | None = None):
+        if "observations_tr.json" in recorded:
+            return Response(recorded["observations_tr.json"], media_type="application/json")
+        return observations(datetime.now(), grandeur_hydro)
+
+    @app.post("/alert")
+    async def receive_alert():
+        app.state.alerts_received += 1
+        return {"status": "received"}
+
+    @app.get("/alert/count")
+    async def alert_count():
+        return {"received": app.state.alerts_received}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--wcs-latency-ms", type=float, default=200.0)
+    parser.add_argument("--hubeau-latency-ms", type=float, default=100.0)
+    parser.add_argument("--alert-latency-ms", type=float, default=20.0)
+    parser.add_argument(
+        "--recordings", type=Path, help="Directory of recorded responses to replay"
+    )
+    args = parser.parse_args()
+
+    app = create_app(
+        wcs_latency=args.wcs_latency_ms / 1000,
+        hubeau_latency=args.hubeau_latency_ms / 1000,
+        alert_latency=args.alert_latency_ms / 1000,
+        recordings=args.recordings,
+    )
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+from collections.abc import Callable
+from contextlib import suppress
+from typing import Self
+
+import httpx
+from pydantic import BaseModel, ValidationError
+
+logger = logging.getLogger("floodcast.config")
+
+DEFAULT_CONFIG_SERVER_URL = "http://config-service:8000"
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "floodcast-config")
+
+# Time the config server holds a watch request before answering 304, in seconds
+WATCH_TIMEOUT = 60.0
+# Timeout of the startup fetch, after which the copy on disk is used
+STARTUP_TIMEOUT = 5.0
+# Startup attempts when there is no copy on disk to fall back to
+STARTUP_ATTEMPTS = 10
+MAX_RETRY_DELAY = 60.0
+
+
+class ConfigUnavailable(Exception):
+    pass
+
+
+class ConfigClient[M: BaseModel]:
+    """
+    Config of one service, fetched from the config server when the app starts
+    and refreshed in the background as soon as it changes.
+
+    The last config received is saved to disk, and used when the config server
+    cannot be reached at startup. A config that does not validate is logged and
+    ignored, keeping the current one.
+
+    Settings read from `current` on each use are live. Objects built from the
+    config at startup, e.g. connection pools, are rebuilt by on_change
+    listeners, or need a restart.
+    """
+
+    def __init__(
+        self,
+        service_name: str,
+        model: type[M],
+        base_url: str | None = None,
+        cache_dir: str | None = None,
+    ) -> None:
+        self.service_name = service_name
+        self.model = model
+        self.base_url = base_url or os.environ.get(
+            "CONFIG_SERVER_URL", DEFAULT_CONFIG_SERVER_URL
+        )
+        self.cache_path = os.path.join(
+            cache_dir or os.environ.get("CONFIG_CACHE_DIR", DEFAULT_CACHE_DIR),
+            f"{service_name}.json",
+        )
+        self.etag: str | None = None
+        self._current: M | None = None
+        self._client: httpx.AsyncClient | None = None
+        self._watcher: asyncio.Task | None = None
+        self._listeners: list[Callable[[M, M], None]] = []
+
+    @property
+    def current(self) -> M:
+        if self._current is None:
+            raise RuntimeError(
+                f"Config of {self.service_name} used before the config client was started"
+            )
+        return self._current
+
+    async def start(self):
+        """
+        Load the config, then start watching for changes. Meant for the app
+        lifespan, so that no request ever waits on the config server.
+        """
+        self._client = httpx.AsyncClient(base_url=self.base_url)
+        self.load_cached()
+        try:
+            await self.fetch_initial()
+        except BaseException:
+            await self._client.aclose()
+            raise
+        self._watcher = asyncio.create_task(
+            self.watch(), name=f"config-watch-{self.service_name}"
+        )
+
+    def on_change(self, listener: Callable[[M, M], None]):
+        """
+        Call listener(old, new) after each config change received by watch().
+        """
+        self._listeners.append(listener)
+
+    async def stop(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._watcher
+        if self._client is not None:
+            await self._client.aclose()
+
+    async def __aenter__(self) -> Self:
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    def load_cached(self):
+        """
+        Use the last known good config saved on disk, if any.
+        """
+        try:
+            with open(self.cache_path, "r") as f:
+                data = json.load(f)
+            self._current = self.model.model_validate(data["config"])
+            self.etag = data["etag"]
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Ignoring cached config %s: %r", self.cache_path, e)
+
+    def save_cached(self, config: dict):
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.cache_path))
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"etag": self.etag, "config": config}, f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            logger.warning("Could not save config to %s: %r", self.cache_path, e)
+            with suppress(OSError):
+                os.unlink(tmp_path)
+
+    async def fetch_initial(self):
+        """
+        Fetch the config, revalidating the copy on disk if there is one. When the
+        config server is unreachable, fall back to that copy or keep retrying.
+        """
+        delay = 1.0
+        for attempt in range(1, STARTUP_ATTEMPTS + 1):
+            try:
+                r = await self._client.get(
+                    f"/config/{self.service_name}",
+                    headers={"If-None-Match": self.etag} if self.etag else None,
+                    timeout=STARTUP_TIMEOUT,
+                )
+                self.apply(r)
+                return
+            except (httpx.HTTPError, ValueError) as e:
+                if self._current is not None:
+                    logger.warning(
+                        "Could not fetch config of %s, using the copy on disk: %r",
+                        self.service_name,
+                        e,
+                    )
+                    return
+                if attempt == STARTUP_ATTEMPTS:
+                    raise ConfigUnavailable(
+                        f"Could not fetch config of {self.service_name}"
+                    ) from e
+                logger.warning(
+                    "Could not fetch config of %s (attempt %d): %r",
+                    self.service_name,
+                    attempt,
+                    e,
+                )
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+
+    def apply(self, r: httpx.Response) -> bool:
+        """
+        Apply a config server response. Returns whether the config changed.
+        """
+        if r.status_code == 304:
+            return False
+        r.raise_for_status()
+        data = r.json()["config"]
+        etag = r.headers.get("etag")
+        try:
+            config = self.model.model_validate(data)
+        except ValidationError:
+            # Do not ask for the same broken config again
+            self.etag = etag
+            raise
+        old, self._current = self._current, config
+        self.etag = etag
+        self.save_cached(data)
+        if old is not None:
+            for listener in self._listeners:
+                try:
+                    listener(old, config)
+                except Exception:
+                    logger.exception("Config listener of %s failed", self.service_name)
+        return True
+
+    async def watch(self):
+        """
+        Long poll the config server for changes, for as long as the app runs.
+        """
+        delay = 1.0
+        while True:
+            try:
+                r = await self._client.get(
+                    f"/config/{self.service_name}/watch",
+                    params={"etag": self.etag or "", "timeout": WATCH_TIMEOUT},
+                    timeout=WATCH_TIMEOUT + 10,
+                )
+                if self.apply(r):
+                    logger.info("Config of %s updated", self.service_name)
+                delay = 1.0
+            except ValueError as e:
+                logger.error(
+                    "Invalid config for %s, keeping the current one: %s",
+                    self.service_name,
+                    e,
+                )
+                await asyncio.sleep(delay)
+            except httpx.HTTPError as e:
+                logger.warning(
+                    "Watching config of %s failed, retrying in %.0fs: %r",
+                    self.service_name,
+                    delay,
+                    e,
+                )
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
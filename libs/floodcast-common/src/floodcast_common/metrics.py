@@ -0,0 +1,185 @@
+import os
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+METRICS_PATH = "/metrics"
+# Set when a service runs several worker processes: metrics are then written to
+# files in this directory by every worker, and each scrape sums them. Read by
+# prometheus_client when metrics are created, it must be empty at startup.
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+# Buckets from 5ms to 1 minute, for requests that may wait on slow upstreams
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)  # fmt: skip
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time to handle a request, including streaming the response body.",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+UPSTREAM_LATENCY = Histogram(
+    "upstream_request_duration_seconds",
+    "Time of calls to other services, until the response headers are received.",
+    ["upstream", "operation", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+STAGE_LATENCY = Histogram(
+    "stage_duration_seconds",
+    "Time spent in a stage of a computation.",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+CACHE_EVENTS = Counter(
+    "cache_events_total",
+    "Cache lookups and evictions, by event: hit, miss, stale, coalesced, eviction.",
+    ["cache", "event"],
+)
+
+
+class MetricsMiddleware:
+    """
+    Observe the duration of every HTTP request, labelled with its route template
+    rather than its path so that the number of series stays bounded.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["path"] == METRICS_PATH:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_LATENCY.labels(scope["method"], route, str(status)).observe(
+                time.perf_counter() - start
+            )
+
+
+# Collectors computing their values when scraped, which only see the process
+# answering the scrape
+_process_collectors: list[Collector] = []
+
+
+def scrape_registry() -> CollectorRegistry:
+    """
+    Metrics of every worker in multiprocess mode, else of this process.
+    """
+    if not MULTIPROC_DIR:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    for collector in _process_collectors:
+        registry.register(collector)
+    return registry
+
+
+async def metrics_endpoint(request: Request) -> Response:
+    return Response(generate_latest(scrape_registry()), media_type=CONTENT_TYPE_LATEST)
+
+
+def instrument(app: Starlette):
+    """
+    Time every request and serve the metrics on /metrics. Call right after
+    creating the app, so that /metrics comes before any catch-all route.
+    """
+    app.add_middleware(MetricsMiddleware)
+    app.add_route(METRICS_PATH, metrics_endpoint, include_in_schema=False)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Time a stage of a computation, e.g. stage("reproject").
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.labels(name).observe(time.perf_counter() - start)
+
+
+@contextmanager
+def upstream_call(upstream: str, operation: str) -> Iterator[None]:
+    """
+    Time a call to another service, labelled ok or error depending on whether
+    the block raised.
+    """
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        UPSTREAM_LATENCY.labels(upstream, operation, outcome).observe(
+            time.perf_counter() - start
+        )
+
+
+class _LruCacheCollector(Collector):
+    def __init__(self, name: str, cache_info: Callable) -> None:
+        self.name = name
+        self.cache_info = cache_info
+
+    def collect(self):
+        info = self.cache_info()
+        # In multiprocess mode, these are the statistics of the worker
+        # answering the scrape, told apart by their pid
+        labels, values = ["cache"], [self.name]
+        if MULTIPROC_DIR:
+            labels.append("pid")
+            values.append(str(os.getpid()))
+        hits = CounterMetricFamily(
+            "lru_cache_hits", "Hits of an in-process LRU cache.", labels=labels
+        )
+        hits.add_metric(values, info.hits)
+        misses = CounterMetricFamily(
+            "lru_cache_misses", "Misses of an in-process LRU cache.", labels=labels
+        )
+        misses.add_metric(values, info.misses)
+        size = GaugeMetricFamily(
+            "lru_cache_size", "Entries in an in-process LRU cache.", labels=labels
+        )
+        size.add_metric(values, info.currsize)
+        return [hits, misses, size]
+
+
+def register_lru_cache(name: str, cached: Callable):
+    """
+    Export the statistics of a functools.lru_cache or async_lru.alru_cache
+    function. They are read when scraped, so lookups cost nothing extra.
+    """
+    collector = _LruCacheCollector(name, cached.cache_info)  # pyright: ignore[reportFunctionMemberAccess]
+    REGISTRY.register(collector)
+    _process_collectors.append(collector)
@@ -0,0 +1,192 @@
+"""
+Compact transfer format for single band rasters, for the rainfall hand-off
+between weather-data and flow-prediction. Requires the raster extra.
+
+    magic (4 bytes) | header length (uint32 LE) | JSON header | array
+
+The JSON header holds the dtype, shape, affine transform, CRS (WKT), nodata
+and the scale of quantized values, and is padded so that the array starts on
+an 8 byte boundary. The array is raw row-major little-endian, optionally
+zlib-compressed, so that it decodes with np.frombuffer without any copy.
+"""
+
+import json
+import struct
+import zlib
+from dataclasses import dataclass
+from typing import Literal
+
+import numpy as np
+
+MEDIA_TYPE = "application/vnd.floodcast.raster"
+MAGIC = b"FCR1"
+_PREFIX = struct.Struct("<4sI")
+_ALIGNMENT = 8
+
+# Quantized values are multiples of at least this step
+MIN_STEP = 0.01
+INT16_NODATA = np.iinfo(np.int16).min
+
+Dtype = Literal["float32", "int16"]
+Compression = Literal["zlib"] | None
+
+
+@dataclass(frozen=True)
+class RasterArray:
+    # Read-only when decoded
+    array: np.ndarray
+    # Affine coefficients a, b, c, d, e, f
+    transform: tuple[float, float, float, float, float, float]
+    crs: str
+    nodata: float | None
+    # Values are array * scale
+    scale: float = 1.0
+
+    @property
+    def height(self) -> int:
+        return self.array.shape[0]
+
+    @property
+    def width(self) -> int:
+        return self.array.shape[1]
+
+    def values(self) -> np.ndarray:
+        """
+        Values as float32, NaN at nodata.
+        """
+        values = self.array.astype(np.float32) * np.float32(self.scale)
+        if self.nodata is not None:
+            values[self.array == self.nodata] = np.nan
+        return values
+
+
+@dataclass(frozen=True)
+class Encoding:
+    dtype: Dtype = "float32"
+    compression: Compression = None
+
+    @property
+    def media_type(self) -> str:
+        return (
+            f"{MEDIA_TYPE}; dtype={self.dtype}; "
+            f"compression={self.compression or 'none'}"
+        )
+
+
+def from_geotiff(data: bytes) -> RasterArray:
+    """
+    First band of a GeoTIFF.
+    """
+    # GDAL takes a while to load, only when needed
+    from rasterio.io import MemoryFile  # pyright: ignore[reportMissingTypeStubs]
+
+    with MemoryFile(data) as memfile, memfile.open() as dataset:
+        return RasterArray(
+            array=dataset.read(1),
+            transform=tuple(dataset.transform)[:6],
+            crs=dataset.crs.to_wkt(),
+            nodata=dataset.nodata,
+        )
+
+
+def quantize(raster: RasterArray) -> RasterArray:
+    """
+    Round values to int16, in steps of MIN_STEP unless the largest value
+    needs a coarser one, with INT16_NODATA as nodata.
+    """
+    values = raster.values()
+    valid = ~np.isnan(values)
+    largest = float(np.abs(values[valid]).max()) if valid.any() else 0.0
+    step = max(MIN_STEP, largest / np.iinfo(np.int16).max)
+    quantized = np.full(values.shape, INT16_NODATA, dtype=np.int16)
+    quantized[valid] = np.round(values[valid] / step)
+    return RasterArray(
+        array=quantized,
+        transform=raster.transform,
+        crs=raster.crs,
+        nodata=INT16_NODATA,
+        scale=step,
+    )
+
+
+def encode(raster: RasterArray, encoding: Encoding = Encoding()) -> bytes:
+    if encoding.dtype == "int16":
+        raster = quantize(raster)
+        dtype = np.dtype("<i2")
+    else:
+        dtype = np.dtype("<f4")
+
+    payload = np.ascontiguousarray(raster.array, dtype=dtype).tobytes()
+    if encoding.compression == "zlib":
+        payload = zlib.compress(payload, 1)
+
+    header = json.dumps(
+        {
+            "dtype": dtype.str,
+            "shape": raster.array.shape,
+            "transform": raster.transform,
+            "crs": raster.crs,
+            "nodata": raster.nodata,
+            "scale": raster.scale,
+            "compression": encoding.compression,
+        }
+    ).encode()
+    header += b" " * (-(_PREFIX.size + len(header)) % _ALIGNMENT)
+    return _PREFIX.pack(MAGIC, len(header)) + header + payload
+
+
+def decode(data: bytes) -> RasterArray:
+    magic, header_length = _PREFIX.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a floodcast raster")
+    offset = _PREFIX.size + header_length
+    header = json.loads(data[_PREFIX.size : offset])
+
+    payload = memoryview(data)[offset:]
+    if header["compression"] == "zlib":
+        payload = zlib.decompress(payload)
+    elif header["compression"] is not None:
+        raise ValueError(f"Unknown compression {header['compression']}")
+
+    return RasterArray(
+        array=np.frombuffer(payload, dtype=header["dtype"]).reshape(header["shape"]),
+        transform=tuple(header["transform"]),
+        crs=header["crs"],
+        nodata=header["nodata"],
+        scale=header["scale"],
+    )
+
+
+def accepted_encoding(accept: str | None) -> Encoding | None:
+    """
+    Encoding requested by an Accept header, if MEDIA_TYPE is preferred to
+    GeoTIFF. Its dtype and compression parameters default to float32 and none.
+    """
+    best: tuple[float, Encoding] | None = None
+    other_q = 0.0
+    for media_range in (accept or "").split(","):
+        media_type, *params = (p.strip() for p in media_range.split(";"))
+        values = {
+            k.strip().lower(): v.strip()
+            for k, _, v in (p.partition("=") for p in params)
+        }
+        try:
+            q = float(values.pop("q", 1))
+        except ValueError:
+            continue
+        if media_type.lower() != MEDIA_TYPE:
+            other_q = max(other_q, q)
+            continue
+        dtype = values.get("dtype", "float32")
+        compression = values.get("compression", "none")
+        if dtype not in ("float32", "int16") or compression not in ("zlib", "none"):
+            continue
+        encoding = Encoding(
+            dtype=dtype,  # pyright: ignore[reportArgumentType]
+            compression=None if compression == "none" else "zlib",
+        )
+        if q > 0 and (best is None or q > best[0]):
+            best = (q, encoding)
+    if best is None or best[0] < other_q:
+        return None
+    return best[1]
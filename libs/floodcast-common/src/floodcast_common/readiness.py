@@ -0,0 +1,66 @@
+import asyncio
+import time
+from collections.abc import Awaitable
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+
+class Readiness:
+    """
+    Serves /ready for Kubernetes readiness probes.
+
+    Expensive initialization, e.g. loading a model, is started as warm-up
+    tasks from the app lifespan, so that the service is up and live as soon
+    as its modules are imported. /ready answers 503 until every warm-up task
+    is done, and for good if one of them failed.
+    """
+
+    def __init__(self) -> None:
+        self.tasks: dict[str, asyncio.Task[object]] = {}
+
+    def install(self, app: Starlette):
+        app.add_route("/ready", self.endpoint, ["GET"], include_in_schema=False)
+
+    def warm_up(self, name: str, awaitable: Awaitable[object]):
+        """
+        Run awaitable in the background, e.g. asyncio.to_thread(load_model).
+        """
+        start = time.perf_counter()
+
+        def done(task: asyncio.Task[object]):
+            if task.cancelled():
+                return
+            if task.exception() is not None:
+                print(f"[READY][ERROR] {name} failed: {task.exception()!r}")
+            else:
+                print(f"[READY] {name} in {time.perf_counter() - start:.2f} s")
+
+        task = asyncio.ensure_future(awaitable)
+        task.add_done_callback(done)
+        self.tasks[name] = task
+
+    @property
+    def ready(self) -> bool:
+        return all(
+            t.done() and not t.cancelled() and t.exception() is None
+            for t in self.tasks.values()
+        )
+
+    async def stop(self):
+        for task in self.tasks.values():
+            task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+
+    async def endpoint(self, request: Request) -> JSONResponse:
+        pending = [name for name, t in self.tasks.items() if not t.done()]
+        failed = [
+            name
+            for name, t in self.tasks.items()
+            if t.done() and (t.cancelled() or t.exception() is not None)
+        ]
+        return JSONResponse(
+            {"ready": self.ready, "pending": pending, "failed": failed},
+            status_code=200 if self.ready else 503,
+        )
@@ -0,0 +1,31 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+WORKER = """
+from floodcast_common.metrics import CACHE_EVENTS
+CACHE_EVENTS.labels("test", "hit").inc({hits})
+"""
+
+SCRAPE = """
+from prometheus_client import generate_latest
+from floodcast_common.metrics import scrape_registry
+print(generate_latest(scrape_registry()).decode())
+"""
+
+
+def run(code: str, multiproc_dir: Path) -> str:
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(multiproc_dir)}
+    return subprocess.run(
+        [sys.executable, "-c", code], env=env, check=True, capture_output=True, text=True
+    ).stdout
+
+
+def test_scrape_sums_the_metrics_of_every_worker(tmp_path: Path):
+    run(WORKER.format(hits=2), tmp_path)
+    run(WORKER.format(hits=3), tmp_path)
+
+    scraped = run(SCRAPE, tmp_path)
+
+    assert 'cache_events_total{cache="test",event="hit"} 5.0' in scraped
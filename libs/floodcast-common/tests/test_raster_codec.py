@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from floodcast_common.raster_codec import (
+    INT16_NODATA,
+    MIN_STEP,
+    Encoding,
+    RasterArray,
+    decode,
+    encode,
+)
+
+TRANSFORM = (1000.0, 0.0, 500_000.0, 0.0, -1000.0, 6_300_000.0)
+CRS = 'LOCAL_CS["test"]'
+
+
+def rainfall(nodata: float | None) -> RasterArray:
+    rng = np.random.default_rng(0)
+    array = rng.gamma(0.5, 4, (10, 10)).astype(np.float32)
+    array[:3] = np.nan if nodata is None else nodata
+    return RasterArray(array=array, transform=TRANSFORM, crs=CRS, nodata=nodata)
+
+
+@pytest.mark.parametrize("nodata", [None, -9999.0])
+@pytest.mark.parametrize(
+    "encoding",
+    [
+        Encoding(),
+        Encoding(compression="zlib"),
+        Encoding(dtype="int16"),
+        Encoding(dtype="int16", compression="zlib"),
+    ],
+)
+def test_round_trip_keeps_nodata(nodata: float | None, encoding: Encoding):
+    raster = rainfall(nodata)
+    decoded = decode(encode(raster, encoding))
+
+    assert decoded.transform == TRANSFORM
+    assert decoded.crs == CRS
+    expected = raster.values()
+    values = decoded.values()
+    np.testing.assert_array_equal(np.isnan(values), np.isnan(expected))
+    atol = MIN_STEP / 2 if encoding.dtype == "int16" else 0
+    np.testing.assert_allclose(values, expected, atol=atol, equal_nan=True)
+    if encoding.dtype == "int16":
+        assert decoded.nodata == INT16_NODATA
+        assert (decoded.array[:3] == INT16_NODATA).all()
@@ -0,0 +1,111 @@
+from pathlib import Path
+import argparse
+import math
+import numpy as np
+import rasterio
+from rasterio.transform import Affine
+
+RESOLUTIONS = [100, 250, 500, 1000]
+
+
+def travel_hours(dist: np.ndarray) -> np.ndarray:
+    """
+    Travel time to the outlet in whole hours, -1 outside the watershed.
+    """
+    hours = np.full(dist.shape, -1, dtype=np.int32)
+    inside = np.isfinite(dist) & (dist >= 0)
+    hours[inside] = dist[inside] // 3600
+    return hours
+
+
+def build_level(dist_path: Path, resolution: int, out: Path):
+    """
+    Aggregate a travel time raster into a coarser grid of resolution meters,
+    with one band per travel hour. Band h holds the area (m²) of each coarse
+    cell whose travel time is in [h, h + 1) hours, so the area reaching the
+    outlet each hour is the same at every level.
+    """
+    with rasterio.open(dist_path) as src:
+        dist = src.read(1, masked=True).filled(np.nan)
+        profile = src.profile
+        transform = src.transform
+
+    cell_size = abs(transform.a)
+    factor = resolution / cell_size
+    if factor != int(factor) or factor < 1:
+        raise ValueError(
+            f"Resolution {resolution}m is not a multiple of the {cell_size}m input"
+        )
+    factor = int(factor)
+    pixel_area = abs(transform.a * transform.e)
+    height = math.ceil(dist.shape[0] / factor)
+    width = math.ceil(dist.shape[1] / factor)
+
+    hours = travel_hours(dist)
+    del dist
+    rows, cols = np.nonzero(hours >= 0)
+    hours = hours[rows, cols]
+    coarse_index = (rows // factor) * width + (cols // factor)
+    del rows, cols
+
+    order = np.argsort(hours, kind="stable")
+    hours, coarse_index = hours[order], coarse_index[order]
+    n_hours = int(hours[-1]) + 1 if hours.size else 0
+    offsets = np.searchsorted(hours, np.arange(n_hours + 1))
+
+    profile.update(
+        driver="GTiff",
+        count=n_hours,
+        dtype="float32",
+        nodata=None,
+        width=width,
+        height=height,
+        transform=transform * Affine.scale(factor),
+        tiled=True,
+        blockxsize=256,
+        blockysize=256,
+        compress="deflate",
+        interleave="band",
+    )
+    with rasterio.open(out, "w", **profile) as dst:
+        for h in range(n_hours):
+            area = np.bincount(
+                coarse_index[offsets[h] : offsets[h + 1]], minlength=width * height
+            ) * pixel_area
+            dst.write(area.reshape(height, width).astype(np.float32), h + 1)
+            dst.set_band_description(h + 1, f"area {h}h-{h + 1}h (m2)")
+
+    print(f"{out}: {width}x{height}, {n_hours} hours, {pixel_area * hours.size / 1e6:.1f}km2")
+
+
+def build_pyramid(dist_path: Path, resolutions: list[int]):
+    """
+    Write {stem}-{resolution}m.tiff next to dist_path for each resolution.
+    """
+    for resolution in resolutions:
+        build_level(
+            dist_path,
+            resolution,
+            dist_path.with_name(f"{dist_path.stem}-{resolution}m.tiff"),
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Aggregate a travel time raster into per-hour area rasters at coarser resolutions."
+    )
+    parser.add_argument("dist", type=Path, help="Path to the travel time file")
+    parser.add_argument(
+        "resolutions",
+        type=int,
+        nargs="*",
+        default=RESOLUTIONS,
+        help="Output resolutions in meters, multiples of the input resolution",
+    )
+    args = parser.parse_args()
+
+    build_pyramid(args.dist, args.resolutions)
+
+
+if __name__ == "__main__":
+    main()
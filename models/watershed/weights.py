@@ -1,7 +1,13 @@
+from collections.abc import Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from dataclasses import dataclass
 from pathlib import Path
 import argparse
+import math
+import os
 import numpy as np
 import rasterio
+from rasterio.windows import Window
 
 # Constants
 CHANNEL_ACCUMULATION = 100
@@ -10,39 +16,163 @@ N_HILL = 0.12
 R_CHANNEL = 1.0
 H_HILL = 0.02
 
+# Tiles processed at once per worker, bounds memory use
+IN_FLIGHT_PER_WORKER = 2
+# Block size of the output GeoTIFF, a multiple of 16
+OUTPUT_BLOCK = 256
+
+# Rasters opened once per worker process
+_slope_src = None
+_facc_src = None
+
+
+@dataclass
+class VelocityStats:
+    """
+    Running sums of velocities, to compute averages tile by tile.
+    """
+
+    channel_sum: float = 0.0
+    channel_count: int = 0
+    hill_sum: float = 0.0
+    hill_count: int = 0
+
+    def add(self, other: "VelocityStats"):
+        self.channel_sum += other.channel_sum
+        self.channel_count += other.channel_count
+        self.hill_sum += other.hill_sum
+        self.hill_count += other.hill_count
+
+    def means(self) -> tuple[float, float]:
+        return (
+            self.channel_sum / self.channel_count if self.channel_count else np.nan,
+            self.hill_sum / self.hill_count if self.hill_count else np.nan,
+        )
+
+
+def tile_weights(slope: np.ndarray, acc: np.ndarray) -> tuple[np.ndarray, VelocityStats]:
+    """
+    Travel time per meter (inverse velocity) for a tile of slopes in degrees
+    and flow accumulation.
+    """
+    channel = acc >= CHANNEL_ACCUMULATION
+    hill = ~channel
+    with np.errstate(invalid="ignore"):
+        root_slope = np.sqrt(np.tan(np.deg2rad(slope)))
+    v = np.empty_like(root_slope)
+    v[channel] = np.clip(
+        (1 / N_CHANNEL) * (R_CHANNEL ** (2 / 3)) * root_slope[channel], 0.2, 5.0
+    )
+    v[hill] = np.clip(
+        (1 / N_HILL) * (H_HILL ** (2 / 3)) * root_slope[hill], 0.05, 0.2
+    )
+    np.nan_to_num(v, copy=False, nan=0.01)
+    # v = np.clip(v, 0.01, 5.0)
+
+    stats = VelocityStats(
+        channel_sum=float(v[channel].sum(dtype=np.float64)),
+        channel_count=int(channel.sum()),
+        hill_sum=float(v[hill].sum(dtype=np.float64)),
+        hill_count=int(hill.sum()),
+    )
+    np.reciprocal(v, out=v)
+    return v, stats
+
+
+def _open_sources(facc: Path, slope: Path):
+    global _facc_src, _slope_src
+    _facc_src = rasterio.open(facc)
+    _slope_src = rasterio.open(slope)
+
+
+def _process_tile(window: Window) -> tuple[Window, np.ndarray, VelocityStats]:
+    assert _slope_src is not None and _facc_src is not None
+    weights, stats = tile_weights(
+        _slope_src.read(1, window=window), _facc_src.read(1, window=window)
+    )
+    return window, weights, stats
+
+
+def tile_windows(
+    block_shapes: list[tuple[int, int]], width: int, height: int, tile_size: int
+) -> Iterator[Window]:
+    """
+    Windows of about tile_size x tile_size pixels, made of whole internal
+    blocks of the source rasters (block_shapes, as rows x columns) and of the
+    output, so that no block is read or written by two tiles. Striped rasters,
+    whose blocks span their width, are processed in full width bands of about
+    as many pixels.
+    """
+    unit_height = min(math.lcm(OUTPUT_BLOCK, *(h for h, _ in block_shapes)), height)
+    unit_width = min(math.lcm(OUTPUT_BLOCK, *(w for _, w in block_shapes)), width)
+    tile_width = max(1, tile_size // unit_width) * unit_width
+    tile_units = max(1, tile_size * tile_size // (tile_width * unit_height))
+    tile_height = tile_units * unit_height
+    for row in range(0, height, tile_height):
+        for col in range(0, width, tile_width):
+            yield Window(
+                col, row, min(tile_width, width - col), min(tile_height, height - row)
+            )
+
+
+def process_tiles(
+    facc: Path, slope: Path, windows: Iterator[Window], workers: int
+) -> Iterator[tuple[Window, np.ndarray, VelocityStats]]:
+    """
+    Process tiles across worker processes, yielding them as they complete.
+    """
+    if workers == 1:
+        _open_sources(facc, slope)
+        yield from map(_process_tile, windows)
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_open_sources, initargs=(facc, slope)
+    ) as pool:
+        in_flight: set[Future] = set()
+        exhausted = False
+        while not exhausted or in_flight:
+            # Keep a bounded number of tiles in flight, so that results do not
+            # pile up in memory faster than they are written
+            while not exhausted and len(in_flight) < workers * IN_FLIGHT_PER_WORKER:
+                window = next(windows, None)
+                if window is None:
+                    exhausted = True
+                else:
+                    in_flight.add(pool.submit(_process_tile, window))
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
 
 def compute_weights(
     facc: Path,
     slope: Path,
     out: Path,
+    tile_size: int = 1024,
+    workers: int | None = None,
 ):
     """
-    Compute downslope flow length for each outlet point.
+    Compute the travel time per meter of each cell, from its slope and flow
+    accumulation. The rasters are processed in tiles of about tile_size pixels,
+    aligned to their internal blocks, across a pool of worker processes, so
+    memory use does not grow with raster size.
     """
-    # Load slope and accumulation arrays
-    with rasterio.open(slope) as src:
-        slope_data = src.read(1)
-        profile = src.profile
-    with rasterio.open(facc) as src:
-        acc_data = src.read(1)
-    slope_data = np.tan(np.deg2rad(slope_data))
-    v = np.where(
-        acc_data >= CHANNEL_ACCUMULATION,
-        np.clip((1 / N_CHANNEL) * (R_CHANNEL ** (2 / 3)) * np.sqrt(slope_data), 0.2, 5.0),
-        np.clip((1 / N_HILL) * (H_HILL ** (2 / 3)) * np.sqrt(slope_data), 0.05, 0.2),
-    )
-    v = np.nan_to_num(v, nan=0.01)
-    # v = np.clip(v, 0.01, 5.0)
-    
-    print(
-        "Average velocity (channel, hillslope)",
-        v[acc_data >= CHANNEL_ACCUMULATION].mean(),
-        v[acc_data < CHANNEL_ACCUMULATION].mean(),
-    )
+    workers = workers or os.cpu_count() or 1
+
+    with rasterio.open(slope) as slope_src, rasterio.open(facc) as facc_src:
+        profile = slope_src.profile
+        block_shapes = [slope_src.block_shapes[0], facc_src.block_shapes[0]]
+    profile.update(tiled=True, blockxsize=OUTPUT_BLOCK, blockysize=OUTPUT_BLOCK)
+    windows = tile_windows(block_shapes, profile["width"], profile["height"], tile_size)
+    stats = VelocityStats()
 
-    # Save velocity weights raster
     with rasterio.open(out, "w", **profile) as dst:
-        dst.write(1.0 / v, 1)
+        for window, weights, tile_stats in process_tiles(facc, slope, windows, workers):
+            dst.write(weights.astype(profile["dtype"], copy=False), 1, window=window)
+            stats.add(tile_stats)
+
+    print("Average velocity (channel, hillslope)", *stats.means())
 
 
 def main():
@@ -52,12 +182,27 @@ def main():
     parser.add_argument("facc", type=Path, help="Path to the flow accumulation file")
     parser.add_argument("slopes", type=Path, help="Path to the slopes file")
     parser.add_argument("out", type=Path, help="Path to the out file")
+    parser.add_argument(
+        "--tile-size",
+        type=int,
+        default=1024,
+        help="Approximate width and height of processed tiles in pixels, rounded "
+        "to the rasters' internal blocks",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes, defaults to the number of CPUs",
+    )
     args = parser.parse_args()
 
     compute_weights(
         Path(args.facc),
         Path(args.slopes),
         Path(args.out),
+        tile_size=args.tile_size,
+        workers=args.workers,
     )
 
 
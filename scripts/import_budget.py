@@ -0,0 +1,156 @@
+"""
+Import time of each service's app.main, checked against a budget.
+
+Pods restarted or scaled up during a flood must be ready quickly: expensive
+initialization belongs to the app lifespan (see floodcast_common.readiness),
+and debug-only dependencies must not be imported at all.
+
+    uv sync --all-packages
+    uv run python scripts/import_budget.py
+    uv run python scripts/import_budget.py --profile 15 flow-prediction
+
+Each service is imported in fresh interpreters with -X importtime, after a
+first run compiling the bytecode, and the fastest run is kept. FRAMEWORK is
+imported first: it takes most of the time and varies the most from run to
+run, while app.main cannot make it faster. Budgets apply to the rest, the
+service's own import time, and the total is reported. Exits with 1 if a
+service exceeds its budget or imports a forbidden module.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).parents[1]
+SERVICES = ROOT / "services"
+
+# Imported by every service, not counted in the budgets. fastapi imports
+# pydantic.v1 when the first route with a model is declared.
+FRAMEWORK = ["fastapi", "httpx", "pydantic.v1"]
+# Seconds of import time of app.main after FRAMEWORK, about 1.5 times the
+# slowest result of several invocations on a single vCPU agent, where FRAMEWORK takes about
+# 0.5 s. Most of alert's is SQLAlchemy, that the lifespan needs before serving
+# anyway, and most of weather-data's and flow-prediction's is numpy.
+DEFAULT_BUDGET = 0.2
+BUDGETS = {
+    "alert": 0.6,
+    "flow-prediction": 0.45,
+    "weather-data": 0.35,
+}
+# Debug or batch only, never needed to serve requests
+FORBIDDEN = ["matplotlib", "pyarrow", "IPython"]
+# Read at import time, any value will do
+ENV = {"METEO_FRANCE_AROME_API_KEY": "import-budget"}
+
+
+def import_times(service: str) -> list[tuple[str, int, int]]:
+    """
+    Module, cumulative import time (µs) and nesting depth of each module
+    imported, in the order of -X importtime: after the modules they import.
+    FRAMEWORK and app.main are at depth 0.
+    """
+    env = os.environ | ENV
+    env["PYTHONPATH"] = os.pathsep.join(
+        [str(SERVICES / service), env.get("PYTHONPATH", "")]
+    )
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            f"import {', '.join(FRAMEWORK)}; import app.main",
+        ],
+        cwd=SERVICES / service,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {service} failed:\n{result.stderr}")
+
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, module = line.removeprefix("import time:").split("|")
+        depth = (len(module) - len(module.lstrip()) - 1) // 2
+        times.append((module.strip(), int(cumulative_us), depth))
+    return times
+
+
+def top_level(times: list[tuple[str, int, int]]) -> dict[str, int]:
+    return {module: cumulative for module, cumulative, depth in times if depth == 0}
+
+
+def imported_by_app(times: list[tuple[str, int, int]]) -> list[tuple[str, int, int]]:
+    """
+    The modules imported by app.main, that FRAMEWORK had not imported.
+    """
+    end = next(i for i, (module, _, depth) in enumerate(times) if module == "app.main")
+    start = max(
+        (i + 1 for i, (_, _, depth) in enumerate(times[:end]) if depth == 0), default=0
+    )
+    return times[start:end]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "services",
+        nargs="*",
+        default=sorted(p.name for p in SERVICES.iterdir() if (p / "app").is_dir()),
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--profile",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Print the N imports of app.main taking the longest",
+    )
+    args = parser.parse_args()
+
+    failed = False
+    for service in args.services:
+        import_times(service)
+        runs = [import_times(service) for _ in range(args.runs)]
+        times = min(runs, key=lambda t: top_level(t)["app.main"])
+        own = top_level(times)["app.main"] / 1e6
+        total = sum(top_level(times).values()) / 1e6
+        budget = BUDGETS.get(service, DEFAULT_BUDGET)
+        app_modules = imported_by_app(times)
+        forbidden = sorted(
+            {module.split(".")[0] for module, _, _ in app_modules} & set(FORBIDDEN)
+        )
+
+        problems = []
+        if own > budget:
+            problems.append("over budget")
+        if forbidden:
+            problems.append(f"imports {', '.join(forbidden)}")
+        failed |= bool(problems)
+        print(
+            f"{service:16} {own:6.3f} s / {budget:.3f} s  (total {total:.3f} s)  "
+            f"{', '.join(problems) or 'ok'}"
+        )
+
+        if args.profile:
+            top = sorted(
+                (
+                    (cumulative, module)
+                    for module, cumulative, depth in app_modules
+                    if depth == 1
+                ),
+                reverse=True,
+            )
+            for cumulative, module in top[: args.profile]:
+                print(f"  {cumulative / 1e3:8.1f} ms  {module}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+from collections.abc import AsyncIterable, AsyncIterator
+
+from pydantic import TypeAdapter, ValidationError
+
+from app.models.user import ImportLineError, UserModel
+
+NDJSON_MEDIA_TYPES = {"application/x-ndjson", "application/jsonl"}
+# Invalid NDJSON lines listed in the import result
+MAX_REPORTED_ERRORS = 100
+
+users_adapter = TypeAdapter(list[UserModel])
+
+
+async def ndjson_lines(stream: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    """
+    Split a byte stream into lines without buffering the whole body.
+    """
+    buffer = b""
+    async for chunk in stream:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+
+async def parse_ndjson(
+    stream: AsyncIterable[bytes], errors: list[ImportLineError]
+) -> AsyncIterator[UserModel]:
+    """
+    Yield one user per valid line. Invalid lines are skipped and appended to errors.
+    """
+    number = 0
+    async for line in ndjson_lines(stream):
+        number += 1
+        if not line.strip():
+            continue
+        try:
+            yield UserModel.model_validate_json(line)
+        except ValidationError as e:
+            errors.append(ImportLineError(line=number, error=e.errors()[0]["msg"]))
+
+
+async def parse_json_array(body: bytes) -> AsyncIterator[UserModel]:
+    """
+    Validate a whole JSON array at once. Raises ValidationError if any item is invalid.
+    """
+    for user in users_adapter.validate_json(body):
+        yield user
+
+
+async def batched(
+    users: AsyncIterable[UserModel], size: int
+) -> AsyncIterator[list[UserModel]]:
+    batch: list[UserModel] = []
+    async for user in users:
+        batch.append(user)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
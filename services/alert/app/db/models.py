@@ -1,4 +1,7 @@
-from sqlalchemy import ForeignKey, String
+from datetime import datetime
+
+from sqlalchemy import ForeignKey, Index, String, UniqueConstraint
+from sqlalchemy.ext.associationproxy import AssociationProxy, association_proxy
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
@@ -8,6 +11,9 @@ class Base(DeclarativeBase):
 
 class User(Base):
     __tablename__ = "user"
+    # A subscriber is identified by their contact details
+    __table_args__ = (UniqueConstraint("mail", "ip"),)
+
     id: Mapped[int] = mapped_column(primary_key=True)
 
     name: Mapped[str] = mapped_column()
@@ -16,9 +22,92 @@ class User(Base):
 
     ip: Mapped[str] = mapped_column()
 
-    #segments_ids: Mapped[list[int]] = mapped_column()
+    segment_subscriptions: Mapped[list["SegmentSubscription"]] = relationship(
+        cascade="all, delete-orphan", lazy="selectin"
+    )
+
+    departement_subscriptions: Mapped[list["DepartementSubscription"]] = relationship(
+        cascade="all, delete-orphan", lazy="selectin"
+    )
 
-    #departements: Mapped[list[int]] = mapped_column()
+    segments_ids: AssociationProxy[list[int]] = association_proxy(
+        "segment_subscriptions",
+        "segment_id",
+        creator=lambda segment_id: SegmentSubscription(segment_id=segment_id),
+    )
+
+    departements: AssociationProxy[list[int]] = association_proxy(
+        "departement_subscriptions",
+        "departement",
+        creator=lambda departement: DepartementSubscription(departement=departement),
+    )
 
     def __repr__(self) -> str:
         return f"User(id={self.id!r})"
+
+
+class SegmentSubscription(Base):
+    """
+    User subscribed to alerts for a river segment. Indexed for lookup by segment.
+    """
+
+    __tablename__ = "segment_subscription"
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"), primary_key=True)
+
+    segment_id: Mapped[int] = mapped_column(primary_key=True, index=True)
+
+
+class DepartementSubscription(Base):
+    """
+    User subscribed to alerts for a whole département.
+    """
+
+    __tablename__ = "departement_subscription"
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"), primary_key=True)
+
+    departement: Mapped[int] = mapped_column(primary_key=True, index=True)
+
+
+class AlertOutbox(Base):
+    """
+    One alert to deliver to one user on one channel.
+    Rows stay pending until sent or until they run out of attempts.
+    """
+
+    __tablename__ = "alert_outbox"
+    __table_args__ = (Index("ix_alert_outbox_due", "status", "next_attempt_at"),)
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+
+    # prediction id, user id and channel: enqueuing the same alert twice is a no-op
+    idempotency_key: Mapped[str] = mapped_column(unique=True)
+
+    prediction_id: Mapped[int] = mapped_column(index=True)
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"))
+
+    channel: Mapped[str] = mapped_column()
+
+    target: Mapped[str] = mapped_column()
+
+    # PredictionModel as JSON
+    payload: Mapped[str] = mapped_column()
+
+    # pending | sent | failed
+    status: Mapped[str] = mapped_column(default="pending")
+
+    attempts: Mapped[int] = mapped_column(default=0)
+
+    # Also used as a lease: claimed rows are pushed into the future until processed
+    next_attempt_at: Mapped[datetime] = mapped_column()
+
+    created_at: Mapped[datetime] = mapped_column()
+
+    sent_at: Mapped[datetime | None] = mapped_column(default=None)
+
+    last_error: Mapped[str | None] = mapped_column(default=None)
+
+    def __repr__(self) -> str:
+        return f"AlertOutbox(id={self.id!r}, key={self.idempotency_key!r})"
@@ -1,26 +1,290 @@
-from app.db.models import User
-from sqlalchemy import Engine, select
-from sqlalchemy.orm import sessionmaker
+from collections.abc import Iterable, Sequence
+from datetime import datetime, timedelta
+
+from app.db.models import (
+    AlertOutbox,
+    DepartementSubscription,
+    SegmentSubscription,
+    User,
+)
+from app.models.prediction import PredictionModel
+from app.models.user import UserModel
+from sqlalchemy import Select, func, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
+from sqlalchemy.orm import noload
 
 
 class DB:
-    session: sessionmaker
-
-    def __init__(self, engine: Engine) -> None:
-        self.session = sessionmaker(engine, expire_on_commit=False)
-
-    def add_user(self, user: User):
-        with self.session.begin() as session:
-            session.add(user)
-
-    def get_all_users(self) -> list[User]:
-        with self.session.begin() as session:
-            return session.scalars(select(User)).all()
-        
-    def get_all_users_from_dep(self, dep) -> list[User]:
-        with self.session.begin() as session:
-            return session.scalars(select(User)).all()
-        
-    def get_user_by_id(self) -> list[User]:
-        with self.session.begin() as session:
-            return session.scalars(select(User)).all()
+    session: async_sessionmaker[AsyncSession]
+
+    def __init__(self, engine: AsyncEngine) -> None:
+        self.engine = engine
+        self.session = async_sessionmaker(engine, expire_on_commit=False)
+
+    async def close(self):
+        await self.engine.dispose()
+
+    def _insert(self, table):
+        """
+        Dialect specific INSERT, which supports ON CONFLICT clauses.
+        """
+        if self.engine.dialect.name == "postgresql":
+            return postgresql.insert(table)
+        return sqlite.insert(table)
+
+    async def upsert_users(self, users: Sequence[UserModel]) -> int:
+        """
+        Insert or update a batch of users in one transaction, with one multi-row
+        statement per table. Users are keyed on (mail, ip): an existing user gets
+        the new name and the union of old and new subscriptions.
+
+        Returns the number of distinct users in the batch.
+        """
+        # A row may only be upserted once per statement
+        unique: dict[tuple[str, str], UserModel] = {}
+        for user in users:
+            key = (user.mail, user.ip)
+            if key in unique:
+                previous = unique[key]
+                user = user.model_copy(
+                    update={
+                        "segments_ids": previous.segments_ids + user.segments_ids,
+                        "departements": previous.departements + user.departements,
+                    }
+                )
+            unique[key] = user
+        if not unique:
+            return 0
+
+        stmt = self._insert(User)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["mail", "ip"], set_={"name": stmt.excluded.name}
+        ).returning(User.id, User.mail, User.ip)
+
+        async with self.session.begin() as session:
+            rows = await session.execute(
+                stmt,
+                [{"name": u.name, "mail": u.mail, "ip": u.ip} for u in unique.values()],
+            )
+            ids = {(mail, ip): id for id, mail, ip in rows}
+
+            segments = {
+                (ids[key], segment_id)
+                for key, user in unique.items()
+                for segment_id in user.segments_ids
+            }
+            departements = {
+                (ids[key], departement)
+                for key, user in unique.items()
+                for departement in user.departements
+            }
+            if segments:
+                await session.execute(
+                    self._insert(SegmentSubscription).on_conflict_do_nothing(),
+                    [{"user_id": u, "segment_id": s} for u, s in segments],
+                )
+            if departements:
+                await session.execute(
+                    self._insert(DepartementSubscription).on_conflict_do_nothing(),
+                    [{"user_id": u, "departement": d} for u, d in departements],
+                )
+        return len(unique)
+
+    async def get_all_users(self) -> list[User]:
+        async with self.session.begin() as session:
+            return list((await session.scalars(select(User))).all())
+
+    async def get_all_users_from_dep(self, dep: int) -> list[User]:
+        async with self.session.begin() as session:
+            return list(
+                (
+                    await session.scalars(
+                        select(User)
+                        .join(DepartementSubscription)
+                        .where(DepartementSubscription.departement == dep)
+                    )
+                ).all()
+            )
+
+    async def get_user_by_id(self, id: int) -> User | None:
+        async with self.session.begin() as session:
+            return await session.get(User, id)
+
+    @staticmethod
+    def _recipients(prediction: PredictionModel) -> Select[User]:
+        """
+        Users subscribed to the prediction's segment or département.
+        Subscriptions are not loaded, the fan-out only needs contact details.
+        """
+        subscribers = select(SegmentSubscription.user_id).where(
+            SegmentSubscription.segment_id == prediction.segment_id
+        )
+        if prediction.departement is not None:
+            subscribers = subscribers.union(
+                select(DepartementSubscription.user_id).where(
+                    DepartementSubscription.departement == prediction.departement
+                )
+            )
+        return (
+            select(User)
+            .where(User.id.in_(subscribers))
+            .options(
+                noload(User.segment_subscriptions),
+                noload(User.departement_subscriptions),
+            )
+        )
+
+    # --------------------------------------------------
+    # Alert outbox
+    # --------------------------------------------------
+
+    async def enqueue_prediction_alerts(
+        self, prediction: PredictionModel, batch_size: int
+    ) -> tuple[int, int]:
+        """
+        Enqueue alerts for every subscriber of the prediction. Recipients are
+        streamed from the database in batches, so memory does not grow with the
+        number of users. Alerts already enqueued for this prediction are skipped.
+
+        Each batch is inserted in its own short transaction, next to the read-only
+        streaming one: with SQLite, a transaction that reads then writes fails if
+        another writer committed in between. Retrying after a failure part way is
+        safe thanks to the idempotency keys.
+
+        Returns (number of recipients, number of new alerts).
+        """
+        recipients = queued = 0
+        stmt = self._recipients(prediction).execution_options(yield_per=batch_size)
+        async with self.session() as reader:
+            result = await reader.stream_scalars(stmt)
+            async for users in result.partitions():
+                recipients += len(users)
+                async with self.session.begin() as writer:
+                    queued += await self._enqueue_alerts(writer, prediction, users)
+        return recipients, queued
+
+    async def _enqueue_alerts(
+        self, session: AsyncSession, prediction: PredictionModel, users: Iterable[User]
+    ) -> int:
+        """
+        Add one outbox row per user and channel. Returns the number of new rows.
+        """
+        now = datetime.now()
+        payload = prediction.model_dump_json()
+        rows = [
+            {
+                "idempotency_key": f"{prediction.id}:{user.id}:{channel}",
+                "prediction_id": prediction.id,
+                "user_id": user.id,
+                "channel": channel,
+                "target": target,
+                "payload": payload,
+                "next_attempt_at": now,
+                "created_at": now,
+            }
+            for user in users
+            for channel, target in (("mail", user.mail), ("ip", user.ip))
+            if target
+        ]
+        if not rows:
+            return 0
+
+        stmt = (
+            self._insert(AlertOutbox)
+            .on_conflict_do_nothing(index_elements=["idempotency_key"])
+            .returning(AlertOutbox.id)
+        )
+        return len((await session.scalars(stmt, rows)).all())
+
+    async def claim_alerts(self, limit: int, lease: timedelta) -> list[AlertOutbox]:
+        """
+        Claim up to `limit` due alerts. Claimed rows are hidden from other
+        workers for `lease`, after which they are retried if still pending.
+        """
+        now = datetime.now()
+        due = (
+            select(AlertOutbox.id)
+            .where(AlertOutbox.status == "pending")
+            .where(AlertOutbox.next_attempt_at <= now)
+            .order_by(AlertOutbox.next_attempt_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        # A single UPDATE ... RETURNING, so two workers never claim the same row
+        async with self.session.begin() as session:
+            return list(
+                (
+                    await session.scalars(
+                        update(AlertOutbox)
+                        .where(AlertOutbox.id.in_(due.scalar_subquery()))
+                        .values(
+                            attempts=AlertOutbox.attempts + 1,
+                            next_attempt_at=now + lease,
+                        )
+                        .returning(AlertOutbox)
+                    )
+                ).all()
+            )
+
+    async def mark_alerts(
+        self, sent: list[int], failed: list[tuple[int, str, datetime | None]]
+    ):
+        """
+        Record the outcome of the attempts of a batch in a single transaction:
+        the ids sent, and the (id, error, retry_at) of the failures. Failures
+        without retry_at are given up on.
+        """
+        if not sent and not failed:
+            return
+        now = datetime.now()
+        async with self.session.begin() as session:
+            if sent:
+                await session.execute(
+                    update(AlertOutbox)
+                    .where(AlertOutbox.id.in_(sent))
+                    .values(status="sent", sent_at=now, last_error=None)
+                )
+            if failed:
+                # Bulk UPDATE by primary key, a single executemany
+                await session.execute(
+                    update(AlertOutbox),
+                    [
+                        {
+                            "id": id,
+                            "last_error": error,
+                            "status": "failed" if retry_at is None else "pending",
+                            "next_attempt_at": retry_at or now,
+                        }
+                        for id, error, retry_at in failed
+                    ],
+                )
+
+    async def get_alerts(self, prediction_id: int) -> list[AlertOutbox]:
+        async with self.session.begin() as session:
+            return list(
+                (
+                    await session.scalars(
+                        select(AlertOutbox)
+                        .where(AlertOutbox.prediction_id == prediction_id)
+                        .order_by(AlertOutbox.user_id, AlertOutbox.channel)
+                    )
+                ).all()
+            )
+
+    async def outbox_stats(self) -> tuple[int, int, datetime | None]:
+        """
+        Returns (pending count, failed count, creation date of the oldest pending alert).
+        """
+        async with self.session.begin() as session:
+            pending, oldest = (
+                await session.execute(
+                    select(func.count(), func.min(AlertOutbox.created_at)).where(
+                        AlertOutbox.status == "pending"
+                    )
+                )
+            ).one()
+            failed = await session.scalar(
+                select(func.count()).where(AlertOutbox.status == "failed")
+            )
+            return pending, failed or 0, oldest
@@ -1,28 +1,42 @@
 from typing import Annotated, Literal
 
-from async_lru import alru_cache
 from fastapi import Depends
-from httpx import AsyncClient
+from floodcast_common.config import ConfigClient
 from pydantic import BaseModel
 
 
 class ConfigModel(BaseModel):
     log_level: Literal["debug"]
+    # db_* are read once at startup, the other settings apply while running
+    # Must use an async driver, e.g. sqlite+aiosqlite:// or postgresql+asyncpg://
     db_url: str
-
-
-@alru_cache(maxsize=32)
-async def fetch_config() -> ConfigModel:
-    url = "http://config-service:8000/config/alert"
-    async with AsyncClient() as client:
-        r = await client.get(url)
-        r.raise_for_status()
-        data = r.json()
-        return ConfigModel(**data["config"])
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    # Log every SQL statement
+    db_echo: bool = False
+    # Maximum number of alert sends in flight at once
+    alert_concurrency: int = 100
+    # Per target timeout, in seconds
+    alert_timeout: float = 3.0
+    # Users upserted per transaction by /subscribe/bulk
+    import_batch_size: int = 1000
+    # Subscribers loaded from the database at once when enqueuing alerts
+    recipient_batch_size: int = 1000
+    outbox_workers: int = 4
+    # Alerts claimed by a worker at once
+    outbox_batch_size: int = 100
+    outbox_max_attempts: int = 5
+    # First retry delay, doubled on each attempt
+    outbox_retry_base_seconds: float = 2.0
+    # Time after which a claimed but unprocessed alert is retried
+    outbox_lease_seconds: float = 60.0
+
+
+config_client = ConfigClient("alert", ConfigModel)
 
 
 async def get_config() -> ConfigModel:
-    return await fetch_config()
+    return config_client.current
 
 
-Config = Annotated[ConfigModel, Depends(get_config)]
\ No newline at end of file
+Config = Annotated[ConfigModel, Depends(get_config)]
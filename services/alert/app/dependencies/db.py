@@ -1,31 +1,122 @@
 from typing import Annotated
 
-from fastapi import Depends
-from sqlalchemy import Engine, create_engine
+from fastapi import Depends, Request
+from sqlalchemy import Connection, event, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
 
 from app.db.models import Base
 from app.db.repo import DB
-from app.dependencies.config import Config
+from app.dependencies.config import ConfigModel
 
-DB_ENGINE: Engine | None = None
 
+def _sqlite_connect(dbapi_connection, connection_record):
+    # Readers do not block on the writer, and writers queue for the lock
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA busy_timeout=30000")
+    cursor.close()
 
-def create_db_engine(config: Config) -> Engine:
-    engine = create_engine(config.db_url, echo=True)
-    Base.metadata.create_all(engine)
-    return engine
 
+# Subscriber id each subscriber is merged into: the latest one with the same
+# mail and ip
+_KEPT_USER = """
+    SELECT u.id AS id, (
+        SELECT MAX(v.id) FROM "user" v WHERE v.mail = u.mail AND v.ip = u.ip
+    ) AS kept_id
+    FROM "user" u
+"""
 
-def get_db_engine(config: Config) -> Engine:
-    global DB_ENGINE
-    if DB_ENGINE is None:
-        DB_ENGINE = create_db_engine(config)
-    return DB_ENGINE
 
+def _add_user_unique_constraint(conn: Connection):
+    """
+    Databases created before subscribers were upserted on (mail, ip) have no
+    unique constraint on them, and may hold duplicates. Merge the duplicates
+    into the latest one and add the constraint as a unique index, which
+    create_all does not do on existing tables.
+    """
+    inspector = inspect(conn)
+    unique = [c["column_names"] for c in inspector.get_unique_constraints("user")]
+    unique += [i["column_names"] for i in inspector.get_indexes("user") if i["unique"]]
+    if any(sorted(columns) == ["ip", "mail"] for columns in unique):
+        return
 
-def get_db(config: Config) -> DB:
-    engine = get_db_engine(config)
+    for table, column in [
+        ("segment_subscription", "segment_id"),
+        ("departement_subscription", "departement"),
+    ]:
+        conn.execute(
+            text(
+                f"""
+                INSERT INTO {table} (user_id, {column})
+                SELECT DISTINCT k.kept_id, s.{column}
+                FROM {table} s JOIN ({_KEPT_USER}) k ON k.id = s.user_id
+                WHERE k.kept_id != k.id AND NOT EXISTS (
+                    SELECT 1 FROM {table} t
+                    WHERE t.user_id = k.kept_id AND t.{column} = s.{column}
+                )
+                """
+            )
+        )
+        conn.execute(
+            text(
+                f"""
+                DELETE FROM {table} WHERE user_id IN (
+                    SELECT id FROM ({_KEPT_USER}) k WHERE k.kept_id != k.id
+                )
+                """
+            )
+        )
+    conn.execute(
+        text(
+            f"""
+            UPDATE alert_outbox SET user_id = (
+                SELECT kept_id FROM ({_KEPT_USER}) k WHERE k.id = alert_outbox.user_id
+            )
+            WHERE user_id IN (SELECT id FROM ({_KEPT_USER}) k WHERE k.kept_id != k.id)
+            """
+        )
+    )
+    result = conn.execute(
+        text(
+            f"""
+            DELETE FROM "user" WHERE id IN (
+                SELECT id FROM ({_KEPT_USER}) k WHERE k.kept_id != k.id
+            )
+            """
+        )
+    )
+    conn.execute(text('CREATE UNIQUE INDEX uq_user_mail_ip ON "user" (mail, ip)'))
+    print(f"[DB] Added a unique (mail, ip) index, merged {result.rowcount} duplicates")
+
+
+async def create_db(config: ConfigModel) -> DB:
+    """
+    Create the engine and its connection pool. Called once, in the app lifespan.
+    """
+    url = make_url(config.db_url)
+    in_memory = url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+    kwargs = {}
+    if not in_memory:
+        # In-memory SQLite is limited to a single shared connection, use it for tests only
+        kwargs = {
+            "pool_size": config.db_pool_size,
+            "max_overflow": config.db_max_overflow,
+            "pool_pre_ping": True,
+        }
+    engine = create_async_engine(url, echo=config.db_echo, **kwargs)
+    if url.get_backend_name() == "sqlite" and not in_memory:
+        event.listen(engine.sync_engine, "connect", _sqlite_connect)
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_add_user_unique_constraint)
     return DB(engine)
 
 
-DBDependency = Annotated[DB, Depends(get_db)]
\ No newline at end of file
+def get_db(request: Request) -> DB:
+    return request.app.state.db
+
+
+DBDependency = Annotated[DB, Depends(get_db)]
@@ -0,0 +1,12 @@
+from typing import Annotated
+
+from fastapi import Depends, Request
+
+from app.outbox import OutboxWorkers
+
+
+def get_outbox(request: Request) -> OutboxWorkers:
+    return request.app.state.outbox
+
+
+Outbox = Annotated[OutboxWorkers, Depends(get_outbox)]
@@ -1,50 +1,53 @@
-from fastapi import FastAPI, HTTPException
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from datetime import datetime
 from typing import List
 
-from app.dependencies.config import Config
-from app.dependencies.db import DBDependency
-from app.db.models import User
-from app.models.user import UserModel
-from app.models.prediction import PredictionModel
 import httpx
-app = FastAPI()
-
-
-# --------------------------------------------------
-# Utils (mock alerting functions)
-# --------------------------------------------------
-
-def mailto(email: str, prediction: PredictionModel):
-    print(f"[MAIL] Alerte envoyée à {email} : {prediction}")
-
-
-
-
-
-async def send_to_ip(ip: str, prediction: PredictionModel):
-    """
-    Send alert to a remote service identified by its IP.
-    """
-    url = f"http://{ip}:8000/alert"
-
-    payload = prediction.model_dump()
-
-    try:
-        async with httpx.AsyncClient(timeout=3.0) as client:
-            response = await client.post(url, json=payload)
-            response.raise_for_status()
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
+from floodcast_common.metrics import instrument, stage
+from floodcast_common.readiness import Readiness
+from pydantic import ValidationError
+
+from app.bulk import (
+    MAX_REPORTED_ERRORS,
+    NDJSON_MEDIA_TYPES,
+    batched,
+    parse_json_array,
+    parse_ndjson,
+)
+from app.dependencies.config import Config, config_client
+from app.dependencies.db import DBDependency, create_db
+from app.dependencies.outbox import Outbox
+from app.models.delivery import AlertStatusModel, OutboxStatsModel
+from app.models.user import BulkImportResult, ImportLineError, UserModel
+from app.models.prediction import PredictionModel
+from app.outbox import OutboxWorkers
 
-        print(f"[IP] Alerte envoyée à {ip}")
 
-    except httpx.RequestError as e:
-        print(f"[IP][ERROR] Impossible de joindre {ip}: {e}")
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    await config_client.start()
+    config = config_client.current
+    app.state.db = await create_db(config)
+    async with httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=200, max_keepalive_connections=50)
+    ) as client:
+        app.state.outbox = OutboxWorkers(app.state.db, client, config)
+        app.state.outbox.start()
+        config_client.on_change(lambda old, new: app.state.outbox.reconfigure(new))
+        try:
+            yield
+        finally:
+            await app.state.outbox.stop()
+            await app.state.db.close()
+            await config_client.stop()
 
-    except httpx.HTTPStatusError as e:
-        print(
-            f"[IP][ERROR] {ip} a répondu {e.response.status_code} "
-            f"- {e.response.text}"
-        )
 
+app = FastAPI(lifespan=lifespan)
+instrument(app)
+Readiness().install(app)
 
 
 # --------------------------------------------------
@@ -60,42 +63,113 @@ async def root(config: Config):
 
 
 @app.get("/users", response_model=List[UserModel])
-def get_users(db: DBDependency):
-    return db.get_all_users()
+async def get_users(db: DBDependency):
+    return await db.get_all_users()
 
 
 @app.post("/subscribe", status_code=201)
-def subscribe_user(user: UserModel, db: DBDependency):
-    db.add_user(User(**user.model_dump()))
+async def subscribe_user(user: UserModel, db: DBDependency):
+    await db.upsert_users([user])
     return {"status": "subscribed"}
 
 
-@app.post("/alertUsers")
-def alert_users(
+@app.post(
+    "/subscribe/bulk",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": {
+                        "type": "array",
+                        "items": {"$ref": "#/components/schemas/UserModel"},
+                    }
+                },
+                "application/x-ndjson": {
+                    "schema": {"type": "string", "description": "One user per line"}
+                },
+            },
+        }
+    },
+)
+async def subscribe_bulk(
+    request: Request, db: DBDependency, config: Config
+) -> BulkImportResult:
+    """
+    Import many subscribers at once, from a JSON array or an NDJSON stream.
+    Users are upserted on (mail, ip) in batches of import_batch_size, one
+    transaction per batch. NDJSON is read as it arrives, and invalid lines are
+    skipped and reported instead of failing the import.
+    """
+    errors: list[ImportLineError] = []
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type in NDJSON_MEDIA_TYPES:
+        users = parse_ndjson(request.stream(), errors)
+    else:
+        users = parse_json_array(await request.body())
+
+    received = upserted = batches = 0
+    try:
+        async for batch in batched(users, config.import_batch_size):
+            received += len(batch)
+            upserted += await db.upsert_users(batch)
+            batches += 1
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+
+    return BulkImportResult(
+        received=received + len(errors),
+        upserted=upserted,
+        batches=batches,
+        invalid=len(errors),
+        errors=errors[:MAX_REPORTED_ERRORS],
+    )
+
+
+@app.post("/alertUsers", status_code=202)
+async def alert_users(
     prediction: PredictionModel,
     db: DBDependency,
+    config: Config,
+    outbox: Outbox,
 ):
     """
-    Envoie une alerte si la prédiction correspond à une crue
+    Envoie une alerte si la prédiction correspond à une crue.
+    Les alertes sont mises dans l'outbox, puis envoyées par les workers.
     """
     CRUE_SEVERITY_THRESHOLD = 0.7
 
     if prediction.severity < CRUE_SEVERITY_THRESHOLD:
         return {"status": "no alert", "reason": "severity too low"}
 
-    users = db.get_all_users()
+    with stage("enqueue"):
+        users, queued = await db.enqueue_prediction_alerts(
+            prediction, config.recipient_batch_size
+        )
 
     if not users:
         raise HTTPException(status_code=404, detail="No users to alert")
 
-    for user in users:
-        if user.mail:
-            mailto(user.mail, prediction)
-        if user.ip:
-            send_to_ip(user.ip, prediction)
+    outbox.notify()
 
     return {
-        "status": "alert sent",
-        "users_notified": len(users),
+        "status": "alert queued",
+        "users": users,
+        "alerts_queued": queued,
         "severity": prediction.severity,
     }
+
+
+@app.get("/alertUsers/{prediction_id}", response_model=List[AlertStatusModel])
+async def get_alert_status(prediction_id: int, db: DBDependency):
+    """
+    Delivery status of every alert sent for a prediction.
+    """
+    return await db.get_alerts(prediction_id)
+
+
+@app.get("/outbox/stats")
+async def get_outbox_stats(db: DBDependency) -> OutboxStatsModel:
+    pending, failed, oldest = await db.outbox_stats()
+    lag = (datetime.now() - oldest).total_seconds() if oldest else 0.0
+    return OutboxStatsModel(pending=pending, failed=failed, lag=lag)
@@ -0,0 +1,30 @@
+from datetime import datetime
+from typing import Literal
+
+from pydantic import BaseModel, ConfigDict
+
+
+class ChannelDelivery(BaseModel):
+    channel: Literal["mail", "ip"]
+    target: str
+    delivered: bool
+    error: str | None = None
+
+
+class AlertStatusModel(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    user_id: int
+    channel: Literal["mail", "ip"]
+    target: str
+    status: Literal["pending", "sent", "failed"]
+    attempts: int
+    sent_at: datetime | None
+    last_error: str | None
+
+
+class OutboxStatsModel(BaseModel):
+    pending: int
+    failed: int
+    # Age of the oldest pending alert, in seconds
+    lag: float
@@ -5,6 +5,8 @@ from pydantic import BaseModel
 class PredictionModel(BaseModel):
     id: int
     segment_id: int
+    # Also alert users subscribed to the whole département
+    departement: int | None = None
     severity: float
     probability: float
     start_date: datetime
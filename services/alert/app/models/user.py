@@ -6,5 +6,20 @@ class UserModel(BaseModel):
     name: str
     mail: str
     ip: str
-    #segments_ids: list[int]
-    #departements: list[int]
+    segments_ids: list[int] = []
+    departements: list[int] = []
+
+
+class ImportLineError(BaseModel):
+    line: int
+    error: str
+
+
+class BulkImportResult(BaseModel):
+    received: int
+    # Distinct users inserted or updated, counted per batch
+    upserted: int
+    batches: int
+    invalid: int
+    # First invalid NDJSON lines, if any
+    errors: list[ImportLineError]
@@ -0,0 +1,80 @@
+import asyncio
+import os
+from collections.abc import Awaitable, Callable
+from typing import Literal
+
+import httpx
+from floodcast_common.metrics import upstream_call
+
+from app.models.delivery import ChannelDelivery
+from app.models.prediction import PredictionModel
+
+# Port of the alert receivers reached through the ip channel
+ALERT_RECEIVER_PORT = int(os.environ.get("ALERT_RECEIVER_PORT", 8000))
+
+# --------------------------------------------------
+# Channels (mail is still mocked)
+# --------------------------------------------------
+
+
+async def mailto(email: str, prediction: PredictionModel):
+    print(f"[MAIL] Alerte envoyée à {email} : {prediction}")
+
+
+async def send_to_ip(
+    client: httpx.AsyncClient,
+    ip: str,
+    prediction: PredictionModel,
+    idempotency_key: str | None = None,
+):
+    """
+    Send alert to a remote service identified by its IP.
+    Raises on connection errors and non 2xx responses.
+
+    The idempotency key lets the receiver ignore retries of an alert it already got.
+    """
+    url = f"http://{ip}:{ALERT_RECEIVER_PORT}/alert"
+    headers = {"Idempotency-Key": idempotency_key} if idempotency_key else None
+
+    with upstream_call("alert-receiver", "/alert"):
+        response = await client.post(
+            url, json=prediction.model_dump(mode="json"), headers=headers
+        )
+        _ = response.raise_for_status()
+
+
+# --------------------------------------------------
+# Delivery
+# --------------------------------------------------
+
+
+async def deliver(
+    channel: Literal["mail", "ip"],
+    target: str,
+    send: Callable[[], Awaitable[None]],
+    semaphore: asyncio.Semaphore,
+    timeout: float,
+) -> ChannelDelivery:
+    """
+    Run one send under the shared concurrency limit and a per-target timeout,
+    turning any failure into a delivery outcome. send is only called here, so
+    that errors building it, e.g. an invalid payload, are outcomes too.
+    """
+    try:
+        async with semaphore:
+            async with asyncio.timeout(timeout):
+                await send()
+    except TimeoutError:
+        error = f"{target} n'a pas répondu après {timeout}s"
+    except httpx.HTTPStatusError as e:
+        error = f"{target} a répondu {e.response.status_code}"
+    except httpx.RequestError as e:
+        error = f"impossible de joindre {target}: {e!r}"
+    except Exception as e:
+        # e.g. httpx.InvalidURL for a malformed ip, which is not a RequestError
+        error = f"envoi à {target} impossible: {e!r}"
+    else:
+        return ChannelDelivery(channel=channel, target=target, delivered=True)
+
+    print(f"[{channel.upper()}][ERROR] {error}")
+    return ChannelDelivery(channel=channel, target=target, delivered=False, error=error)
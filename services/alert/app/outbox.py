@@ -0,0 +1,143 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import httpx
+from floodcast_common.metrics import LATENCY_BUCKETS, stage
+from prometheus_client import Histogram
+
+from app.db.models import AlertOutbox
+from app.db.repo import DB
+from app.dependencies.config import ConfigModel
+from app.models.prediction import PredictionModel
+from app.notify import deliver, mailto, send_to_ip
+
+# Poll interval when the outbox is empty. Enqueuing wakes the workers up early.
+IDLE_POLL_SECONDS = 1.0
+MAX_RETRY_DELAY = timedelta(minutes=10)
+
+DELIVERY_DELAY = Histogram(
+    "alert_delivery_delay_seconds",
+    "Time from enqueuing an alert to the end of a delivery attempt.",
+    ["channel", "outcome"],
+    buckets=LATENCY_BUCKETS + (120.0, 300.0, 600.0, 1800.0),
+)
+
+
+class OutboxWorkers:
+    """
+    Pool of background workers draining the alert outbox.
+    Throughput scales with `outbox_workers` and `alert_concurrency`, which
+    reconfigure() applies while running.
+    """
+
+    def __init__(self, db: DB, client: httpx.AsyncClient, config: ConfigModel) -> None:
+        self.db = db
+        self.client = client
+        self.config = config
+        self.semaphore = asyncio.Semaphore(config.alert_concurrency)
+        self.wakeup = asyncio.Event()
+        self.tasks: list[asyncio.Task] = []
+
+    def start(self):
+        self.tasks = [
+            asyncio.create_task(self.run(i), name=f"outbox-worker-{i}")
+            for i in range(self.config.outbox_workers)
+        ]
+
+    def reconfigure(self, config: ConfigModel):
+        """
+        Apply a new config. Extra workers stop after their current batch, and
+        sends in flight keep the previous concurrency limit.
+        """
+        if config.alert_concurrency != self.config.alert_concurrency:
+            self.semaphore = asyncio.Semaphore(config.alert_concurrency)
+        self.config = config
+        self.tasks = [t for t in self.tasks if not t.done()]
+        running = {t.get_name() for t in self.tasks}
+        for i in range(config.outbox_workers):
+            if f"outbox-worker-{i}" not in running:
+                self.tasks.append(
+                    asyncio.create_task(self.run(i), name=f"outbox-worker-{i}")
+                )
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def notify(self):
+        """
+        Wake up idle workers, e.g. after new alerts were enqueued.
+        """
+        self.wakeup.set()
+
+    async def run(self, index: int):
+        while index < self.config.outbox_workers:
+            try:
+                processed = await self.process_batch()
+            except Exception as e:
+                print(f"[OUTBOX][ERROR] {e!r}")
+                processed = 0
+
+            if processed == 0:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), IDLE_POLL_SECONDS)
+                except TimeoutError:
+                    pass
+
+    async def process_batch(self) -> int:
+        alerts = await self.db.claim_alerts(
+            self.config.outbox_batch_size,
+            timedelta(seconds=self.config.outbox_lease_seconds),
+        )
+        if not alerts:
+            return 0
+
+        with stage("fanout"):
+            outcomes = await asyncio.gather(*(self.send(a) for a in alerts))
+
+        now = datetime.now()
+        for alert, outcome in zip(alerts, outcomes):
+            DELIVERY_DELAY.labels(
+                alert.channel, "delivered" if outcome.delivered else "failed"
+            ).observe((now - alert.created_at).total_seconds())
+
+        await self.db.mark_alerts(
+            sent=[a.id for a, o in zip(alerts, outcomes) if o.delivered],
+            failed=[
+                (a.id, o.error or "unknown error", self.retry_at(a))
+                for a, o in zip(alerts, outcomes)
+                if not o.delivered
+            ],
+        )
+        return len(alerts)
+
+    def send(self, alert: AlertOutbox):
+        async def send():
+            prediction = PredictionModel.model_validate_json(alert.payload)
+            if alert.channel == "mail":
+                await mailto(alert.target, prediction)
+            else:
+                await send_to_ip(
+                    self.client, alert.target, prediction, alert.idempotency_key
+                )
+
+        return deliver(
+            alert.channel,
+            alert.target,
+            send,
+            self.semaphore,
+            self.config.alert_timeout,
+        )
+
+    def retry_at(self, alert: AlertOutbox) -> datetime | None:
+        """
+        Exponential backoff, or None once the alert is out of attempts.
+        """
+        if alert.attempts >= self.config.outbox_max_attempts:
+            return None
+        delay = timedelta(
+            seconds=self.config.outbox_retry_base_seconds * 2 ** (alert.attempts - 1)
+        )
+        return datetime.now() + min(delay, MAX_RETRY_DELAY)
@@ -0,0 +1,67 @@
+import asyncio
+from datetime import datetime
+
+import httpx
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.db.models import Base
+from app.db.repo import DB
+from app.dependencies.config import ConfigModel
+from app.models.prediction import PredictionModel
+from app.models.user import UserModel
+from app.outbox import OutboxWorkers
+
+PREDICTION = PredictionModel(
+    id=1,
+    segment_id=7,
+    severity=0.8,
+    probability=0.9,
+    start_date=datetime(2025, 3, 1, 10),
+    end_date=datetime(2025, 3, 1, 16),
+)
+
+
+async def process_one_batch(ips: list[str], max_attempts: int):
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    db = DB(engine)
+    await db.upsert_users(
+        [
+            UserModel(name=ip, mail=f"user{i}@example.com", ip=ip, segments_ids=[7])
+            for i, ip in enumerate(ips)
+        ]
+    )
+    await db.enqueue_prediction_alerts(PREDICTION, batch_size=100)
+
+    config = ConfigModel(
+        log_level="debug",
+        db_url="sqlite+aiosqlite://",
+        outbox_max_attempts=max_attempts,
+    )
+    transport = httpx.MockTransport(lambda request: httpx.Response(200))
+    async with httpx.AsyncClient(transport=transport) as client:
+        processed = await OutboxWorkers(db, client, config).process_batch()
+    alerts = await db.get_alerts(PREDICTION.id)
+    await db.close()
+    return processed, {(a.channel, a.target): a for a in alerts}
+
+
+def test_invalid_targets_do_not_abort_the_batch():
+    ips = ["10.0.0.1", "::1", "[::1"]
+    processed, alerts = asyncio.run(process_one_batch(ips, max_attempts=5))
+
+    assert processed == 6
+    assert all(
+        a.status == "sent" for (channel, _), a in alerts.items() if channel == "mail"
+    )
+    assert alerts["ip", "10.0.0.1"].status == "sent"
+    for ip in ["::1", "[::1"]:
+        assert alerts["ip", ip].status == "pending"
+        assert alerts["ip", ip].last_error
+
+
+def test_invalid_targets_fail_once_out_of_attempts():
+    _, alerts = asyncio.run(process_one_batch(["[::1"], max_attempts=1))
+
+    assert alerts["ip", "[::1"].status == "failed"
@@ -1,27 +1,77 @@
-from fastapi import FastAPI, HTTPException
-import yaml
+import asyncio
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager, suppress
+
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 import os
+from floodcast_common.metrics import instrument
+from floodcast_common.readiness import Readiness
 
-app = FastAPI()
+from app.store import ConfigEntry, ConfigStore
 
 CONFIG_DIR = os.path.join(os.path.dirname(__file__), "../config-repo")
 
+# Longest a watch request may be held open, in seconds
+MAX_WATCH_TIMEOUT = 300.0
+
+store = ConfigStore(CONFIG_DIR)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    watcher = asyncio.create_task(store.watch())
+    try:
+        yield
+    finally:
+        watcher.cancel()
+        with suppress(asyncio.CancelledError):
+            await watcher
+
+
+app = FastAPI(lifespan=lifespan)
+instrument(app)
+Readiness().install(app)
+
+
 # DO NOT REMOVE
 # Docker health check calls the root endpoint
+# Kept free of any file or config access so that it costs nothing
 @app.get("/")
 async def root():
     return "Hello from config service"
 
-@app.get("/config/{service_name}")
-async def get_config(service_name: str):
-    filename = f"{service_name}.yml"
-    filepath = os.path.join(CONFIG_DIR, filename)
 
-    if not os.path.exists(filepath):
+def config_response(service_name: str, entry: ConfigEntry | None, if_none_match: str | None):
+    if entry is None:
         raise HTTPException(status_code=404, detail="Config not found")
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if if_none_match is not None and entry.etag in if_none_match.split(", "):
+        return Response(status_code=304, headers=headers)
+    return Response(
+        content=entry.body,
+        media_type="application/json",
+        headers=headers,
+    )
 
-    with open(filepath, "r") as f:
-        config = yaml.safe_load(f)
 
-    return {"service": service_name, "config": config}
+@app.get("/config/{service_name}")
+async def get_config(service_name: str, request: Request):
+    return config_response(
+        service_name, store.get(service_name), request.headers.get("if-none-match")
+    )
+
 
+@app.get("/config/{service_name}/watch")
+async def watch_config(
+    service_name: str,
+    request: Request,
+    etag: str | None = None,
+    timeout: float = Query(30.0, gt=0, le=MAX_WATCH_TIMEOUT),
+):
+    """
+    Long poll: answer as soon as the config's ETag differs from `etag` (or the
+    If-None-Match header), or with 304 Not Modified after `timeout` seconds.
+    """
+    etag = etag or request.headers.get("if-none-match")
+    entry = await store.wait_for_change(service_name, etag, timeout)
+    return config_response(service_name, entry, etag)
@@ -0,0 +1,95 @@
+import asyncio
+import hashlib
+import json
+import os
+from dataclasses import dataclass, field
+
+import yaml
+
+# Interval at which config files are checked for changes, in seconds
+WATCH_INTERVAL = 1.0
+
+
+@dataclass
+class ConfigEntry:
+    config: dict
+    # Serialized response, built once per file version
+    body: bytes
+    etag: str
+    mtime_ns: int
+
+
+@dataclass
+class ConfigStore:
+    """
+    Parsed configs kept in memory, reloaded when their file's mtime changes.
+    """
+
+    config_dir: str
+    entries: dict[str, ConfigEntry] = field(default_factory=dict)
+    changed: dict[str, asyncio.Event] = field(default_factory=dict)
+
+    def path(self, service_name: str) -> str:
+        return os.path.join(self.config_dir, f"{service_name}.yml")
+
+    def get(self, service_name: str) -> ConfigEntry | None:
+        """
+        Current config of a service, or None if it has no config file.
+        Costs a stat call unless the file changed. Clients waiting on the
+        config are woken up when it did, whoever noticed it first.
+        """
+        try:
+            mtime_ns = os.stat(self.path(service_name)).st_mtime_ns
+        except FileNotFoundError:
+            if self.entries.pop(service_name, None) is not None:
+                self._notify(service_name)
+            return None
+
+        previous = entry = self.entries.get(service_name)
+        if entry is None or entry.mtime_ns != mtime_ns:
+            with open(self.path(service_name), "r") as f:
+                config = yaml.safe_load(f)
+            body = json.dumps(
+                {"service": service_name, "config": config}, default=str
+            ).encode()
+            etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+            entry = ConfigEntry(config=config, body=body, etag=etag, mtime_ns=mtime_ns)
+            self.entries[service_name] = entry
+            if previous is None or previous.etag != etag:
+                self._notify(service_name)
+        return entry
+
+    def _notify(self, service_name: str):
+        event = self.changed.pop(service_name, None)
+        if event is not None:
+            event.set()
+
+    async def wait_for_change(
+        self, service_name: str, etag: str | None, timeout: float
+    ) -> ConfigEntry | None:
+        """
+        Wait until the config's etag differs from the given one, for at most
+        timeout seconds. Returns the current entry either way.
+        """
+        entry = self.get(service_name)
+        if entry is None or entry.etag != etag:
+            return entry
+
+        event = self.changed.setdefault(service_name, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except TimeoutError:
+            pass
+        return self.get(service_name)
+
+    async def watch(self):
+        """
+        Poll the files that clients are waiting on, and wake them up on changes.
+        """
+        while True:
+            await asyncio.sleep(WATCH_INTERVAL)
+            for service_name in list(self.changed):
+                try:
+                    self.get(service_name)
+                except (OSError, yaml.YAMLError) as e:
+                    print(f"Warning: could not reload config {service_name}: {e}")
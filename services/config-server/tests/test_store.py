@@ -0,0 +1,49 @@
+import asyncio
+import os
+from pathlib import Path
+
+from app.store import ConfigStore
+
+
+def write_config(path: Path, text: str, mtime_ns: int):
+    path.write_text(text)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_get_wakes_watchers_of_a_changed_config(tmp_path: Path):
+    async def scenario():
+        store = ConfigStore(str(tmp_path))
+        write_config(tmp_path / "alert.yml", "alert_timeout: 3\n", 1_000_000_000)
+        entry = store.get("alert")
+        assert entry is not None
+
+        waiter = asyncio.create_task(store.wait_for_change("alert", entry.etag, 5))
+        await asyncio.sleep(0)
+        write_config(tmp_path / "alert.yml", "alert_timeout: 5\n", 2_000_000_000)
+        # Noticed by another client's plain GET, while no watch loop runs
+        store.get("alert")
+
+        async with asyncio.timeout(1):
+            changed = await waiter
+        assert changed is not None
+        assert changed.config == {"alert_timeout": 5}
+
+    asyncio.run(scenario())
+
+
+def test_get_wakes_watchers_of_a_removed_config(tmp_path: Path):
+    async def scenario():
+        store = ConfigStore(str(tmp_path))
+        write_config(tmp_path / "alert.yml", "alert_timeout: 3\n", 1_000_000_000)
+        entry = store.get("alert")
+        assert entry is not None
+
+        waiter = asyncio.create_task(store.wait_for_change("alert", entry.etag, 5))
+        await asyncio.sleep(0)
+        (tmp_path / "alert.yml").unlink()
+        assert store.get("alert") is None
+
+        async with asyncio.timeout(1):
+            assert await waiter is None
+
+    asyncio.run(scenario())
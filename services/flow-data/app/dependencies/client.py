@@ -0,0 +1,14 @@
+from typing import Annotated
+
+from fastapi import Depends, Request
+from httpx import AsyncClient
+
+
+def get_client(request: Request) -> AsyncClient:
+    """
+    Shared Hub'Eau client, opened once in the app lifespan.
+    """
+    return request.app.state.hubeau_client
+
+
+HubEauClient = Annotated[AsyncClient, Depends(get_client)]
@@ -1,27 +1,25 @@
 from typing import Annotated, Literal
 
-from async_lru import alru_cache
 from fastapi import Depends
-from httpx import AsyncClient
+from floodcast_common.config import ConfigClient
 from pydantic import BaseModel
 
 
 class ConfigModel(BaseModel):
     log_level: Literal["debug"]
+    # Maximum number of concurrent Hub'Eau calls for one batch query
+    batch_concurrency: int = 8
+    # Hub'Eau site codes polled in the background for /measurements/flow/stream
+    watched_stations: list[str] = []
+    # Hub'Eau publishes a new observation about every 5 minutes
+    poll_interval_seconds: float = 300
 
 
-@alru_cache(maxsize=32)
-async def fetch_config() -> ConfigModel:
-    url = "http://config-service:8000/config/flow-data"
-    async with AsyncClient() as client:
-        r = await client.get(url)
-        r.raise_for_status()
-        data = r.json()
-        return ConfigModel(**data["config"])
+config_client = ConfigClient("flow-data", ConfigModel)
 
 
 async def get_config() -> ConfigModel:
-    return await fetch_config()
+    return config_client.current
 
 
 Config = Annotated[ConfigModel, Depends(get_config)]
@@ -0,0 +1,15 @@
+from typing import Annotated
+
+from fastapi import Depends, Request
+
+from app.stream import ObservationStream
+
+
+def get_observation_stream(request: Request) -> ObservationStream:
+    """
+    Pollers of the watched stations, started in the app lifespan.
+    """
+    return request.app.state.observation_stream
+
+
+Observations = Annotated[ObservationStream, Depends(get_observation_stream)]
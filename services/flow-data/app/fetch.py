@@ -1,10 +1,14 @@
+import os
 from datetime import date, datetime
 from typing import Literal
 
+from floodcast_common.metrics import upstream_call
 from httpx import AsyncClient
 from pydantic import BaseModel, Field, OnErrorOmit, model_validator
 
-BASE_URL = "https://hubeau.eaufrance.fr/api/v2/hydrometrie"
+BASE_URL = os.environ.get(
+    "HUBEAU_BASE_URL", "https://hubeau.eaufrance.fr/api/v2/hydrometrie"
+)
 
 
 class SiteInfo(BaseModel):
@@ -28,10 +32,11 @@ class SiteQueryParams(BaseModel):
 
 async def locate_nearest_station(query: SiteQueryParams) -> SiteInfo | None:
     async with AsyncClient() as client:
-        r = await client.get(
-            BASE_URL + "/referentiel/sites",
-            params=query.model_dump(by_alias=True, exclude_none=True),
-        )
+        with upstream_call("hubeau", "referentiel/sites"):
+            r = await client.get(
+                BASE_URL + "/referentiel/sites",
+                params=query.model_dump(by_alias=True, exclude_none=True),
+            )
     stations = SiteQueryResponse.model_validate_json(r.text)
     if len(stations.data) == 0:
         return None
@@ -43,18 +48,28 @@ async def locate_nearest_station(query: SiteQueryParams) -> SiteInfo | None:
 
 
 class FlowQueryParams(BaseModel):
-    latitude: float
-    longitude: float
-    max_distance: int = Field(serialization_alias="distance")
-    # site_code: str = Field(serialization_alias="code_entite")
+    latitude: float | None = None
+    longitude: float | None = None
+    max_distance: int | None = Field(default=None, serialization_alias="distance")
+    site_code: str | None = Field(default=None, serialization_alias="code_entite")
     start_date: datetime | None = Field(
         default=None, serialization_alias="date_debut_obs"
     )
     end_date: datetime | None = Field(default=None, serialization_alias="date_fin_obs")
-    measure: Literal["Q", "H"] = Field(
+    # None fetches both measures in a single call
+    measure: Literal["Q", "H"] | None = Field(
         default="Q", serialization_alias="grandeur_hydro"
     )
 
+    @model_validator(mode="after")
+    def check_location(self):
+        coordinates = (self.latitude, self.longitude, self.max_distance)
+        if self.site_code is None and None in coordinates:
+            raise ValueError(
+                "Either site_code or latitude, longitude and max_distance are required"
+            )
+        return self
+
 
 class FlowInfo(BaseModel):
     site_info: SiteInfo
@@ -81,12 +96,25 @@ class FlowResponse(BaseModel):
     data: list[FlowInfo]
 
 
-async def fetch_flows(query: FlowQueryParams) -> FlowResponse:
-    async with AsyncClient() as client:
-        r = await client.get(
-            BASE_URL + "/observations_tr",
-            params=query.model_dump(by_alias=True, exclude_none=True),
-        )
+async def fetch_flows(
+    query: FlowQueryParams,
+    client: AsyncClient | None = None,
+) -> FlowResponse:
+    close_client = client is None
+    if close_client:
+        client = AsyncClient()
+
+    try:
+        with upstream_call("hubeau", "observations_tr"):
+            r = await client.get(
+                BASE_URL + "/observations_tr",
+                params=query.model_dump(by_alias=True, exclude_none=True),
+            )
+            _ = r.raise_for_status()
+    finally:
+        if close_client:
+            await client.aclose()
+
     stations = FlowResponse.model_validate_json(r.text, by_alias=True)
     return stations
 
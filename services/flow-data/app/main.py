@@ -1,9 +1,19 @@
+import asyncio
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
 from datetime import date, datetime, timedelta
 from typing import Annotated
 
 from fastapi import FastAPI, HTTPException, Query
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse
+from httpx import AsyncClient, HTTPError, Limits
+from floodcast_common.metrics import instrument
+from floodcast_common.readiness import Readiness
+from pydantic import BaseModel, Field, ValidationError
 
+from app.dependencies.client import HubEauClient
+from app.dependencies.config import Config, config_client
+from app.dependencies.stream import Observations
 from app.fetch import (
     FlowInfo,
     FlowQueryParams,
@@ -11,8 +21,26 @@ from app.fetch import (
     fetch_flows,
     latest_measure,
 )
+from app.stream import ObservationStream
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    async with config_client, AsyncClient(
+        timeout=30, limits=Limits(max_connections=32, max_keepalive_connections=32)
+    ) as client:
+        app.state.hubeau_client = client
+        app.state.observation_stream = ObservationStream(config_client)
+        app.state.observation_stream.start(client)
+        try:
+            yield
+        finally:
+            await app.state.observation_stream.stop()
+
+
+app = FastAPI(lifespan=lifespan)
+instrument(app)
+Readiness().install(app)
 
 
 @app.get("/")
@@ -21,8 +49,10 @@ async def root():
 
 
 @app.get("/measurements")
-async def get_data(query: Annotated[FlowQueryParams, Query()]) -> FlowResponse:
-    return await fetch_flows(query)
+async def get_data(
+    query: Annotated[FlowQueryParams, Query()], client: HubEauClient
+) -> FlowResponse:
+    return await fetch_flows(query, client)
 
 
 class LatestFlowQueryParams(BaseModel):
@@ -32,14 +62,17 @@ class LatestFlowQueryParams(BaseModel):
 
 
 @app.get("/measurements/flow/latest")
-async def get_latest_flow(query: Annotated[LatestFlowQueryParams, Query()]) -> FlowInfo:
+async def get_latest_flow(
+    query: Annotated[LatestFlowQueryParams, Query()], client: HubEauClient
+) -> FlowInfo:
     res = await fetch_flows(
         FlowQueryParams(
             latitude=query.latitude,
             longitude=query.longitude,
             max_distance=query.max_distance,
             start_date=datetime.now() - timedelta(hours=1),
-        )
+        ),
+        client,
     )
     latest = latest_measure(res, measure="Q")
     if latest is None:
@@ -47,3 +80,95 @@ async def get_latest_flow(query: Annotated[LatestFlowQueryParams, Query()]) -> F
             404, "Yesterday's max flow rate not found for this location."
         )
     return latest
+
+
+class StationQuery(BaseModel):
+    """
+    A station, given either by its Hub'Eau site code or by coordinates.
+    """
+
+    site_code: str | None = None
+    latitude: float | None = None
+    longitude: float | None = None
+    max_distance: int | None = None
+
+
+class BatchLatestFlowQuery(BaseModel):
+    stations: list[StationQuery] = Field(min_length=1, max_length=100)
+
+
+class StationLatestFlow(BaseModel):
+    station: StationQuery
+    flow: FlowInfo | None = None
+    height: FlowInfo | None = None
+    error: str | None = None
+
+
+async def station_latest_flow(
+    station: StationQuery,
+    client: AsyncClient,
+    semaphore: asyncio.Semaphore,
+) -> StationLatestFlow:
+    """
+    Latest Q and H for one station. Failures are reported in the result
+    rather than raised, so one bad station does not fail the whole batch.
+    """
+    try:
+        query = FlowQueryParams(
+            **station.model_dump(),
+            start_date=datetime.now() - timedelta(hours=1),
+            measure=None,
+        )
+        async with semaphore:
+            res = await fetch_flows(query, client)
+    except ValidationError as e:
+        return StationLatestFlow(station=station, error=e.errors()[0]["msg"])
+    except HTTPError as e:
+        return StationLatestFlow(station=station, error=f"Hub'Eau request failed: {e}")
+
+    result = StationLatestFlow(
+        station=station,
+        flow=latest_measure(res, measure="Q"),
+        height=latest_measure(res, measure="H"),
+    )
+    if result.flow is None and result.height is None:
+        result.error = "No recent measurement found for this station."
+    return result
+
+
+@app.post("/measurements/flow/latest/batch")
+async def get_latest_flow_batch(
+    query: BatchLatestFlowQuery, config: Config, client: HubEauClient
+) -> list[StationLatestFlow]:
+    """
+    Latest Q/H for several stations at once, fetched concurrently.
+    Results are in the same order as the requested stations.
+    """
+    semaphore = asyncio.Semaphore(config.batch_concurrency)
+    return await asyncio.gather(
+        *(station_latest_flow(s, client, semaphore) for s in query.stations)
+    )
+
+
+@app.get("/measurements/flow/stream")
+async def stream_flows(
+    observations: Observations,
+    site_code: Annotated[list[str] | None, Query()] = None,
+) -> StreamingResponse:
+    """
+    Server-sent events of the new Q and H observations of the watched stations,
+    or of the given ones only. Each event is a FlowInfo, the latest known one
+    of each station and measure being sent first. Stations are polled once
+    for all subscribers, so this is cheaper than polling /measurements/flow/latest.
+    """
+    watched = observations.watched
+    site_codes = frozenset(site_code) if site_code else watched
+    if not site_codes <= watched:
+        raise HTTPException(
+            404, f"Stations not watched: {', '.join(sorted(site_codes - watched))}"
+        )
+    return StreamingResponse(
+        observations.events(site_codes),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,175 @@
+"""
+Push delivery of new Hub'Eau observations.
+
+One poller per watched station (watched_stations in the config) calls
+observations_tr every poll_interval_seconds, however many subscribers there
+are, and publishes the observations newer than the ones it already saw.
+Subscribers receive them as server-sent events from /measurements/flow/stream,
+starting with the latest known observation of each measure.
+"""
+
+import asyncio
+from collections.abc import AsyncIterator, Iterator
+from contextlib import contextmanager
+from datetime import UTC, datetime, timedelta
+
+from floodcast_common.config import ConfigClient
+from httpx import AsyncClient
+
+from app.dependencies.config import ConfigModel
+from app.fetch import FlowInfo, FlowQueryParams, fetch_flows
+
+# Polls look back at most this far, as /measurements/flow/latest does
+LOOKBACK = timedelta(hours=1)
+# Watched stations added to or removed from the config are picked up this often
+RECONCILE_SECONDS = 30
+# Comment sent on idle streams, under the proxies' read timeouts
+KEEPALIVE_SECONDS = 15
+# Observations a slow subscriber may lag behind, the oldest are dropped beyond
+SUBSCRIBER_BUFFER = 100
+
+type ObservationKey = tuple[str, str]
+
+
+class Subscription:
+    def __init__(self, site_codes: frozenset[str]) -> None:
+        self.site_codes = site_codes
+        self.queue: asyncio.Queue[tuple[str, FlowInfo]] = asyncio.Queue(
+            SUBSCRIBER_BUFFER
+        )
+        self.dropped = 0
+
+    def put(self, site_code: str, observation: FlowInfo):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait((site_code, observation))
+
+
+def format_event(site_code: str, observation: FlowInfo) -> str:
+    return (
+        "event: observation\n"
+        f"id: {site_code}/{observation.measure}/{observation.obs_date.isoformat()}\n"
+        f"data: {observation.model_dump_json()}\n\n"
+    )
+
+
+class ObservationStream:
+    """
+    Pollers of the watched stations, and the subscribers their new
+    observations are published to.
+    """
+
+    def __init__(self, config_client: ConfigClient[ConfigModel]) -> None:
+        self.config_client = config_client
+        # Latest observation of each station and measure
+        self.latest: dict[ObservationKey, FlowInfo] = {}
+        self.subscriptions: set[Subscription] = set()
+        self.pollers: dict[str, asyncio.Task[None]] = {}
+        self.task: asyncio.Task[None] | None = None
+
+    @property
+    def watched(self) -> frozenset[str]:
+        return frozenset(self.config_client.current.watched_stations)
+
+    def start(self, client: AsyncClient):
+        self.task = asyncio.create_task(self.run(client), name="observation-stream")
+
+    async def stop(self):
+        tasks = [t for t in [self.task, *self.pollers.values()] if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def run(self, client: AsyncClient):
+        while True:
+            watched = self.watched
+            # Pollers do not stop on errors, restarted in case one did anyway
+            stopped = {s for s, t in self.pollers.items() if t.done()}
+            for site_code in (watched - self.pollers.keys()) | (watched & stopped):
+                self.pollers[site_code] = asyncio.create_task(
+                    self.poll(site_code, client), name=f"poll-{site_code}"
+                )
+            for site_code in self.pollers.keys() - watched:
+                self.pollers.pop(site_code).cancel()
+                for key in [k for k in self.latest if k[0] == site_code]:
+                    del self.latest[key]
+            await asyncio.sleep(RECONCILE_SECONDS)
+
+    async def poll(self, site_code: str, client: AsyncClient):
+        while True:
+            try:
+                await self.poll_once(site_code, client)
+            except Exception as e:
+                print(f"[STREAM][ERROR] Polling {site_code} failed: {e!r}")
+            await asyncio.sleep(self.config_client.current.poll_interval_seconds)
+
+    async def poll_once(self, site_code: str, client: AsyncClient) -> int:
+        """
+        Fetch the observations of site_code since the latest one seen, and
+        publish the new ones. Returns how many were published.
+        """
+        start = datetime.now(UTC) - LOOKBACK
+        seen = [o.obs_date for (s, _), o in self.latest.items() if s == site_code]
+        if seen:
+            start = max(start, min(seen))
+        flows = await fetch_flows(
+            FlowQueryParams(site_code=site_code, start_date=start, measure=None),
+            client,
+        )
+        published = 0
+        for observation in sorted(flows.data, key=lambda o: o.obs_date):
+            published += self.publish(site_code, observation)
+        return published
+
+    def publish(self, site_code: str, observation: FlowInfo) -> bool:
+        """
+        Send observation to the subscribers of site_code, unless it is not
+        newer than the latest one of its measure.
+        """
+        key = (site_code, observation.measure)
+        latest = self.latest.get(key)
+        if latest is not None and observation.obs_date <= latest.obs_date:
+            return False
+        self.latest[key] = observation
+        for subscription in self.subscriptions:
+            if site_code in subscription.site_codes:
+                subscription.put(site_code, observation)
+        return True
+
+    @contextmanager
+    def subscribe(self, site_codes: frozenset[str]) -> Iterator[Subscription]:
+        subscription = Subscription(site_codes)
+        self.subscriptions.add(subscription)
+        try:
+            yield subscription
+        finally:
+            self.subscriptions.remove(subscription)
+            if subscription.dropped:
+                print(
+                    f"[STREAM] Subscriber of {sorted(site_codes)} missed "
+                    f"{subscription.dropped} observations"
+                )
+
+    async def events(self, site_codes: frozenset[str]) -> AsyncIterator[str]:
+        """
+        Server-sent events of the observations of site_codes, until the client
+        disconnects.
+        """
+        with self.subscribe(site_codes) as subscription:
+            # Taken with the subscription, so that nothing is sent twice
+            current = sorted(
+                ((k, o) for k, o in self.latest.items() if k[0] in site_codes),
+                key=lambda item: item[0],
+            )
+            for (site_code, _), observation in current:
+                yield format_event(site_code, observation)
+
+            while True:
+                try:
+                    async with asyncio.timeout(KEEPALIVE_SECONDS):
+                        site_code, observation = await subscription.queue.get()
+                except TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_event(site_code, observation)
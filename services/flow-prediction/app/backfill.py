@@ -0,0 +1,339 @@
+"""
+Historical backfill of the rainfall flow at the outlet, from the Coméphores
+archive on local disk (see models/comephores).
+
+    cd services/flow-prediction
+    uv run --extra backfill python -m app.backfill 2019-01-01 2023-12-31 --output backfill
+
+Days are split across a process pool. The volume of each hour's rain reaching
+the outlet after each travel hour is written to
+{output}/volumes-{resolution}m/{day}.parquet as soon as a day is done, and days
+already there are skipped, so an interrupted run resumes where it stopped.
+Days written while some of their Coméphores files were missing are done again
+once more of them are there. The hourly flow series is then written to
+{output}/flow-{resolution}m.parquet.
+
+The regridding weights are kept in {output}/weights-{resolution}m.npz, with the
+size and modification time of the watershed raster they were computed from in
+weights-{resolution}m.json. They are recomputed, and the days done again, when
+the raster changes.
+"""
+
+import argparse
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+import rasterio  # pyright: ignore[reportMissingTypeStubs]
+
+from app.predict.parameters import PARAMETERS
+from app.predict.predict_flow_rate import BIN_SIZE, FLOW_RATE_DIV, MAX_TRAVEL_TIME
+from app.predict.regrid import RegridWeights
+from app.predict.watershed import (
+    FULL_RESOLUTION,
+    load_base_watershed,
+    scaled_hours,
+    source_info,
+    watershed_path,
+)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+COMEPHORES_DIR = Path(
+    os.environ.get(
+        "COMEPHORES_DIR", Path(__file__).parents[3] / "models" / "comephores" / "data"
+    )
+)
+# Same files as weather-data's /rainfall/local
+FILE_PATTERN = "%Y%m%d%H_ERR.gtif"
+
+# Set once per worker process
+_weights: RegridWeights | None = None
+_comephores_dir: Path | None = None
+
+
+def comephores_path(comephores_dir: Path, hour: datetime) -> Path:
+    return comephores_dir / hour.strftime(FILE_PATTERN)
+
+
+def day_hours(day: date) -> list[datetime]:
+    start = datetime.combine(day, datetime.min.time())
+    return [start + timedelta(hours=h) for h in range(24)]
+
+
+def available_hours(comephores_dir: Path, day: date) -> int:
+    """
+    Number of hours of day with a Coméphores file.
+    """
+    return sum(comephores_path(comephores_dir, h).is_file() for h in day_hours(day))
+
+
+def is_done(path: Path, comephores_dir: Path, day: date) -> bool:
+    """
+    Whether the part file of day has all the hours Coméphores now has.
+    """
+    assert pq is not None
+    if not path.exists():
+        return False
+    return pq.read_metadata(path).num_rows >= available_hours(comephores_dir, day)
+
+
+def pending_days(days: list[date], parts_dir: Path, comephores_dir: Path) -> list[date]:
+    return [
+        d for d in days if not is_done(parts_dir / f"{d}.parquet", comephores_dir, d)
+    ]
+
+
+def _init_worker(weights_path: Path, comephores_dir: Path):
+    global _weights, _comephores_dir
+    _weights = RegridWeights.load(weights_path)
+    _comephores_dir = comephores_dir
+
+
+def day_volumes(day: date) -> tuple[list[datetime], np.ndarray]:
+    """
+    Hours of day with a Coméphores file, and for each the volume (m³) of its
+    rain reaching the outlet in each travel hour.
+    """
+    assert _weights is not None and _comephores_dir is not None
+    hours, volumes = [], []
+    for hour in day_hours(day):
+        path = comephores_path(_comephores_dir, hour)
+        if not path.is_file():
+            continue
+        with rasterio.open(path) as ds:
+            rain = ds.read(1, window=_weights.window, masked=True).filled(0)
+        hours.append(hour)
+        volumes.append(_weights.volumes_m3(rain))
+    return hours, np.array(volumes).reshape(len(hours), _weights.hours)
+
+
+def write_volumes(path: Path, hours: list[datetime], volumes: np.ndarray):
+    """
+    Write atomically, so that a part file is always complete.
+    """
+    assert pa is not None and pq is not None
+    table = pa.table(
+        {
+            "time": pa.array(hours, pa.timestamp("s")),
+            "volume_m3": pa.FixedSizeListArray.from_arrays(
+                pa.array(volumes.ravel()), volumes.shape[1]
+            ),
+        }
+    )
+    tmp = path.with_name(f".{path.name}")
+    pq.write_table(table, tmp)
+    os.replace(tmp, path)
+
+
+def _backfill_day(day: date, path: Path) -> int:
+    """
+    Days without any Coméphores file are not written, to be retried once
+    downloaded. Days with some of them are, and retried by is_done once more
+    are there.
+    """
+    hours, volumes = day_volumes(day)
+    if hours:
+        write_volumes(path, hours, volumes)
+    return len(hours)
+
+
+def prepare_weights(
+    weights_path: Path, comephores_dir: Path, resolution: int, parts_dir: Path
+):
+    """
+    Compute the regridding weights, unless weights_path has them for the
+    current watershed raster. Part files computed with previous weights are
+    removed.
+    """
+    manifest_path = weights_path.with_suffix(".json")
+    source = source_info(watershed_path(resolution))
+    try:
+        manifest = json.loads(manifest_path.read_text())
+    except (OSError, ValueError):
+        manifest = None
+    if weights_path.exists() and manifest == {"source": source}:
+        return
+
+    grid = next(comephores_dir.glob("*_ERR.gtif"), None)
+    if grid is None:
+        raise FileNotFoundError(f"No Coméphores file in {comephores_dir}")
+    if any(parts_dir.glob("*.parquet")):
+        print(f"Watershed raster changed, removing the days done in {parts_dir}")
+        shutil.rmtree(parts_dir)
+        parts_dir.mkdir()
+    print(f"Computing regridding weights on the grid of {grid.name}")
+    with rasterio.open(grid) as ds:
+        weights = RegridWeights.compute(load_base_watershed(resolution), ds)
+    tmp = weights_path.with_name(f".{weights_path.name}")
+    weights.save(tmp)
+    os.replace(tmp, weights_path)
+    manifest_path.write_text(json.dumps({"source": source}))
+
+
+def rescale_volumes(volumes: np.ndarray, velocity_scale: float) -> np.ndarray:
+    """
+    Volumes (hours, travel hours) once flow velocities are multiplied by
+    velocity_scale, as WatershedModel.with_velocity_scale.
+    """
+    hours = scaled_hours(volumes.shape[1], velocity_scale)
+    regroup = np.zeros((volumes.shape[1], hours[-1] + 1))
+    regroup[np.arange(volumes.shape[1]), hours] = 1
+    return volumes @ regroup
+
+
+def bin_flow_series(
+    volumes: np.ndarray, bin_size_hours: int, max_travel_time_hours: int
+) -> np.ndarray:
+    """
+    Volume (m³) of the rain over the bin_size_hours before each travel time
+    bin falling on the cells of that bin, for each bin (bins, hours), as
+    estimate_outlet_flow_rate computes it for the end of each of the hours of
+    volumes (hours, travel hours). NaN until the bin's rain is known, and
+    where an hour is missing.
+    """
+    n, hours = volumes.shape
+    bins = range(0, max_travel_time_hours, bin_size_hours)
+    series = np.full((len(bins), n), np.nan)
+    for i, bin_start in enumerate(bins):
+        bin_volumes = volumes[:, min(bin_start, hours) : bin_start + bin_size_hours]
+        per_hour = bin_volumes.sum(axis=1)
+        # Rain of the bin_size_hours hours ending bin_start hours before each hour
+        sums = np.lib.stride_tricks.sliding_window_view(
+            per_hour, bin_size_hours
+        ).sum(axis=1)
+        series[i, bin_start + bin_size_hours - 1 :] = sums[
+            : max(0, len(sums) - bin_start)
+        ]
+    return series
+
+
+def rainfall_flow_series(
+    volumes: np.ndarray, bin_size_hours: int, max_travel_time_hours: int
+) -> np.ndarray:
+    """
+    Rainfall flow rate (m³/h) reaching the outlet at the end of each hour of
+    volumes (hours, travel hours).
+    """
+    series = bin_flow_series(volumes, bin_size_hours, max_travel_time_hours)
+    return series.sum(axis=0) / bin_size_hours
+
+
+def load_hourly_volumes(
+    parts: list[Path], first_hour: np.datetime64, end_hour: np.datetime64
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Consecutive hours from first_hour to end_hour, excluded, and their volumes
+    (hours, travel hours) read from the existing parts, NaN where Coméphores
+    has no file.
+    """
+    assert pa is not None and pq is not None
+    tables = [pq.read_table(p) for p in parts if p.exists()]
+    if not tables:
+        raise FileNotFoundError("No backfilled volumes")
+    table = pa.concat_tables(tables)
+    travel_hours = table.schema.field("volume_m3").type.list_size
+    times = table.column("time").to_numpy().astype("datetime64[h]")
+    volumes = table.column("volume_m3").combine_chunks().flatten().to_numpy()
+
+    all_hours = np.arange(first_hour, end_hour)
+    hourly = np.full((len(all_hours), travel_hours), np.nan)
+    inside = (times >= first_hour) & (times < end_hour)
+    hourly[np.searchsorted(all_hours, times[inside])] = volumes.reshape(
+        -1, travel_hours
+    )[inside]
+    return all_hours, hourly
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("start", type=date.fromisoformat)
+    parser.add_argument("end", type=date.fromisoformat, help="Last day, included")
+    parser.add_argument("--output", type=Path, required=True)
+    parser.add_argument("--comephores", type=Path, default=COMEPHORES_DIR)
+    parser.add_argument("--resolution", type=int, default=FULL_RESOLUTION)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    if pa is None:
+        parser.error(
+            "pyarrow is required, install flow-prediction with the backfill extra"
+        )
+
+    # Rain falling up to MAX_TRAVEL_TIME before the first hour reaches it
+    first_day = args.start - timedelta(days=-(-MAX_TRAVEL_TIME // 24))
+    days = [
+        first_day + timedelta(days=i) for i in range((args.end - first_day).days + 1)
+    ]
+    parts_dir = args.output / f"volumes-{args.resolution}m"
+    parts_dir.mkdir(parents=True, exist_ok=True)
+
+    weights_path = args.output / f"weights-{args.resolution}m.npz"
+    try:
+        prepare_weights(weights_path, args.comephores, args.resolution, parts_dir)
+    except FileNotFoundError as e:
+        parser.error(str(e))
+
+    pending = pending_days(days, parts_dir, args.comephores)
+    print(f"{len(days) - len(pending)} days already done, {len(pending)} to go")
+    if args.workers == 1:
+        _init_worker(weights_path, args.comephores)
+        for day in pending:
+            _backfill_day(day, parts_dir / f"{day}.parquet")
+    else:
+        with ProcessPoolExecutor(
+            args.workers,
+            initializer=_init_worker,
+            initargs=(weights_path, args.comephores),
+        ) as executor:
+            done = 0
+            futures = [
+                executor.submit(_backfill_day, day, parts_dir / f"{day}.parquet")
+                for day in pending
+            ]
+            for future in as_completed(futures):
+                future.result()
+                done += 1
+                if done % 100 == 0:
+                    print(f"{done}/{len(pending)} days")
+
+    all_hours, hourly = load_hourly_volumes(
+        [parts_dir / f"{d}.parquet" for d in days],
+        np.datetime64(first_day, "h"),
+        np.datetime64(args.end + timedelta(days=1), "h"),
+    )
+    hourly = rescale_volumes(hourly, PARAMETERS.velocity_scale)
+    flow = rainfall_flow_series(hourly, BIN_SIZE, MAX_TRAVEL_TIME)
+    # Flow at the end of each hour, i.e. the start of the next
+    outlet_times = all_hours + np.timedelta64(1, "h")
+    keep = (outlet_times >= np.datetime64(args.start, "h")) & (
+        outlet_times < np.datetime64(args.end + timedelta(days=1), "h")
+    )
+    flow_path = args.output / f"flow-{args.resolution}m.parquet"
+    pq.write_table(  # pyright: ignore[reportOptionalMemberAccess]
+        pa.table(
+            {
+                "time": pa.array(outlet_times[keep].astype("datetime64[s]")),
+                "rainfall_flow_m3h": pa.array(flow[keep]),
+                # Rainfall part of the predicted flow, without the baseline
+                "rainfall_flow_m3s": pa.array(flow[keep] / FLOW_RATE_DIV / 3600),
+            }
+        ),
+        flow_path,
+    )
+    print(
+        f"Wrote {keep.sum()} hours to {flow_path}, "
+        f"{np.isnan(flow[keep]).sum()} without complete rainfall"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+Calibration of the model parameters (see app/predict/parameters.py) against
+observed flow rates at the outlet.
+
+    cd services/flow-prediction
+    uv run --extra backfill python -m app.calibrate \\
+        --backfill backfill --observed observed.csv
+
+The volumes of each hour's rain reaching the outlet after each travel hour
+are read once from the backfill (see app/backfill.py), so that each
+combination of velocity scale, bin size and maximum travel time is only a few
+array operations on them. observed.csv has time and flow_m3s columns, e.g. an
+export of Hub'Eau's observations_tr for the outlet station, averaged per hour.
+
+For each combination, flow_m3s = intercept + rainfall_flow / flow_rate_div /
+3600 is fitted by least squares, on the hours where every combination has a
+complete rainfall. The combination with the lowest RMSE is written to
+--output, which flow-prediction loads on startup.
+"""
+
+import argparse
+import csv
+from datetime import datetime
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+
+from app.backfill import bin_flow_series, load_hourly_volumes, rescale_volumes
+from app.predict.parameters import (
+    PARAMETERS,
+    PARAMETERS_PATH,
+    CalibrationMetrics,
+    ModelParameters,
+)
+from app.predict.watershed import FULL_RESOLUTION
+
+
+class Candidate(NamedTuple):
+    velocity_scale: float
+    bin_size: int
+    max_travel_time: int
+
+
+class Fit(NamedTuple):
+    """
+    Least squares fit of y = intercept + slope * x for each row of x.
+    """
+
+    intercept: np.ndarray
+    slope: np.ndarray
+    rmse: np.ndarray
+    nse: np.ndarray
+
+
+def read_observed(path: Path) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Hours with at least one observation, and the mean flow rate (m³/s)
+    observed during each.
+    """
+    with path.open(newline="") as f:
+        rows = [
+            (datetime.fromisoformat(row["time"]), float(row["flow_m3s"]))
+            for row in csv.DictReader(f)
+            if row["flow_m3s"]
+        ]
+    if not rows:
+        raise ValueError(f"No observation in {path}")
+    times = np.array([t.replace(tzinfo=None) for t, _ in rows], "datetime64[h]")
+    flows = np.array([q for _, q in rows])
+    hours, index = np.unique(times, return_inverse=True)
+    sums = np.bincount(index, weights=flows)
+    return hours, sums / np.bincount(index)
+
+
+def fit(x: np.ndarray, y: np.ndarray) -> Fit:
+    """
+    Fit every row of x (candidates, hours) at once, from the sums of the
+    closed-form solution.
+    """
+    n = y.size
+    x_mean = x.mean(axis=1)
+    y_centered = y - y.mean()
+    x_centered = x - x_mean[:, None]
+    sxx = np.einsum("ij,ij->i", x_centered, x_centered)
+    sxy = x_centered @ y_centered
+    syy = y_centered @ y_centered
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = np.where(sxx > 0, sxy / sxx, 0)
+    sse = np.maximum(syy - slope * sxy, 0)
+    return Fit(
+        intercept=y.mean() - slope * x_mean,
+        slope=slope,
+        rmse=np.sqrt(sse / n),
+        nse=1 - sse / syy,
+    )
+
+
+def candidate_series(
+    volumes: np.ndarray,
+    velocity_scales: list[float],
+    bin_sizes: list[int],
+    max_travel_time_hours: int,
+):
+    """
+    Rainfall flow rate (m³/h) at the end of each hour of volumes (hours,
+    travel hours) for each combination, as (candidates, series (candidates,
+    hours)) blocks of one velocity scale and bin size. All maximum travel
+    times of a block are cumulative sums of the same bins.
+    """
+    for scale in velocity_scales:
+        scaled = rescale_volumes(volumes, scale)
+        for bin_size in bin_sizes:
+            bins = bin_flow_series(
+                scaled, bin_size, max_travel_time_hours // bin_size * bin_size
+            )
+            candidates = [
+                Candidate(scale, bin_size, bin_size * (i + 1))
+                for i in range(len(bins))
+            ]
+            yield candidates, np.cumsum(bins, axis=0) / bin_size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--backfill", type=Path, required=True)
+    parser.add_argument("--observed", type=Path, required=True)
+    parser.add_argument("--resolution", type=int, default=FULL_RESOLUTION)
+    parser.add_argument("--output", type=Path, default=PARAMETERS_PATH)
+    parser.add_argument(
+        "--velocity-scales",
+        type=float,
+        nargs=3,
+        default=[0.5, 2.0, 0.05],
+        metavar=("START", "STOP", "STEP"),
+        help="Included range",
+    )
+    parser.add_argument("--bin-sizes", type=int, nargs="+", default=[1, 2, 3, 4, 6])
+    parser.add_argument(
+        "--max-travel-time",
+        type=int,
+        default=48,
+        help="Maximum travel times are the multiples of the bin size up to this",
+    )
+    args = parser.parse_args()
+
+    start, stop, step = args.velocity_scales
+    velocity_scales = np.round(np.arange(start, stop + step / 2, step), 6).tolist()
+
+    observed_hours, observed = read_observed(args.observed)
+    parts = sorted((args.backfill / f"volumes-{args.resolution}m").glob("*.parquet"))
+    if not parts:
+        parser.error(f"No backfilled volumes in {args.backfill}")
+    # Rainfall flow at the end of each hour is compared to the next hour
+    all_hours, volumes = load_hourly_volumes(
+        parts,
+        observed_hours[0] - np.timedelta64(args.max_travel_time + 1, "h"),
+        observed_hours[-1],
+    )
+    model_index = np.searchsorted(all_hours, observed_hours - np.timedelta64(1, "h"))
+    complete = ~np.isnan(volumes).any(axis=1)
+
+    # Hours where every combination has a complete rainfall, i.e. the
+    # max_travel_time hours before them are all backfilled
+    in_range = (model_index >= args.max_travel_time) & (model_index < len(all_hours))
+    window = np.lib.stride_tricks.sliding_window_view(
+        np.concatenate([np.zeros(args.max_travel_time, bool), complete]),
+        args.max_travel_time + 1,
+    ).all(axis=1)
+    hours = in_range & window[np.minimum(model_index, len(all_hours) - 1)]
+    if not hours.any():
+        parser.error("No observed hour with a complete backfilled rainfall")
+    y = observed[hours]
+    print(
+        f"{hours.sum()} hours from {observed_hours[hours][0]} "
+        f"to {observed_hours[hours][-1]}"
+    )
+
+    candidates: list[Candidate] = []
+    fits: list[Fit] = []
+    for block, series in candidate_series(
+        volumes, velocity_scales, args.bin_sizes, args.max_travel_time
+    ):
+        candidates += block
+        fits.append(fit(series[:, model_index[hours]], y))
+    results = Fit(*(np.concatenate(f) for f in zip(*fits)))
+    print(f"Evaluated {len(candidates)} combinations")
+
+    # A slope ≤ 0 means more rain, less flow
+    rmse = np.where(results.slope > 0, results.rmse, np.inf)
+    ranking = np.argsort(rmse)
+    if not np.isfinite(rmse[ranking[0]]):
+        parser.error("No combination where rainfall increases the flow rate")
+
+    current = Candidate(
+        PARAMETERS.velocity_scale, PARAMETERS.bin_size, PARAMETERS.max_travel_time
+    )
+    print("velocity_scale bin_size max_travel_time flow_rate_div  rmse_m3s   nse")
+    for i in ranking[:5]:
+        c = candidates[i]
+        print(
+            f"{c.velocity_scale:14.2f} {c.bin_size:8d} {c.max_travel_time:15d} "
+            f"{1 / (3600 * results.slope[i]):13.2f} "
+            f"{results.rmse[i]:9.2f} {results.nse[i]:5.3f}"
+        )
+    if current in candidates:
+        i = candidates.index(current)
+        print(
+            f"Current parameters: rmse {results.rmse[i]:.2f} m³/s, "
+            f"nse {results.nse[i]:.3f}"
+        )
+
+    best = ranking[0]
+    c = candidates[best]
+    parameters = ModelParameters(
+        flow_rate_div=1 / (3600 * results.slope[best]),
+        bin_size=c.bin_size,
+        max_travel_time=c.max_travel_time,
+        velocity_scale=c.velocity_scale,
+        calibration=CalibrationMetrics(
+            start=observed_hours[hours][0].item(),
+            end=observed_hours[hours][-1].item(),
+            hours=int(hours.sum()),
+            rmse_m3s=float(results.rmse[best]),
+            nse=float(results.nse[best]),
+            intercept_m3s=float(results.intercept[best]),
+        ),
+    )
+    args.output.write_text(parameters.model_dump_json(indent=2) + "\n")
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
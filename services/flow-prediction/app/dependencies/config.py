@@ -1,27 +1,41 @@
 from typing import Annotated, Literal
 
-from async_lru import alru_cache
 from fastapi import Depends
-from httpx import AsyncClient
-from pydantic import BaseModel
+from floodcast_common.config import ConfigClient
+from pydantic import BaseModel, Field
+
+
+class EnsembleConfig(BaseModel):
+    members: int = Field(default=50, ge=1)
+    # Standard deviation of the displacement of the rainfall field, in meters
+    displacement_m: float = 10_000
+    # Standard deviation of the log of the rainfall scale of each bin
+    scale_sigma: float = 0.3
+    quantiles: list[Annotated[float, Field(ge=0, le=1)]] = [0.1, 0.5, 0.9]
+    # Flow rates (m³/s) whose exceedance probabilities are reported by default
+    thresholds: list[float] = []
 
 
 class ConfigModel(BaseModel):
     log_level: Literal["debug"]
+    # Resolution of the watershed model in meters: 25 for the full resolution
+    # travel times, or one of the coarser levels built by models/watershed/pyramid.py
+    resolution: int = 25
+    ensemble: EnsembleConfig = EnsembleConfig()
+    # SQLite file of the forecasts computed after each AROME run, read once at
+    # startup
+    forecast_db: str = "forecasts.db"
+    # Forecasts go up to this many hours after the run, AROME's horizon
+    forecast_horizon_hours: int = 42
+    # How often to check for a new AROME run or Hub'Eau observation
+    forecast_poll_seconds: float = 300
 
 
-@alru_cache(maxsize=32)
-async def fetch_config() -> ConfigModel:
-    url = "http://config-service:8000/config/flow-prediction"
-    async with AsyncClient() as client:
-        r = await client.get(url)
-        r.raise_for_status()
-        data = r.json()
-        return ConfigModel(**data["config"])
+config_client = ConfigClient("flow-prediction", ConfigModel)
 
 
 async def get_config() -> ConfigModel:
-    return await fetch_config()
+    return config_client.current
 
 
 Config = Annotated[ConfigModel, Depends(get_config)]
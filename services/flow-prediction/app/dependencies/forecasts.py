@@ -0,0 +1,12 @@
+from typing import Annotated
+
+from fastapi import Depends, Request
+
+from app.store import ForecastStore
+
+
+def get_forecasts(request: Request) -> ForecastStore:
+    return request.app.state.forecasts
+
+
+Forecasts = Annotated[ForecastStore, Depends(get_forecasts)]
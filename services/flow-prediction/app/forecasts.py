@@ -0,0 +1,193 @@
+import asyncio
+import contextlib
+import fcntl
+from datetime import datetime, timedelta
+
+import httpx
+from floodcast_common.config import ConfigClient
+from pydantic import ValidationError
+
+from app.dependencies.config import ConfigModel
+from app.predict.compute_flow_rate import (
+    estimate_outlet_flow_rate,
+    estimate_outlet_flow_rates,
+)
+from app.predict.get_flow_rate import (
+    FlowInfo,
+    get_flow_rate_data,
+    watch_flow_rate_data,
+)
+from app.predict.predict_flow_rate import (
+    BIN_SIZE,
+    MAX_TRAVEL_TIME,
+    OUTLET,
+    OUTLET_SITE_CODE,
+    baseline_flow_from,
+    observation_hour,
+)
+from app.predict.parameters import PARAMETERS
+from app.predict.weather import get_latest_run
+from app.store import ForecastStore
+
+# Older pushed observations are checked with /measurements/flow/latest, in case
+# flow-data stopped pushing
+PUSHED_OBSERVATION_MAX_AGE = timedelta(hours=1)
+
+
+class ForecastJob:
+    """
+    Background task computing the forecasts of the whole horizon of each new
+    AROME run into the store, and their baseline from each new Hub'Eau
+    observation. Runs in a single worker process per store.
+
+    New observations are pushed by flow-data's stream and trigger an update
+    right away. The job still checks every forecast_poll_seconds, for new AROME
+    runs, and polls the observation while the stream is down.
+    """
+
+    def __init__(
+        self, store: ForecastStore, config_client: ConfigClient[ConfigModel]
+    ) -> None:
+        self.store = store
+        self.config_client = config_client
+        self.lock_file = open(f"{store.path}.lock", "a")
+        self.task: asyncio.Task | None = None
+        self.watch_task: asyncio.Task | None = None
+        # Latest outlet flow rate pushed by flow-data, None while disconnected
+        self.observation: FlowInfo | None = None
+        self.observed = asyncio.Event()
+
+    def start(self):
+        self.task = asyncio.create_task(self.run(), name="forecast-job")
+        self.watch_task = asyncio.create_task(self.watch(), name="outlet-watch")
+
+    async def stop(self):
+        tasks = [t for t in (self.task, self.watch_task) if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.lock_file.close()
+
+    def try_lock(self) -> bool:
+        """
+        Elect this process to run the job, until it exits.
+        """
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    async def run(self):
+        locked = False
+        while True:
+            config = self.config_client.current
+            try:
+                locked = locked or self.try_lock()
+                if locked:
+                    await self.update(config)
+            except Exception as e:
+                print(f"[FORECAST][ERROR] {e!r}")
+            with contextlib.suppress(TimeoutError):
+                async with asyncio.timeout(config.forecast_poll_seconds):
+                    await self.observed.wait()
+            self.observed.clear()
+
+    async def watch(self):
+        """
+        Follow the outlet observations pushed by flow-data, reconnecting with
+        a backoff.
+        """
+        delay = 1.0
+        while True:
+            try:
+                async with httpx.AsyncClient() as client:
+                    async for flow_info in watch_flow_rate_data(
+                        OUTLET_SITE_CODE, client
+                    ):
+                        delay = 1.0
+                        if flow_info.measure == "Q":
+                            self.observation = flow_info
+                            self.observed.set()
+            except (httpx.HTTPError, ValidationError) as e:
+                print(f"[FORECAST][ERROR] Observation stream: {e!r}")
+            self.observation = None
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.config_client.current.forecast_poll_seconds)
+
+    async def outlet_observation(self) -> FlowInfo:
+        """
+        The latest pushed observation, or the one of /measurements/flow/latest
+        if none is recent.
+        """
+        pushed = self.observation
+        if pushed is not None:
+            age = datetime.now(pushed.obs_date.tzinfo) - pushed.obs_date
+            if age <= PUSHED_OBSERVATION_MAX_AGE:
+                return pushed
+        return await get_flow_rate_data(OUTLET)
+
+    async def update(self, config: ConfigModel):
+        async with httpx.AsyncClient(timeout=None) as client:
+            run = await get_latest_run(client)
+            flow_info = await self.outlet_observation()
+            baseline_time = observation_hour(flow_info)
+
+            current = self.store.run()
+            if (
+                current is None
+                or current.run != run
+                or not current.computed_with(config.resolution, PARAMETERS.fingerprint)
+            ):
+                now = datetime.now().replace(minute=0, second=0, microsecond=0)
+                end = run + timedelta(hours=config.forecast_horizon_hours)
+                outlet_times = [baseline_time] + [
+                    now + timedelta(hours=h)
+                    for h in range(int((end - now) / timedelta(hours=1)) + 1)
+                ]
+                print(f"[FORECAST] Computing {len(outlet_times)} hours of run {run}")
+                flow_rates = await estimate_outlet_flow_rates(
+                    outlet_times,
+                    bin_size_hours=BIN_SIZE,
+                    max_travel_time_hours=MAX_TRAVEL_TIME,
+                    client=client,
+                    resolution=config.resolution,
+                )
+                baseline_rainfall_flow = flow_rates.get(baseline_time)
+                if baseline_rainfall_flow is None:
+                    baseline_rainfall_flow = await self.estimate(
+                        baseline_time, client, config
+                    )
+                self.store.replace(
+                    run,
+                    config.resolution,
+                    PARAMETERS.fingerprint,
+                    flow_rates,
+                    flow_info.obs_date,
+                    baseline_flow_from(flow_info, baseline_rainfall_flow),
+                )
+
+            elif current.observation_time != flow_info.obs_date:
+                stored = self.store.get(baseline_time)
+                if stored is not None:
+                    baseline_rainfall_flow = stored.rainfall_flow
+                else:
+                    baseline_rainfall_flow = await self.estimate(
+                        baseline_time, client, config
+                    )
+                self.store.set_baseline(
+                    flow_info.obs_date,
+                    baseline_flow_from(flow_info, baseline_rainfall_flow),
+                )
+
+    @staticmethod
+    async def estimate(
+        outlet_time: datetime, client: httpx.AsyncClient, config: ConfigModel
+    ) -> float:
+        return await estimate_outlet_flow_rate(
+            outlet_time=outlet_time,
+            bin_size_hours=BIN_SIZE,
+            max_travel_time_hours=MAX_TRAVEL_TIME,
+            client=client,
+            resolution=config.resolution,
+        )
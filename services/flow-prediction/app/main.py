@@ -1,12 +1,51 @@
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
 from datetime import datetime
+from typing import Annotated, Literal
 
-from fastapi import FastAPI
+import numpy as np
+from fastapi import FastAPI, Query
+from floodcast_common.metrics import instrument
+from floodcast_common.readiness import Readiness
 from pydantic import BaseModel
 
-from app.dependencies.config import Config
-from app.predict.predict_flow_rate import predict_flow_rate
+from app.dependencies.config import Config, config_client
+from app.dependencies.forecasts import Forecasts
+from app.forecasts import ForecastJob
+from app.predict.predict_flow_rate import (
+    predict_flow_ensemble,
+    predict_flow_rate,
+    predicted_flow,
+)
+from app.predict.parameters import PARAMETERS
+from app.predict.watershed import get_watershed
+from app.store import ForecastStore
 
-app = FastAPI()
+readiness = Readiness()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    async with config_client:
+        # Attached from shared memory, or read from disk by the first worker
+        readiness.warm_up(
+            "watershed",
+            get_watershed(config_client.current.resolution),
+        )
+        app.state.forecasts = ForecastStore(config_client.current.forecast_db)
+        job = ForecastJob(app.state.forecasts, config_client)
+        job.start()
+        try:
+            yield
+        finally:
+            await job.stop()
+            await readiness.stop()
+            app.state.forecasts.close()
+
+
+app = FastAPI(lifespan=lifespan)
+instrument(app)
+readiness.install(app)
 
 
 @app.get("/")
@@ -19,18 +58,111 @@ async def root(config: Config):
 
 class FlowPredictionResult(BaseModel):
     value: float
+    # forecast: computed after the AROME run `run`, with the baseline of the
+    # Hub'Eau observation at `observation_time`. on-demand: computed now.
+    source: Literal["forecast", "on-demand"]
+    run: datetime | None = None
+    observation_time: datetime | None = None
+
+
+def stored_baseline_flow(config: Config, forecasts: Forecasts) -> float | None:
+    """
+    Baseline flow (m³/h) kept up to date by the forecast job, if it was
+    computed with the current model.
+    """
+    run = forecasts.run()
+    if run is None or not run.computed_with(config.resolution, PARAMETERS.fingerprint):
+        return None
+    return run.baseline_flow
 
 
 @app.get("/flow")
 async def get_predicted_flow_rate(
-    config: Config, prediction_time: datetime
+    config: Config, forecasts: Forecasts, prediction_time: datetime
 ) -> FlowPredictionResult:
     """
-    Returns predicted flow rate in m3/s at prediction_time
+    Returns predicted flow rate in m3/s at prediction_time, from the forecasts
+    of the latest AROME run, or computed on demand outside of their horizon.
     """
+    prediction_time = prediction_time.replace(
+        minute=0, second=0, microsecond=0, tzinfo=None
+    )
+
+    stored = forecasts.get(prediction_time)
+    if stored is not None and stored.source.computed_with(
+        config.resolution, PARAMETERS.fingerprint
+    ):
+        return FlowPredictionResult(
+            value=predicted_flow(stored.source.baseline_flow, stored.rainfall_flow)
+            / 3600,
+            source="forecast",
+            run=stored.source.run,
+            observation_time=stored.source.observation_time,
+        )
+
     return FlowPredictionResult(
         value=await predict_flow_rate(
-            prediction_time.replace(minute=0, second=0, microsecond=0, tzinfo=None)
+            prediction_time,
+            resolution=config.resolution,
+            baseline_flow=stored_baseline_flow(config, forecasts),
+        )
+        / 3600,
+        source="on-demand",
+    )
+
+
+class FlowQuantile(BaseModel):
+    quantile: float
+    value: float
+
+
+class FlowExceedance(BaseModel):
+    threshold: float
+    probability: float
+
+
+class FlowEnsembleResult(BaseModel):
+    # Deterministic prediction, as returned by /flow
+    value: float
+    members: int
+    quantiles: list[FlowQuantile]
+    exceedance: list[FlowExceedance]
+
+
+@app.get("/flow/ensemble")
+async def get_predicted_flow_ensemble(
+    config: Config,
+    forecasts: Forecasts,
+    prediction_time: datetime,
+    threshold: Annotated[list[float] | None, Query()] = None,
+) -> FlowEnsembleResult:
+    """
+    Returns quantiles of the predicted flow rate in m3/s at prediction_time,
+    and the probability of exceeding each threshold (m3/s), over an ensemble
+    of rainfall scenarios. Thresholds default to the configured ones.
+    """
+    ensemble = config.ensemble
+    flows = (
+        await predict_flow_ensemble(
+            prediction_time.replace(minute=0, second=0, microsecond=0, tzinfo=None),
+            members=ensemble.members,
+            displacement_m=ensemble.displacement_m,
+            scale_sigma=ensemble.scale_sigma,
+            resolution=config.resolution,
+            baseline_flow=stored_baseline_flow(config, forecasts),
         )
         / 3600
     )
+    thresholds = threshold if threshold is not None else ensemble.thresholds
+    return FlowEnsembleResult(
+        value=float(flows[0]),
+        members=len(flows),
+        quantiles=[
+            FlowQuantile(quantile=q, value=float(np.quantile(flows, q)))
+            for q in ensemble.quantiles
+        ],
+        exceedance=[
+            FlowExceedance(threshold=t, probability=float(np.mean(flows > t)))
+            for t in thresholds
+        ],
+    )
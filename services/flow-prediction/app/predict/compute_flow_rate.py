@@ -1,27 +1,58 @@
+import asyncio
 from datetime import datetime, timedelta
 
 import httpx
-import matplotlib.pyplot as plt
 import numpy as np
-import rasterio  # pyright: ignore[reportMissingTypeStubs]
-from app.predict.reproject import pixel_area_m2, reproject_to_match
-from app.predict.watershed import watershed_dataset
-from app.predict.weather import AvailabilityPeriod, rainfall_data
+from floodcast_common.metrics import stage
 
+from app.predict.reproject import reproject_to_match
+from app.predict.watershed import FULL_RESOLUTION, WatershedModel, get_watershed
+from app.predict.weather import (
+    AvailabilityPeriod,
+    get_rainfall_availability,
+    rainfall_data,
+)
 
-async def volume_for_time_bin(
+
+async def rainfall_on_watershed(
+    period: AvailabilityPeriod,
+    watershed: WatershedModel,
+    client: httpx.AsyncClient | None,
+) -> np.ndarray:
+    """
+    Rainfall (kg/m²) over period, on the watershed grid.
+    """
+    async with rainfall_data(period, client) as rain:
+        # raw_rain_array = rain.values()
+        # raw_rain_array[raw_rain_array >= 1000] = np.nan
+
+        # print("total rain: ", np.nansum(raw_rain_array))
+
+        # Reprojection releases the GIL, keep serving requests meanwhile
+        rain_array = await asyncio.to_thread(reproject_to_match, rain, watershed)
+        assert not (rain_array > 9000).any()
+
+    # Debugging only, install the plot extra
+    # import matplotlib.pyplot as plt
+    # fig, axs = plt.subplots(1, 2)
+    # axs[0].imshow(rain_array)
+    # plt.draw()
+
+    return rain_array
+
+
+async def rainfall_for_time_bin(
     *,
     outlet_time: datetime,
     bin_start_hr: int,
     bin_end_hr: int,
-    watershed_ds: rasterio.DatasetReader,
-    watershed_array: np.ndarray,
-    pixel_area: float,
+    watershed: WatershedModel,
     client: httpx.AsyncClient | None,
-) -> float:
+) -> np.ndarray:
     """
-    Compute volume contributed by watershed pixels whose travel time
-    is in [bin_start_hr, bin_end_hr).
+    Rainfall (kg/m²) on the watershed grid that reaches the outlet at
+    outlet_time through the pixels whose travel time is in
+    [bin_start_hr, bin_end_hr).
     """
 
     # Rainfall must have occurred earlier so it arrives at outlet_time
@@ -32,34 +63,32 @@ async def volume_for_time_bin(
         start=rainfall_start,
         span=rainfall_span,
     )
+    return await rainfall_on_watershed(rainfall_period, watershed, client)
 
-    async with rainfall_data(rainfall_period, client) as rain_ds:
-        # raw_rain_array = rain_ds.read(1)
-        # raw_rain_array[raw_rain_array >= 1000] = np.nan
 
-        # print("total rain: ", np.nansum(raw_rain_array))
-
-        rain_array = reproject_to_match(rain_ds, watershed_ds)
-        assert np.max(rain_array) <= 9000
-
-    # Mask watershed pixels belonging to this time bin
-    mask = (watershed_array >= bin_start_hr * 3600) & (
-        watershed_array < bin_end_hr * 3600
+async def volume_for_time_bin(
+    *,
+    outlet_time: datetime,
+    bin_start_hr: int,
+    bin_end_hr: int,
+    watershed: WatershedModel,
+    client: httpx.AsyncClient | None,
+) -> float:
+    """
+    Compute volume contributed by watershed pixels whose travel time
+    is in [bin_start_hr, bin_end_hr).
+    """
+    rain_array = await rainfall_for_time_bin(
+        outlet_time=outlet_time,
+        bin_start_hr=bin_start_hr,
+        bin_end_hr=bin_end_hr,
+        watershed=watershed,
+        client=client,
     )
 
-    # fig, axs = plt.subplots(1, 2)
-    # axs[0].imshow(mask)
-    # axs[1].imshow(rain_array)
-    # plt.draw()
-
-    # Rainfall depth in meters
-    rainfall_m = rain_array * 0.001  # kg/m² → m
-
-    # Volume per pixel
-    volume_m3 = rainfall_m * pixel_area
-
-    # Total volume from this bin
-    return float(np.nansum(volume_m3[mask]))
+    # Total volume from the watershed pixels belonging to this time bin
+    with stage("reduce"):
+        return watershed.volume_m3(rain_array, bin_start_hr, bin_end_hr)
 
 
 async def estimate_outlet_flow_rate(
@@ -67,6 +96,7 @@ async def estimate_outlet_flow_rate(
     bin_size_hours: int,
     max_travel_time_hours: int,
     client: httpx.AsyncClient | None = None,
+    resolution: int = FULL_RESOLUTION,
 ) -> float:
     """
     Estimate rainfall flow rate (m³/h) reaching outlet at outlet_time.
@@ -74,32 +104,93 @@ async def estimate_outlet_flow_rate(
 
     total_volume = 0.0
 
-    with watershed_dataset() as watershed_ds:
-        watershed_array = watershed_ds.read(1)  # pyright: ignore[reportUnknownVariableType, reportUnknownMemberType]
-        pixel_area = pixel_area_m2(watershed_ds)
-
-        for bin_start in range(0, max_travel_time_hours, bin_size_hours):
-            bin_end = bin_start + bin_size_hours
-
-            volume = await volume_for_time_bin(
-                outlet_time=outlet_time,
-                bin_start_hr=bin_start,
-                bin_end_hr=bin_end,
-                watershed_ds=watershed_ds,
-                watershed_array=watershed_array,  # pyright: ignore[reportUnknownArgumentType]
-                pixel_area=pixel_area,
-                client=client,
-            )
+    watershed = await get_watershed(resolution)
 
-            total_volume += volume
+    for bin_start in range(0, max_travel_time_hours, bin_size_hours):
+        bin_end = bin_start + bin_size_hours
 
-            # Debug logging
-            # print(f"Bin {bin_start}-{bin_end} hr: {volume:,.2f} m³")
+        volume = await volume_for_time_bin(
+            outlet_time=outlet_time,
+            bin_start_hr=bin_start,
+            bin_end_hr=bin_end,
+            watershed=watershed,
+            client=client,
+        )
+
+        total_volume += volume
+
+        # Debug logging
+        # print(f"Bin {bin_start}-{bin_end} hr: {volume:,.2f} m³")
 
     # print(f"FLOW RATE: {total_volume / bin_size_hours:,.2f} m³/h")
     return total_volume / bin_size_hours
 
 
+async def estimate_outlet_flow_rates(
+    outlet_times: list[datetime],
+    bin_size_hours: int,
+    max_travel_time_hours: int,
+    client: httpx.AsyncClient | None = None,
+    resolution: int = FULL_RESOLUTION,
+) -> dict[datetime, float]:
+    """
+    Estimate rainfall flow rate (m³/h) reaching outlet at each of outlet_times,
+    leaving out the times whose rainfall is not available.
+
+    Outlet times an hour apart share most of their rainfall periods, so each
+    period is fetched and reprojected once and its volume computed for every
+    time bin, rather than once per outlet time. Periods weather-data lists as
+    unavailable are not requested.
+    """
+    watershed = await get_watershed(resolution)
+    bins = range(0, max_travel_time_hours, bin_size_hours)
+
+    # Rainfall start → volume falling on the pixels of each time bin
+    volumes: dict[datetime, list[float] | None] = {}
+    for outlet_time in outlet_times:
+        for bin_start in bins:
+            start = outlet_time - timedelta(hours=bin_start + bin_size_hours)
+            volumes[start] = None
+
+    starts = sorted(volumes)
+    span = timedelta(hours=bin_size_hours)
+    try:
+        available = await get_rainfall_availability(
+            starts[0], starts[-1] + timedelta(hours=1), span, client
+        )
+    except httpx.HTTPError as e:
+        print(f"Rainfall availability unknown, requesting every period: {e!r}")
+        available = set(starts)
+
+    for start in starts:
+        if start not in available:
+            continue
+        period = AvailabilityPeriod(start=start, span=span)
+        try:
+            rain_array = await rainfall_on_watershed(period, watershed, client)
+        except (FileNotFoundError, httpx.HTTPStatusError) as e:
+            print(f"Rainfall from {start} not available: {e!r}")
+            continue
+        with stage("reduce"):
+            volumes[start] = [
+                watershed.volume_m3(rain_array, bin_start, bin_start + bin_size_hours)
+                for bin_start in bins
+            ]
+
+    flow_rates = {}
+    for outlet_time in outlet_times:
+        total_volume = 0.0
+        for i, bin_start in enumerate(bins):
+            start = outlet_time - timedelta(hours=bin_start + bin_size_hours)
+            bin_volumes = volumes[start]
+            if bin_volumes is None:
+                break
+            total_volume += bin_volumes[i]
+        else:
+            flow_rates[outlet_time] = total_volume / bin_size_hours
+    return flow_rates
+
+
 if __name__ == "__main__":
     import asyncio
 
@@ -113,4 +204,3 @@ if __name__ == "__main__":
             max_travel_time_hours=48,
         )
     )
-    plt.show()
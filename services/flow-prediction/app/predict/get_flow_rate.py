@@ -1,16 +1,18 @@
+import os
 from collections.abc import AsyncIterator
 from contextlib import asynccontextmanager
 from datetime import date, datetime, timedelta
 from typing import Literal
 
 import httpx
+from floodcast_common.metrics import upstream_call
 from pydantic import BaseModel
 from rasterio.io import (  # pyright: ignore[reportMissingTypeStubs]
     DatasetReader,
     MemoryFile,
 )
 
-BASE_URL = "http://flow-data-service:8000"
+BASE_URL = os.environ.get("FLOW_DATA_URL", "http://flow-data-service:8000")
 # BASE_URL = "http://localhost:8002"
 
 
@@ -47,10 +49,31 @@ async def get_flow_rate_data(
     """
 
     async with httpx.AsyncClient(timeout=None) as client:
-        response = await client.get(
-            f"{BASE_URL}/measurements/flow/latest", params=params.model_dump()
-        )
+        with upstream_call("flow-data", "/measurements/flow/latest"):
+            response = await client.get(
+                f"{BASE_URL}/measurements/flow/latest", params=params.model_dump()
+            )
 
-        _ = response.raise_for_status()
+            _ = response.raise_for_status()
 
         return FlowInfo.model_validate_json(response.text)
+
+
+async def watch_flow_rate_data(
+    site_code: str, client: httpx.AsyncClient
+) -> AsyncIterator[FlowInfo]:
+    """
+    Observations of a station watched by flow-data, as soon as they are
+    published, starting with the latest ones. Ends when the stream is closed.
+    """
+    async with client.stream(
+        "GET",
+        f"{BASE_URL}/measurements/flow/stream",
+        params={"site_code": site_code},
+        # flow-data sends a keep-alive comment every 15 s
+        timeout=httpx.Timeout(10, read=60),
+    ) as response:
+        _ = response.raise_for_status()
+        async for line in response.aiter_lines():
+            if line.startswith("data:"):
+                yield FlowInfo.model_validate_json(line.removeprefix("data:"))
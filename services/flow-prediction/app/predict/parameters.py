@@ -0,0 +1,52 @@
+import hashlib
+import os
+from datetime import datetime
+from pathlib import Path
+
+from pydantic import BaseModel, Field
+
+# Written by app/calibrate.py, the defaults below are used if it does not exist
+PARAMETERS_PATH = Path(
+    os.environ.get("FLOW_PARAMETERS", Path(__file__).parents[2] / "parameters.json")
+)
+
+
+class CalibrationMetrics(BaseModel):
+    start: datetime
+    end: datetime
+    hours: int
+    rmse_m3s: float
+    nse: float
+    # Constant baseline of the fit, /flow uses the latest observation instead
+    intercept_m3s: float
+
+
+class ModelParameters(BaseModel):
+    # Volume of rain reaching the outlet per hour → flow rate
+    flow_rate_div: float = Field(default=12, gt=0)
+    # Travel times are grouped in bins of this many hours
+    bin_size: int = Field(default=3, gt=0)
+    # Rain taking longer than this to reach the outlet is ignored
+    max_travel_time: int = Field(default=24, gt=0)
+    # Multiplies the flow velocities of models/watershed/weights.py, i.e.
+    # divides travel times
+    velocity_scale: float = Field(default=1.0, gt=0)
+    calibration: CalibrationMetrics | None = None
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        Changes with any parameter the flow depends on, to tell which
+        parameters stored forecasts were computed with.
+        """
+        model = self.model_dump_json(exclude={"calibration"})
+        return hashlib.sha256(model.encode()).hexdigest()[:16]
+
+
+def load_parameters(path: Path = PARAMETERS_PATH) -> ModelParameters:
+    if not path.is_file():
+        return ModelParameters()
+    return ModelParameters.model_validate_json(path.read_text())
+
+
+PARAMETERS = load_parameters()
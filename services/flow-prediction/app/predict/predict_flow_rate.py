@@ -1,40 +1,112 @@
 from datetime import datetime, time
 
+import numpy as np
+
 from app.predict.compute_flow_rate import estimate_outlet_flow_rate
+from app.predict.ensemble import Perturbations, estimate_outlet_flow_rate_ensemble
 from app.predict.get_flow_rate import (
     FlowInfo,
     LatestFlowQueryParams,
     get_flow_rate_data,
 )
+from app.predict.parameters import PARAMETERS
+from app.predict.watershed import FULL_RESOLUTION, get_watershed
 
-FLOW_RATE_DIV = 12
-BIN_SIZE = 3
-MAX_TRAVEL_TIME = 24
+FLOW_RATE_DIV = PARAMETERS.flow_rate_div
+BIN_SIZE = PARAMETERS.bin_size
+MAX_TRAVEL_TIME = PARAMETERS.max_travel_time
 
+# Garonne at Portet-sur-Garonne
+OUTLET = LatestFlowQueryParams(latitude=43.520681, longitude=1.411743, max_distance=5)
+# Its Hub'Eau site, watched by flow-data
+OUTLET_SITE_CODE = "O2000040"
 
-async def get_baseline_flow() -> float:
-    flow_info = await get_flow_rate_data(
-        LatestFlowQueryParams(latitude=43.520681, longitude=1.411743, max_distance=5)
-    )
-    baseline_date = flow_info.obs_date.replace(
-        minute=0, second=0, microsecond=0, tzinfo=None
-    )
+
+def observation_hour(flow_info: FlowInfo) -> datetime:
+    return flow_info.obs_date.replace(minute=0, second=0, microsecond=0, tzinfo=None)
+
+
+def baseline_flow_from(flow_info: FlowInfo, baseline_rainfall_flow: float) -> float:
+    """
+    Flow rate (m³/h) not explained by rainfall, from an observation and the
+    rainfall flow rate estimated at its time.
+    """
+    return (flow_info.value / 1000 * 3600) - (baseline_rainfall_flow / FLOW_RATE_DIV)
+
+
+def predicted_flow(baseline_flow: float, rainfall_flow: float) -> float:
+    return baseline_flow + (rainfall_flow / FLOW_RATE_DIV)
+
+
+async def get_baseline_flow(resolution: int = FULL_RESOLUTION) -> float:
+    flow_info = await get_flow_rate_data(OUTLET)
+    baseline_date = observation_hour(flow_info)
     print(f"{baseline_date=}")
     baseline_rainfall_flow = await estimate_outlet_flow_rate(
         outlet_time=baseline_date,
         bin_size_hours=BIN_SIZE,
         max_travel_time_hours=MAX_TRAVEL_TIME,
+        resolution=resolution,
     )
-    return (flow_info.value / 1000 * 3600) - (baseline_rainfall_flow / FLOW_RATE_DIV)
+    return baseline_flow_from(flow_info, baseline_rainfall_flow)
 
 
-async def predict_flow_rate(date: datetime) -> float:
-    baseline_flow = await get_baseline_flow()
+async def predict_flow_rate(
+    date: datetime,
+    resolution: int = FULL_RESOLUTION,
+    baseline_flow: float | None = None,
+) -> float:
+    """
+    Predicted flow rate (m³/h) at date. baseline_flow is computed from the
+    latest Hub'Eau observation when not given.
+    """
+    if baseline_flow is None:
+        baseline_flow = await get_baseline_flow(resolution)
     predicted_rainfall_flow_rate = await estimate_outlet_flow_rate(
-        outlet_time=date, bin_size_hours=BIN_SIZE, max_travel_time_hours=MAX_TRAVEL_TIME
+        outlet_time=date,
+        bin_size_hours=BIN_SIZE,
+        max_travel_time_hours=MAX_TRAVEL_TIME,
+        resolution=resolution,
     )
     print(baseline_flow / 3600)
-    return baseline_flow + (predicted_rainfall_flow_rate / FLOW_RATE_DIV)
+    return predicted_flow(baseline_flow, predicted_rainfall_flow_rate)
+
+
+async def predict_flow_ensemble(
+    date: datetime,
+    members: int,
+    displacement_m: float,
+    scale_sigma: float,
+    resolution: int = FULL_RESOLUTION,
+    baseline_flow: float | None = None,
+) -> np.ndarray:
+    """
+    Predicted flow rate (m³/h) of each member of an ensemble of rainfall
+    scenarios around the forecast. Member 0 is the deterministic prediction.
+    baseline_flow is computed from the latest Hub'Eau observation when not
+    given.
+
+    Scenarios only depend on date, so repeated requests get the same ensemble.
+    """
+    if baseline_flow is None:
+        baseline_flow = await get_baseline_flow(resolution)
+    watershed = await get_watershed(resolution)
+    perturbations = Perturbations.draw(
+        members=members,
+        bins=len(range(0, MAX_TRAVEL_TIME, BIN_SIZE)),
+        cell_size_m=abs(watershed.transform.a),
+        displacement_m=displacement_m,
+        scale_sigma=scale_sigma,
+        seed=date.toordinal() * 24 + date.hour,
+    )
+    rainfall_flow_rates = await estimate_outlet_flow_rate_ensemble(
+        outlet_time=date,
+        bin_size_hours=BIN_SIZE,
+        max_travel_time_hours=MAX_TRAVEL_TIME,
+        perturbations=perturbations,
+        resolution=resolution,
+    )
+    return baseline_flow + (rainfall_flow_rates / FLOW_RATE_DIV)
 
 
 if __name__ == "__main__":
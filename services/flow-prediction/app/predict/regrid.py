@@ -0,0 +1,109 @@
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import rasterio  # pyright: ignore[reportMissingTypeStubs]
+from rasterio.warp import (  # pyright: ignore[reportMissingTypeStubs]
+    Resampling,
+    reproject,  # pyright: ignore[reportUnknownVariableType]
+    transform_bounds,
+)
+from rasterio.windows import Window  # pyright: ignore[reportMissingTypeStubs]
+
+from app.predict.watershed import WatershedModel
+
+
+# pyright: reportUnknownArgumentType=false, reportUnknownMemberType=false
+@dataclass(frozen=True)
+class RegridWeights:
+    """
+    Area (m²) of the watershed cells of each travel hour within each pixel of
+    a window of a fixed rainfall grid, such as Coméphores'.
+
+    With them, the volume of a rainfall grid reaching the outlet in each
+    travel hour is a single product, without reprojecting the grid.
+    Cells are assigned to the pixel containing their center, which matches
+    reproject_to_match for grids much coarser than the watershed.
+    """
+
+    window: Window
+    # (window pixels, travel hours)
+    weights: np.ndarray
+
+    @property
+    def hours(self) -> int:
+        return self.weights.shape[1]
+
+    @classmethod
+    def compute(
+        cls, watershed: WatershedModel, grid: rasterio.DatasetReader
+    ) -> "RegridWeights":
+        bounds = transform_bounds(
+            watershed.crs,
+            grid.crs,
+            *rasterio.transform.array_bounds(
+                watershed.height, watershed.width, watershed.transform
+            ),
+        )
+        window = (
+            grid.window(*bounds)
+            .round_offsets(op="floor")
+            .round_lengths(op="ceil")
+            .intersection(Window(0, 0, grid.width, grid.height))
+        )
+        height, width = int(window.height), int(window.width)
+
+        # Index of the grid pixel containing each watershed cell's center
+        pixel_ids = np.arange(height * width, dtype=np.int32).reshape(height, width)
+        cell_pixels = np.full((watershed.height, watershed.width), -1, dtype=np.int32)
+        reproject(
+            source=pixel_ids,
+            destination=cell_pixels,
+            src_transform=grid.window_transform(window),
+            src_crs=grid.crs,
+            src_nodata=-1,
+            dst_transform=watershed.transform,
+            dst_crs=watershed.crs,
+            dst_nodata=-1,
+            resampling=Resampling.nearest,
+        )
+
+        pixels = cell_pixels.ravel()[watershed.cell_index].astype(np.int64)
+        hours = np.repeat(
+            np.arange(watershed.hours), np.diff(watershed.hour_offsets)
+        ).astype(np.int64)
+        inside = pixels >= 0
+        weights = np.bincount(
+            pixels[inside] * watershed.hours + hours[inside],
+            weights=watershed.cell_area[inside],
+            minlength=height * width * watershed.hours,
+        ).reshape(height * width, watershed.hours)
+        return cls(window=window, weights=weights)
+
+    def volumes_m3(self, rain_mm: np.ndarray) -> np.ndarray:
+        """
+        Volume of rain_mm (kg/m² on the window) reaching the outlet in each
+        travel hour.
+        """
+        rain = np.nan_to_num(rain_mm.ravel().astype(np.float64))
+        # kg/m² → m
+        return (rain @ self.weights) * 0.001
+
+    def save(self, path: Path):
+        np.savez(
+            path,
+            window=np.array(
+                [
+                    self.window.col_off,
+                    self.window.row_off,
+                    self.window.width,
+                    self.window.height,
+                ]
+            ),
+            weights=self.weights,
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> "RegridWeights":
+        with np.load(path) as f:
+            return cls(window=Window(*f["window"].tolist()), weights=f["weights"])
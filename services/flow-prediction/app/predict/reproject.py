@@ -1,10 +1,15 @@
 import numpy as np
 import rasterio  # pyright: ignore[reportMissingTypeStubs]
+from affine import Affine
+from floodcast_common.metrics import stage
+from floodcast_common.raster_codec import RasterArray
 from rasterio.warp import (  # pyright: ignore[reportMissingTypeStubs ]
     Resampling,
     reproject,  # pyright: ignore[reportUnknownVariableType]
 )
 
+from app.predict.watershed import WatershedModel
+
 
 def pixel_area_m2(dataset: rasterio.DatasetReader) -> float:
     """
@@ -15,27 +20,35 @@ def pixel_area_m2(dataset: rasterio.DatasetReader) -> float:
 
 # pyright: reportUnknownArgumentType=false, reportUnknownMemberType=false
 def reproject_to_match(
-    src: rasterio.DatasetReader,
-    dst: rasterio.DatasetReader,
+    src: RasterArray,
+    dst: rasterio.DatasetReader | WatershedModel,
 ) -> np.ndarray:
     """
     Reproject src raster to exactly match dst raster grid.
-    Returns a numpy array aligned with dst.
+    Returns a numpy array aligned with dst, NaN where src has no data.
     """
-    dst_array = np.zeros(
+    dst_array = np.full(
         (dst.height, dst.width),
+        np.nan,
         dtype=np.float32,
     )
 
-    reproject(
-        source=rasterio.band(src, 1),
-        destination=dst_array,
-        src_transform=src.transform,
-        src_crs=src.crs,
-        dst_transform=dst.transform,
-        dst_crs=dst.crs,
-        resampling=Resampling.average,  # rainfall should be averaged
-    )
+    with stage("reproject"):
+        reproject(
+            source=src.array,
+            destination=dst_array,
+            src_transform=Affine(*src.transform),
+            src_crs=src.crs,
+            src_nodata=src.nodata,
+            dst_transform=dst.transform,
+            dst_crs=dst.crs,
+            # Not src.nodata, which would be scaled with the values
+            dst_nodata=np.nan,
+            resampling=Resampling.average,  # rainfall should be averaged
+        )
+        # Averaging commutes with the scale of quantized rasters
+        if src.scale != 1:
+            dst_array *= np.float32(src.scale)
 
     return dst_array
 
@@ -70,16 +83,16 @@ if __name__ == "__main__":
                 print("Watershed transform:", watershed_ds.transform)
 
                 # ---- Fetch rainfall ----
-                async with rainfall_data(rainfall_period, client) as rainfall_ds:
-                    print("Rainfall CRS:", rainfall_ds.crs)
-                    print("Rainfall shape:", rainfall_ds.height, rainfall_ds.width)
-                    print("Rainfall transform:", rainfall_ds.transform)
+                async with rainfall_data(rainfall_period, client) as rainfall:
+                    print("Rainfall CRS:", rainfall.crs)
+                    print("Rainfall shape:", rainfall.height, rainfall.width)
+                    print("Rainfall transform:", Affine(*rainfall.transform))
 
-                    write_rainfall_to_disk(rainfall_ds)
+                    write_rainfall_to_disk(rainfall)
 
                     # ---- Reproject rainfall ----
                     reprojected = reproject_to_match(
-                        src=rainfall_ds,
+                        src=rainfall,
                         dst=watershed_ds,
                     )
 
@@ -98,18 +111,24 @@ if __name__ == "__main__":
                     dst.write(reprojected, 1)
 
     def write_rainfall_to_disk(
-        rainfall_ds: rasterio.DatasetReader,
+        rainfall: RasterArray,
     ) -> None:
         """
-        Write the rainfall DatasetReader to disk exactly as read.
+        Write the rainfall values to disk.
         """
 
-        profile = rainfall_ds.profile.copy()
-        profile.update(
+        with rasterio.open(
+            "rainfall.tiff",
+            "w",
+            driver="GTiff",
+            height=rainfall.height,
+            width=rainfall.width,
+            count=1,
+            dtype="float32",
+            crs=rainfall.crs,
+            transform=Affine(*rainfall.transform),
             compress="lzw",
-        )
-
-        with rasterio.open("rainfall.tiff", "w", **profile) as dst:
-            dst.write(rainfall_ds.read(1), 1)
+        ) as dst:
+            dst.write(rainfall.values(), 1)
 
     asyncio.run(test())
@@ -1,9 +1,23 @@
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
 from collections.abc import Iterator
 from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from functools import cache
 from pathlib import Path
 
+import numpy as np
 import rasterio  # pyright: ignore[reportMissingTypeStubs]
+from rasterio.crs import CRS  # pyright: ignore[reportMissingTypeStubs]
 from rasterio.io import DatasetReader  # pyright: ignore[reportMissingTypeStubs]
+from rasterio.transform import Affine  # pyright: ignore[reportMissingTypeStubs]
+
+from app.predict.parameters import PARAMETERS
 
 # WATERSHED_PATH = (
 #     Path(__file__).parents[4]
@@ -13,15 +27,306 @@ from rasterio.io import DatasetReader  # pyright: ignore[reportMissingTypeStubs]
 #     / "garonne"
 #     / "dist.tiff"
 # )
-WATERSHED_PATH = Path(__file__).parents[2] / "watershed" / "garonne" / "dist.tiff"
+WATERSHED_DIR = Path(
+    os.environ.get("WATERSHED_DIR", Path(__file__).parents[2] / "watershed")
+)
+WATERSHED_PATH = WATERSHED_DIR / "garonne" / "dist.tiff"
+
+# Resolution of WATERSHED_PATH, in meters. Coarser levels are built by
+# models/watershed/pyramid.py as dist-{resolution}m.tiff
+FULL_RESOLUTION = 25
+
+# Where models are published for every worker process on the host to map the
+# same pages. Empty to load a private copy in each process. Note that Docker
+# limits /dev/shm to 64 MB unless started with a larger --shm-size; models
+# that do not fit are loaded privately.
+SHARED_DIR = os.environ.get(
+    "WATERSHED_SHARED_DIR", "/dev/shm/floodcast-watershed"
+)
+SHARED_ARRAYS = ("hour_offsets", "cell_index", "cell_area")
 
 
 @contextmanager
-def watershed_dataset() -> Iterator[DatasetReader]:
+def watershed_dataset(resolution: int = FULL_RESOLUTION) -> Iterator[DatasetReader]:
     ds = rasterio.open(  # pyright: ignore[reportUnknownMemberType, reportUnknownVariableType]
-        WATERSHED_PATH
+        watershed_path(resolution)
     )
     try:
         yield ds
     finally:
         ds.close()  # pyright: ignore[reportUnknownMemberType]
+
+
+def watershed_path(resolution: int) -> Path:
+    if resolution == FULL_RESOLUTION:
+        return WATERSHED_PATH
+    return WATERSHED_PATH.with_name(f"{WATERSHED_PATH.stem}-{resolution}m.tiff")
+
+
+def scaled_hours(hours: int, velocity_scale: float) -> np.ndarray:
+    """
+    Travel hour of each of hours travel hours once flow velocities are
+    multiplied by velocity_scale.
+    """
+    return np.floor((np.arange(hours) + 0.5) / velocity_scale).astype(np.int64)
+
+
+@dataclass(frozen=True)
+class WatershedModel:
+    """
+    Area of the watershed by travel time to the outlet, on a raster grid.
+
+    Cells are sorted by travel hour:
+    cell_index[hour_offsets[h]:hour_offsets[h + 1]] are the flat indices of the
+    cells whose water reaches the outlet between h and h + 1 hours later, and
+    cell_area the area (m²) of each such cell draining in that hour.
+    """
+
+    transform: Affine
+    crs: CRS
+    width: int
+    height: int
+    hour_offsets: np.ndarray
+    cell_index: np.ndarray
+    cell_area: np.ndarray
+
+    @property
+    def hours(self) -> int:
+        return len(self.hour_offsets) - 1
+
+    @property
+    def area_m2(self) -> float:
+        return float(self.cell_area.sum())
+
+    def cells(self, start_hr: int, end_hr: int) -> slice:
+        """
+        Cells with travel times in [start_hr, end_hr).
+        """
+        start_hr = min(start_hr, self.hours)
+        end_hr = min(end_hr, self.hours)
+        return slice(int(self.hour_offsets[start_hr]), int(self.hour_offsets[end_hr]))
+
+    def volume_m3(self, rain_mm: np.ndarray, start_hr: int, end_hr: int) -> float:
+        """
+        Volume of rain_mm (kg/m² on this grid) falling on the cells with travel
+        times in [start_hr, end_hr).
+        """
+        cells = self.cells(start_hr, end_hr)
+        rain = rain_mm.ravel()[self.cell_index[cells]]
+        # kg/m² → m
+        return float(np.nansum(rain * self.cell_area[cells]) * 0.001)
+
+    def with_velocity_scale(self, velocity_scale: float) -> "WatershedModel":
+        """
+        The same cells, with flow velocities multiplied by velocity_scale.
+        """
+        if velocity_scale == 1 or self.hours == 0:
+            return self
+        hours = scaled_hours(self.hours, velocity_scale)
+        bands = np.searchsorted(hours, np.arange(hours[-1] + 2))
+        return replace(self, hour_offsets=self.hour_offsets[bands])
+
+    @classmethod
+    def from_travel_times(cls, ds: DatasetReader) -> "WatershedModel":
+        """
+        Model from a single band raster of travel times in seconds.
+        """
+        dist = ds.read(1, masked=True).filled(np.nan)
+        index = np.flatnonzero(np.isfinite(dist) & (dist >= 0))
+        hours = (dist.ravel()[index] // 3600).astype(np.int32)
+        del dist
+        order = np.argsort(hours, kind="stable")
+        hours, index = hours[order], index[order]
+        n_hours = int(hours[-1]) + 1 if hours.size else 0
+
+        return cls(
+            transform=ds.transform,
+            crs=ds.crs,
+            width=ds.width,
+            height=ds.height,
+            hour_offsets=np.searchsorted(hours, np.arange(n_hours + 1)),
+            cell_index=index,
+            cell_area=np.full(
+                index.size, abs(ds.transform.a * ds.transform.e), dtype=np.float32
+            ),
+        )
+
+    @classmethod
+    def from_hour_areas(cls, ds: DatasetReader) -> "WatershedModel":
+        """
+        Model from a raster with one band per travel hour holding drained areas,
+        as written by models/watershed/pyramid.py.
+        """
+        offsets = [0]
+        indices, areas = [], []
+        for band in range(1, ds.count + 1):
+            area = ds.read(band).ravel()
+            index = np.flatnonzero(area > 0)
+            indices.append(index)
+            areas.append(area[index])
+            offsets.append(offsets[-1] + index.size)
+
+        return cls(
+            transform=ds.transform,
+            crs=ds.crs,
+            width=ds.width,
+            height=ds.height,
+            hour_offsets=np.array(offsets),
+            cell_index=np.concatenate(indices),
+            cell_area=np.concatenate(areas).astype(np.float32),
+        )
+
+
+def read_watershed(resolution: int = FULL_RESOLUTION) -> WatershedModel:
+    with watershed_dataset(resolution) as ds:
+        if resolution == FULL_RESOLUTION:
+            return WatershedModel.from_travel_times(ds)
+        return WatershedModel.from_hour_areas(ds)
+
+
+def source_info(source: Path) -> dict:
+    stat = source.stat()
+    return {"path": str(source), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _sha256(path: Path) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+@contextmanager
+def _locked(path: Path) -> Iterator[None]:
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def publish_watershed(model: WatershedModel, source: Path, directory: Path):
+    """
+    Write the arrays of model as .npy files in directory, with a manifest of
+    their checksums and of the source raster they were computed from.
+    The directory is replaced atomically.
+    """
+    tmp = Path(tempfile.mkdtemp(dir=directory.parent, prefix=f".{directory.name}-"))
+    try:
+        checksums = {}
+        for name in SHARED_ARRAYS:
+            path = tmp / f"{name}.npy"
+            np.save(path, getattr(model, name))
+            checksums[name] = _sha256(path)
+        manifest = {
+            "source": source_info(source),
+            "transform": list(model.transform)[:6],
+            "crs": model.crs.to_wkt(),
+            "width": model.width,
+            "height": model.height,
+            "arrays": checksums,
+        }
+        (tmp / "manifest.json").write_text(json.dumps(manifest))
+
+        if directory.exists():
+            # Processes that mapped the old arrays keep them until they exit
+            old = directory.rename(tmp.with_name(tmp.name + "-old"))
+            shutil.rmtree(old)
+        tmp.rename(directory)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+
+def attach_watershed(directory: Path, source: Path) -> WatershedModel | None:
+    """
+    Model whose arrays are read-only memory maps of a published model, or None
+    if there is none for the current source raster or a checksum is wrong.
+    """
+    try:
+        manifest = json.loads((directory / "manifest.json").read_text())
+    except (OSError, ValueError):
+        return None
+    if manifest["source"] != source_info(source):
+        return None
+
+    arrays = {}
+    for name, checksum in manifest["arrays"].items():
+        path = directory / f"{name}.npy"
+        if _sha256(path) != checksum:
+            print(f"[WATERSHED] Checksum mismatch for {path}")
+            return None
+        arrays[name] = np.load(path, mmap_mode="r")
+
+    return WatershedModel(
+        transform=Affine(*manifest["transform"]),
+        crs=CRS.from_wkt(manifest["crs"]),
+        width=manifest["width"],
+        height=manifest["height"],
+        **arrays,
+    )
+
+
+def load_shared_watershed(resolution: int, shared_dir: Path) -> WatershedModel:
+    """
+    Attach to the model published in shared_dir, publishing it first if no
+    other process did. The raster is only read by the first process.
+    """
+    source = watershed_path(resolution)
+    directory = shared_dir / source.stem
+    shared_dir.mkdir(parents=True, exist_ok=True)
+
+    with _locked(shared_dir / f"{source.stem}.lock"):
+        model = attach_watershed(directory, source)
+        if model is None:
+            publish_watershed(read_watershed(resolution), source, directory)
+            model = attach_watershed(directory, source)
+    assert model is not None
+    return model
+
+
+@cache
+def load_base_watershed(resolution: int = FULL_RESOLUTION) -> WatershedModel:
+    """
+    Watershed model at resolution meters, with the travel times of the raster.
+    Loaded once per process and shared between the processes of the host
+    through SHARED_DIR.
+    """
+    if SHARED_DIR:
+        try:
+            return load_shared_watershed(resolution, Path(SHARED_DIR))
+        except OSError as e:
+            print(f"[WATERSHED] Could not share the {resolution}m model: {e!r}")
+    return read_watershed(resolution)
+
+
+@cache
+def load_watershed(resolution: int = FULL_RESOLUTION) -> WatershedModel:
+    """
+    Watershed model at resolution meters, with the calibrated velocities.
+    """
+    return load_base_watershed(resolution).with_velocity_scale(
+        PARAMETERS.velocity_scale
+    )
+
+
+# Loads of each resolution in this process, awaited by the concurrent callers
+_loading: dict[int, asyncio.Future[WatershedModel]] = {}
+
+
+async def get_watershed(resolution: int = FULL_RESOLUTION) -> WatershedModel:
+    """
+    load_watershed off the event loop: the first call of a resolution reads
+    the raster or waits on the other processes sharing it.
+    """
+    future = _loading.get(resolution)
+    if future is None:
+        future = asyncio.ensure_future(asyncio.to_thread(load_watershed, resolution))
+        _loading[resolution] = future
+
+        def forget_failure(f: asyncio.Future[WatershedModel]):
+            if f.cancelled() or f.exception() is not None:
+                _loading.pop(resolution, None)
+
+        future.add_done_callback(forget_failure)
+    # A cancelled request must not cancel the load awaited by the others
+    return await asyncio.shield(future)
@@ -1,17 +1,26 @@
+import os
 from collections.abc import AsyncIterator
 from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
+from typing import Literal
 
 import httpx
-from pydantic import BaseModel
-from rasterio.io import (  # pyright: ignore[reportMissingTypeStubs]
-    DatasetReader,
-    MemoryFile,
+from floodcast_common.metrics import stage, upstream_call
+from floodcast_common.raster_codec import (
+    MEDIA_TYPE,
+    Encoding,
+    RasterArray,
+    decode,
+    from_geotiff,
 )
+from pydantic import BaseModel
 
-BASE_URL = "http://weather-data-service:8000"
+BASE_URL = os.environ.get("WEATHER_DATA_URL", "http://weather-data-service:8000")
 # BASE_URL = "http://localhost:8001"
 
+# Rainfall in steps of 0.01 kg/m² is plenty, falls back to GeoTIFF
+RAINFALL_ACCEPT = f"{Encoding('int16', 'zlib').media_type}, image/tiff;q=0.5"
+
 
 # Times and spans must be on the hour
 class AvailabilityPeriod(BaseModel):
@@ -19,20 +28,81 @@ class AvailabilityPeriod(BaseModel):
     span: timedelta
 
 
+class RunInfo(BaseModel):
+    run: datetime
+
+
+class RainfallAvailability(BaseModel):
+    start: datetime
+    span: timedelta
+    source: Literal["arome", "comephores"]
+    run: datetime | None = None
+
+
+async def get_latest_run(client: httpx.AsyncClient | None = None) -> datetime:
+    """
+    Time of the latest AROME run available from weather-data.
+    """
+    close_client = client is None
+    if close_client:
+        client = httpx.AsyncClient(timeout=None)
+
+    try:
+        with upstream_call("weather-data", "/runs/latest"):
+            response = await client.get(f"{BASE_URL}/runs/latest")
+            _ = response.raise_for_status()
+        return RunInfo.model_validate_json(response.text).run
+    finally:
+        if close_client:
+            await client.aclose()
+
+
+async def get_rainfall_availability(
+    start: datetime,
+    end: datetime,
+    span: timedelta,
+    client: httpx.AsyncClient | None = None,
+) -> set[datetime]:
+    """
+    Start of the periods of span starting every hour from start to end,
+    excluded, that weather-data's /rainfall serves.
+    """
+    close_client = client is None
+    if close_client:
+        client = httpx.AsyncClient(timeout=None)
+
+    try:
+        with upstream_call("weather-data", "/availability"):
+            response = await client.get(
+                f"{BASE_URL}/availability",
+                params={"start": start, "end": end, "span": span},
+            )
+            _ = response.raise_for_status()
+        return {
+            a.start
+            for a in map(RainfallAvailability.model_validate, response.json())
+            if a.source == "arome"
+        }
+    finally:
+        if close_client:
+            await client.aclose()
+
+
 # Rainfall data unit:
 # kg.m-2
 @asynccontextmanager
 async def rainfall_data(
     params: AvailabilityPeriod,
     client: httpx.AsyncClient | None = None,
-) -> AsyncIterator[DatasetReader]:
+) -> AsyncIterator[RasterArray]:
     """
-    Fetch the /rainfall endpoint and open the returned TIFF with rasterio.
+    Fetch the /rainfall endpoint and decode the returned raster, in the
+    compact format of floodcast_common.raster_codec or as a TIFF.
 
     Yields
     ------
-    rasterio.io.DatasetReader
-        An open rasterio dataset.
+    floodcast_common.raster_codec.RasterArray
+        The rainfall array, quantized if weather-data did.
     """
 
     close_client = client is None
@@ -40,20 +110,27 @@ async def rainfall_data(
         client = httpx.AsyncClient(timeout=None)
 
     try:
-        response = await client.get(f"{BASE_URL}/rainfall", params=params.model_dump())
-
-        if response.status_code == 404:
-            raise FileNotFoundError(
-                "Rainfall data not available for this period or span."
+        with stage("fetch"), upstream_call("weather-data", "/rainfall"):
+            response = await client.get(
+                f"{BASE_URL}/rainfall",
+                params=params.model_dump(),
+                headers={"Accept": RAINFALL_ACCEPT},
             )
 
-        _ = response.raise_for_status()
+            if response.status_code == 404:
+                raise FileNotFoundError(
+                    "Rainfall data not available for this period or span."
+                )
+
+            _ = response.raise_for_status()
 
-        tiff_bytes = response.content
+        with stage("decode"):
+            if response.headers.get("content-type", "").startswith(MEDIA_TYPE):
+                raster = decode(response.content)
+            else:
+                raster = from_geotiff(response.content)
 
-        with MemoryFile(tiff_bytes) as memfile:
-            with memfile.open() as dataset:
-                yield dataset
+        yield raster
 
     finally:
         if close_client:
@@ -0,0 +1,152 @@
+import sqlite3
+from dataclasses import dataclass
+from datetime import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS forecasts (
+    outlet_time TEXT PRIMARY KEY,
+    -- m³/h, before the baseline is added
+    rainfall_flow REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS forecast_run (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    run TEXT NOT NULL,
+    resolution INTEGER NOT NULL,
+    -- ModelParameters.fingerprint
+    parameters TEXT NOT NULL DEFAULT '',
+    materialized_at TEXT NOT NULL,
+    observation_time TEXT NOT NULL,
+    -- m³/h
+    baseline_flow REAL NOT NULL
+);
+"""
+
+
+@dataclass(frozen=True)
+class ForecastRun:
+    """
+    The AROME run the stored forecasts were computed from, and the Hub'Eau
+    observation their baseline flow comes from.
+    """
+
+    run: datetime
+    resolution: int
+    # Fingerprint of the model parameters
+    parameters: str
+    materialized_at: datetime
+    observation_time: datetime
+    baseline_flow: float
+
+    def computed_with(self, resolution: int, parameters: str) -> bool:
+        return self.resolution == resolution and self.parameters == parameters
+
+
+@dataclass(frozen=True)
+class StoredForecast:
+    outlet_time: datetime
+    rainfall_flow: float
+    source: ForecastRun
+
+
+class ForecastStore:
+    """
+    Forecasts of a single AROME run, one row per outlet hour, in SQLite.
+    Written by the forecast job, read by /flow.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA busy_timeout=30000")
+        self.connection.executescript(SCHEMA)
+        columns = {
+            row[1]
+            for row in self.connection.execute("PRAGMA table_info(forecast_run)")
+        }
+        if "parameters" not in columns:
+            # Stores from before the parameters were calibrated, whose run
+            # is then recomputed
+            self.connection.execute(
+                "ALTER TABLE forecast_run"
+                " ADD COLUMN parameters TEXT NOT NULL DEFAULT ''"
+            )
+
+    def close(self):
+        self.connection.close()
+
+    def run(self) -> ForecastRun | None:
+        row = self.connection.execute(
+            "SELECT run, resolution, parameters, materialized_at, observation_time,"
+            " baseline_flow FROM forecast_run WHERE id = 1"
+        ).fetchone()
+        if row is None:
+            return None
+        (
+            run,
+            resolution,
+            parameters,
+            materialized_at,
+            observation_time,
+            baseline_flow,
+        ) = row
+        return ForecastRun(
+            run=datetime.fromisoformat(run),
+            resolution=resolution,
+            parameters=parameters,
+            materialized_at=datetime.fromisoformat(materialized_at),
+            observation_time=datetime.fromisoformat(observation_time),
+            baseline_flow=baseline_flow,
+        )
+
+    def get(self, outlet_time: datetime) -> StoredForecast | None:
+        row = self.connection.execute(
+            "SELECT rainfall_flow FROM forecasts WHERE outlet_time = ?",
+            (outlet_time.isoformat(),),
+        ).fetchone()
+        source = self.run()
+        if row is None or source is None:
+            return None
+        return StoredForecast(
+            outlet_time=outlet_time, rainfall_flow=row[0], source=source
+        )
+
+    def replace(
+        self,
+        run: datetime,
+        resolution: int,
+        parameters: str,
+        flow_rates: dict[datetime, float],
+        observation_time: datetime,
+        baseline_flow: float,
+    ):
+        """
+        Replace all the forecasts with those of run.
+        """
+        with self.connection:
+            self.connection.execute("DELETE FROM forecasts")
+            self.connection.executemany(
+                "INSERT INTO forecasts (outlet_time, rainfall_flow) VALUES (?, ?)",
+                [(t.isoformat(), flow) for t, flow in flow_rates.items()],
+            )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO forecast_run (id, run, resolution,"
+                " parameters, materialized_at, observation_time, baseline_flow)"
+                " VALUES (1, ?, ?, ?, ?, ?, ?)",
+                (
+                    run.isoformat(),
+                    resolution,
+                    parameters,
+                    datetime.now().isoformat(),
+                    observation_time.isoformat(),
+                    baseline_flow,
+                ),
+            )
+
+    def set_baseline(self, observation_time: datetime, baseline_flow: float):
+        with self.connection:
+            self.connection.execute(
+                "UPDATE forecast_run SET observation_time = ?, baseline_flow = ?"
+                " WHERE id = 1",
+                (observation_time.isoformat(), baseline_flow),
+            )
@@ -0,0 +1,135 @@
+import asyncio
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+import pytest
+from rasterio.crs import CRS  # pyright: ignore[reportMissingTypeStubs]
+from rasterio.transform import Affine  # pyright: ignore[reportMissingTypeStubs]
+
+from app import backfill
+from app.predict import compute_flow_rate
+from app.predict.watershed import WatershedModel
+
+BIN_SIZE = 3
+MAX_TRAVEL_TIME = 9
+START = datetime(2025, 3, 1)
+HOURS = 30
+
+
+def synthetic_watershed(rng: np.random.Generator) -> WatershedModel:
+    travel_hours = rng.integers(0, 11, size=6 * 5)
+    index = np.argsort(travel_hours, kind="stable")
+    return WatershedModel(
+        transform=Affine.identity(),
+        crs=CRS.from_epsg(2154),
+        width=6,
+        height=5,
+        hour_offsets=np.searchsorted(travel_hours[index], np.arange(12)),
+        cell_index=index,
+        cell_area=rng.uniform(5e3, 1e4, index.size).astype(np.float32),
+    )
+
+
+def hourly_volumes(watershed: WatershedModel, rain: np.ndarray) -> np.ndarray:
+    """
+    Volumes (hours, travel hours), as RegridWeights.volumes_m3 gives them.
+    """
+    return np.array(
+        [
+            [watershed.volume_m3(r, t, t + 1) for t in range(watershed.hours)]
+            for r in rain
+        ]
+    )
+
+
+def test_bin_flow_series_matches_estimate_outlet_flow_rates(monkeypatch):
+    rng = np.random.default_rng(0)
+    watershed = synthetic_watershed(rng)
+    rain = rng.gamma(0.5, 2.0, size=(HOURS, watershed.height, watershed.width))
+
+    async def get_watershed(resolution):
+        return watershed
+
+    async def get_rainfall_availability(start, end, span, client):
+        hours = int((end - start) / timedelta(hours=1))
+        return {start + timedelta(hours=h) for h in range(hours)}
+
+    async def rainfall_on_watershed(period, watershed, client):
+        first = int((period.start - START) / timedelta(hours=1))
+        hours = int(period.span / timedelta(hours=1))
+        if first < 0 or first + hours > HOURS:
+            raise FileNotFoundError(period.start)
+        return rain[first : first + hours].sum(axis=0)
+
+    monkeypatch.setattr(compute_flow_rate, "get_watershed", get_watershed)
+    monkeypatch.setattr(
+        compute_flow_rate, "get_rainfall_availability", get_rainfall_availability
+    )
+    monkeypatch.setattr(
+        compute_flow_rate, "rainfall_on_watershed", rainfall_on_watershed
+    )
+
+    # Flow at the end of each hour of volumes
+    outlet_times = [START + timedelta(hours=h + 1) for h in range(HOURS)]
+    expected = asyncio.run(
+        compute_flow_rate.estimate_outlet_flow_rates(
+            outlet_times, BIN_SIZE, MAX_TRAVEL_TIME
+        )
+    )
+    series = backfill.rainfall_flow_series(
+        hourly_volumes(watershed, rain), BIN_SIZE, MAX_TRAVEL_TIME
+    )
+
+    assert expected, "no outlet time has complete rainfall"
+    for outlet_time, flow in zip(outlet_times, series):
+        if outlet_time in expected:
+            assert flow == pytest.approx(expected[outlet_time], rel=1e-9)
+        else:
+            assert np.isnan(flow)
+
+
+def test_rescale_volumes_matches_a_scaled_watershed():
+    rng = np.random.default_rng(1)
+    watershed = synthetic_watershed(rng)
+    rain = rng.gamma(0.5, 2.0, size=(4, watershed.height, watershed.width))
+
+    for velocity_scale in [0.7, 1.0, 1.6]:
+        scaled = watershed.with_velocity_scale(velocity_scale)
+        np.testing.assert_allclose(
+            backfill.rescale_volumes(hourly_volumes(watershed, rain), velocity_scale),
+            hourly_volumes(scaled, rain),
+            rtol=1e-6,
+        )
+
+
+def test_resumed_run_skips_complete_days_and_redoes_short_ones(tmp_path: Path):
+    pytest.importorskip("pyarrow")
+    comephores_dir, parts_dir = tmp_path / "comephores", tmp_path / "parts"
+    comephores_dir.mkdir()
+    parts_dir.mkdir()
+    complete, short, partial, missing = (date(2025, 3, d) for d in range(1, 5))
+
+    def add_comephores(day: date, hours: int):
+        for hour in backfill.day_hours(day)[:hours]:
+            backfill.comephores_path(comephores_dir, hour).touch()
+
+    def write_part(day: date, hours: int):
+        backfill.write_volumes(
+            parts_dir / f"{day}.parquet",
+            backfill.day_hours(day)[:hours],
+            np.zeros((hours, 3)),
+        )
+
+    add_comephores(complete, 24)
+    write_part(complete, 24)
+    # Written while an hour was missing, which is now there
+    add_comephores(short, 24)
+    write_part(short, 23)
+    # Coméphores itself misses an hour
+    add_comephores(partial, 23)
+    write_part(partial, 23)
+    add_comephores(missing, 24)
+
+    days = [complete, short, partial, missing]
+    assert backfill.pending_days(days, parts_dir, comephores_dir) == [short, missing]
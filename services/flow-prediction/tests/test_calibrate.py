@@ -0,0 +1,63 @@
+import numpy as np
+
+from app.backfill import rainfall_flow_series, rescale_volumes
+from app.calibrate import Candidate, candidate_series, fit
+from app.predict.parameters import ModelParameters
+
+TRUE = ModelParameters(
+    flow_rate_div=15, bin_size=2, max_travel_time=8, velocity_scale=1.3
+)
+INTERCEPT_M3S = 40.0
+
+
+def test_fit_recovers_the_parameters_flows_were_computed_with():
+    rng = np.random.default_rng(0)
+    volumes = rng.gamma(0.5, 2e5, size=(400, 16))
+    rainfall_flow = rainfall_flow_series(
+        rescale_volumes(volumes, TRUE.velocity_scale),
+        TRUE.bin_size,
+        TRUE.max_travel_time,
+    )
+    observed = INTERCEPT_M3S + rainfall_flow / TRUE.flow_rate_div / 3600
+
+    blocks = list(candidate_series(volumes, [0.8, 1.0, 1.3, 1.6], [1, 2, 3], 12))
+    candidates = [c for block, _ in blocks for c in block]
+    series = np.concatenate([s for _, s in blocks])
+    # Hours where every candidate has a complete rainfall
+    hours = np.isfinite(series).all(axis=0) & np.isfinite(observed)
+    result = fit(series[:, hours], observed[hours])
+
+    best = int(np.argmin(np.where(result.slope > 0, result.rmse, np.inf)))
+    assert candidates[best] == Candidate(
+        TRUE.velocity_scale, TRUE.bin_size, TRUE.max_travel_time
+    )
+    np.testing.assert_allclose(1 / (3600 * result.slope[best]), TRUE.flow_rate_div)
+    np.testing.assert_allclose(result.intercept[best], INTERCEPT_M3S)
+    assert result.rmse[best] < 1e-6
+    assert result.nse[best] > 0.999999
+    assert (np.delete(result.rmse, best) > 1e-3).all()
+
+    recovered = ModelParameters(
+        flow_rate_div=1 / (3600 * result.slope[best]),
+        bin_size=candidates[best].bin_size,
+        max_travel_time=candidates[best].max_travel_time,
+        velocity_scale=candidates[best].velocity_scale,
+    )
+    assert recovered.fingerprint != ModelParameters().fingerprint
+    assert (
+        recovered.fingerprint
+        != recovered.model_copy(update={"velocity_scale": 1.0}).fingerprint
+    )
+    assert (
+        recovered.fingerprint
+        != recovered.model_copy(update={"flow_rate_div": 12.0}).fingerprint
+    )
+
+
+def test_fit_of_a_constant_series_has_a_zero_slope():
+    y = np.array([1.0, 2.0, 3.0])
+    result = fit(np.array([[5.0, 5.0, 5.0], [1.0, 2.0, 3.0]]), y)
+
+    np.testing.assert_allclose(result.slope, [0, 1])
+    np.testing.assert_allclose(result.intercept, [2, 0])
+    np.testing.assert_allclose(result.rmse, [np.sqrt(2 / 3), 0], atol=1e-12)
@@ -0,0 +1,14 @@
+import pytest
+from pydantic import ValidationError
+
+from app.dependencies.config import EnsembleConfig
+
+
+@pytest.mark.parametrize("quantile", [-0.1, 1.5])
+def test_quantiles_outside_unit_interval_are_rejected(quantile: float):
+    with pytest.raises(ValidationError):
+        EnsembleConfig(quantiles=[0.5, quantile])
+
+
+def test_quantile_bounds_are_accepted():
+    assert EnsembleConfig(quantiles=[0, 1]).quantiles == [0, 1]
@@ -0,0 +1,38 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from affine import Affine
+from floodcast_common.raster_codec import Encoding, RasterArray, decode, encode
+
+from app.predict.reproject import reproject_to_match
+
+CRS = "EPSG:2154"
+
+
+def test_int16_and_float32_reproject_alike():
+    rng = np.random.default_rng(0)
+    array = rng.gamma(0.5, 4, (10, 10)).astype(np.float32)
+    array[:3] = np.nan
+    src = RasterArray(
+        array=array,
+        transform=tuple(Affine(1000, 0, 500_000, 0, -1000, 6_300_000))[:6],
+        crs=CRS,
+        nodata=None,
+    )
+    # Larger than src, most cells have no source
+    dst = SimpleNamespace(
+        height=40,
+        width=40,
+        transform=Affine(500, 0, 495_000, 0, -500, 6_305_000),
+        crs=CRS,
+    )
+
+    float32 = reproject_to_match(decode(encode(src, Encoding())), dst)
+    int16 = reproject_to_match(
+        decode(encode(src, Encoding(dtype="int16", compression="zlib"))), dst
+    )
+
+    np.testing.assert_array_equal(np.isnan(int16), np.isnan(float32))
+    assert np.nanmin(int16) >= 0
+    assert np.nansum(int16) == pytest.approx(np.nansum(float32), rel=1e-3)
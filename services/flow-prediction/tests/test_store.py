@@ -0,0 +1,63 @@
+import sqlite3
+from datetime import datetime
+
+from app.predict.parameters import ModelParameters
+from app.store import ForecastStore
+
+RUN = datetime(2026, 10, 19, 6)
+
+
+def test_forecasts_of_other_parameters_are_not_current(tmp_path):
+    store = ForecastStore(str(tmp_path / "forecasts.db"))
+    parameters = ModelParameters().fingerprint
+    store.replace(RUN, 250, parameters, {RUN: 1.0}, RUN, 2.0)
+
+    source = store.run()
+    assert source is not None
+    assert source.computed_with(250, parameters)
+    assert not source.computed_with(100, parameters)
+    assert not source.computed_with(
+        250, ModelParameters(velocity_scale=1.2).fingerprint
+    )
+
+
+def test_calibration_does_not_change_the_fingerprint():
+    calibrated = ModelParameters.model_validate(
+        {
+            "calibration": {
+                "start": RUN,
+                "end": RUN,
+                "hours": 1,
+                "rmse_m3s": 1,
+                "nse": 0.5,
+                "intercept_m3s": 0,
+            }
+        }
+    )
+    assert calibrated.fingerprint == ModelParameters().fingerprint
+
+
+def test_stores_without_parameters_are_migrated(tmp_path):
+    path = tmp_path / "forecasts.db"
+    with sqlite3.connect(path) as connection:
+        connection.executescript(
+            """
+            CREATE TABLE forecast_run (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                run TEXT NOT NULL,
+                resolution INTEGER NOT NULL,
+                materialized_at TEXT NOT NULL,
+                observation_time TEXT NOT NULL,
+                baseline_flow REAL NOT NULL
+            );
+            INSERT INTO forecast_run VALUES (
+                1, '2026-10-19T06:00:00', 250, '2026-10-19T06:30:00',
+                '2026-10-19T06:00:00', 2.0
+            );
+            """
+        )
+    connection.close()
+
+    source = ForecastStore(str(path)).run()
+    assert source is not None
+    assert not source.computed_with(250, ModelParameters().fingerprint)
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+
+from fastapi import Request, Response
+from floodcast_common.metrics import CACHE_EVENTS
+
+from app.dependencies.config import CacheConfig
+from app.proxy import BufferedResponse, Upstream, encode_headers
+
+logger = logging.getLogger("gateway")
+
+MAX_ENTRIES = 1024
+# The only request headers sent for cached routes, and part of the cache key.
+# Others, e.g. Authorization, Cookie or X-Forwarded-For, would make the cached
+# response depend on whoever missed the cache first.
+CACHE_KEY_HEADERS = ("accept", "accept-encoding")
+
+CacheKey = tuple[str, str, tuple[tuple[str, str], ...], tuple[str, ...]]
+
+
+@dataclass
+class CacheEntry:
+    response: BufferedResponse
+    stored_at: float
+
+    def age(self) -> float:
+        return time.monotonic() - self.stored_at
+
+
+def normalize_params(
+    params: list[tuple[str, str]], hour_params: list[str]
+) -> tuple[tuple[str, str], ...]:
+    """
+    Sort query parameters, drop empty ones and truncate hour_params to the hour,
+    so that equivalent queries share a cache entry.
+    """
+    normalized = []
+    for key, value in params:
+        if not value:
+            continue
+        if key in hour_params:
+            try:
+                value = (
+                    datetime.fromisoformat(value)
+                    .replace(minute=0, second=0, microsecond=0)
+                    .isoformat()
+                )
+            except ValueError:
+                pass
+        normalized.append((key, value))
+    return tuple(sorted(normalized))
+
+
+def is_storable(response: BufferedResponse) -> bool:
+    """
+    Whether response only varies on request headers of the cache key.
+    """
+    vary = {
+        field.strip().lower()
+        for name, value in response.headers
+        if name.lower() == "vary"
+        for field in value.split(",")
+    }
+    return vary <= set(CACHE_KEY_HEADERS)
+
+
+def is_cached(config: CacheConfig | None, request: Request, path: str) -> bool:
+    return (
+        config is not None
+        and request.method == "GET"
+        and (config.paths is None or path.strip("/") in config.paths)
+    )
+
+
+class ResponseCache:
+    """
+    In-memory LRU cache of upstream GET responses.
+
+    Fresh entries are served directly. Stale entries are served while a single
+    background request refreshes them. Identical requests arriving while an
+    upstream call is in flight wait for that call instead of making their own.
+    """
+
+    def __init__(self, max_entries: int = MAX_ENTRIES) -> None:
+        self.max_entries = max_entries
+        self.entries: OrderedDict[CacheKey, CacheEntry] = OrderedDict()
+        self.in_flight: dict[CacheKey, asyncio.Task[BufferedResponse]] = {}
+
+    async def respond(self, upstream: Upstream, request: Request, path: str) -> Response:
+        config = upstream.route.cache
+        assert config is not None
+
+        params = normalize_params(request.query_params.multi_items(), config.hour_params)
+        key = (
+            upstream.name,
+            path,
+            params,
+            tuple(request.headers.get(h, "") for h in CACHE_KEY_HEADERS),
+        )
+
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            age = entry.age()
+            if age < config.ttl:
+                CACHE_EVENTS.labels("gateway", "hit").inc()
+                return self.to_response(entry.response, "HIT", age)
+            if age < config.ttl + config.stale_while_revalidate:
+                CACHE_EVENTS.labels("gateway", "stale").inc()
+                self.refresh(key, upstream, request, path, list(params))
+                return self.to_response(entry.response, "STALE", age)
+
+        event = "coalesced" if key in self.in_flight else "miss"
+        CACHE_EVENTS.labels("gateway", event).inc()
+        response = await asyncio.shield(
+            self.refresh(key, upstream, request, path, list(params))
+        )
+        return self.to_response(response, "MISS", 0.0)
+
+    def refresh(
+        self,
+        key: CacheKey,
+        upstream: Upstream,
+        request: Request,
+        path: str,
+        params: list[tuple[str, str]],
+    ) -> asyncio.Task[BufferedResponse]:
+        """
+        Start fetching key from upstream, unless a fetch is already in flight.
+        """
+        task = self.in_flight.get(key)
+        if task is None:
+            accept, accept_encoding = key[3]
+            # Without it httpx would ask for compressed bodies
+            headers = [("accept-encoding", accept_encoding or "identity")]
+            if accept:
+                headers.append(("accept", accept))
+            task = asyncio.create_task(upstream.fetch(request, path, params, headers))
+            task.add_done_callback(lambda t: self.store(key, t))
+            self.in_flight[key] = task
+        return task
+
+    def store(self, key: CacheKey, task: asyncio.Task[BufferedResponse]):
+        del self.in_flight[key]
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            logger.warning("Refreshing %s failed: %r", key, task.exception())
+            return
+        response = task.result()
+        # Errors are coalesced but not cached, nor responses varying on headers
+        # that are not sent
+        if response.status_code != 200 or not is_storable(response):
+            return
+        self.entries[key] = CacheEntry(response=response, stored_at=time.monotonic())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            CACHE_EVENTS.labels("gateway", "eviction").inc()
+
+    @staticmethod
+    def to_response(response: BufferedResponse, status: str, age: float) -> Response:
+        r = Response(response.body, status_code=response.status_code)
+        r.raw_headers = encode_headers(
+            response.headers + [("x-cache", status), ("age", str(int(age)))]
+        )
+        return r
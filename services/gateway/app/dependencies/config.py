@@ -1,28 +1,48 @@
 from typing import Annotated, Literal
 from fastapi import Depends
-from httpx import AsyncClient
-from async_lru import alru_cache
-from pydantic import BaseModel
+from floodcast_common.config import ConfigClient
+from pydantic import BaseModel, model_validator
 
 
-class Routes(BaseModel):
-    weather_data: str
+class CacheConfig(BaseModel):
+    # Seconds during which a cached response is served as is
+    ttl: float
+    # Extra seconds during which a stale response is served while it is refreshed
+    stale_while_revalidate: float = 0.0
+    # Cached paths on the upstream, all GET routes if unset
+    paths: list[str] | None = None
+    # Datetime query parameters truncated to the hour in cache keys
+    hour_params: list[str] = []
+
+
+class Route(BaseModel):
+    url: str
+    # Upstream timeout, in seconds
+    timeout: float = 30.0
+    # Requests in flight to this upstream, also the size of its connection pool
+    max_concurrency: int = 100
+    # Cache GET responses, coalescing identical requests in flight
+    cache: CacheConfig | None = None
+
+    @model_validator(mode="before")
+    @classmethod
+    def from_url(cls, data):
+        # A route can also be given as a bare URL
+        if isinstance(data, str):
+            return {"url": data}
+        return data
+
 
 class ConfigModel(BaseModel):
     log_level: Literal["info", "debug"]
-    routes: Routes
+    # Served under /{name}/..., with underscores replaced by dashes
+    routes: dict[str, Route]
+
+config_client = ConfigClient("gateway", ConfigModel)
 
-@alru_cache(maxsize=32)
-async def fetch_config() -> ConfigModel:
-    url = "http://config-service:8000/config/gateway"
-    async with AsyncClient() as client:
-        r = await client.get(url)
-        r.raise_for_status()
-        data = r.json()
-        return ConfigModel(**data["config"])
 
 async def get_config() -> ConfigModel:
-    return await fetch_config()
+    return config_client.current
 
 
 Config = Annotated[ConfigModel, Depends(get_config)]
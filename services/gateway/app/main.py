@@ -1,23 +1,68 @@
-from fastapi import FastAPI
-import httpx
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, HTTPException, Request
 import logging
+from floodcast_common.metrics import instrument
+from floodcast_common.readiness import Readiness
 
 # from app.dependencies.config import Config
-from app.dependencies.config import Config
+from app.dependencies.config import Config, ConfigModel, config_client
+from app.cache import ResponseCache, is_cached
+from app.proxy import create_upstreams
+
+PROXY_METHODS = ["GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS"]
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    await config_client.start()
+    app.state.upstreams = create_upstreams(config_client.current.routes)
+    app.state.cache = ResponseCache()
+
+    def update_routes(old: ConfigModel, new: ConfigModel):
+        if new.routes != old.routes:
+            app.state.upstreams = create_upstreams(new.routes, app.state.upstreams)
+            logger.info("Routes updated: %s", ", ".join(app.state.upstreams))
 
-app = FastAPI()
+    config_client.on_change(update_routes)
+    try:
+        yield
+    finally:
+        for upstream in app.state.upstreams.values():
+            await upstream.aclose()
+        await config_client.stop()
+
+
+app = FastAPI(lifespan=lifespan)
+instrument(app)
+Readiness().install(app)
 logger = logging.getLogger("gateway")
 
 @app.get("/")
-async def root(config: Config):
+async def root(config: Config, request: Request):
     # appel du microservice météo pour vérifier que tout marche
-    weather_url = config.routes.weather_data
-    async with httpx.AsyncClient() as client:
-        r = await client.get(weather_url)
-        weather = r.json()
+    r = await request.app.state.upstreams["weather-data"].client.get("/")
+    weather = r.json()
 
     return {
         "message": "Hello from gateway service!",
-        "config": config.model_dump,
+        "config": config.model_dump(),
         "weather": weather,
     }
+
+
+@app.api_route("/{service}", methods=PROXY_METHODS)
+@app.api_route("/{service}/{path:path}", methods=PROXY_METHODS)
+async def proxy(service: str, request: Request, path: str = ""):
+    """
+    Forward /{service}/{path} to {path} on the service, e.g.
+    /weather-data/rainfall to the weather-data service's /rainfall.
+    Routes with a cache config are answered from the gateway cache.
+    """
+    upstream = request.app.state.upstreams.get(service)
+    if upstream is None:
+        raise HTTPException(404, f"Unknown service {service}")
+    if is_cached(upstream.route.cache, request, path):
+        return await request.app.state.cache.respond(upstream, request, path)
+    return await upstream.forward(request, path)
@@ -0,0 +1,220 @@
+import asyncio
+from collections.abc import AsyncIterator, Iterable
+from dataclasses import dataclass
+
+import httpx
+from fastapi import HTTPException, Request
+from floodcast_common.metrics import upstream_call
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+from app.dependencies.config import Route
+
+# Headers that only apply to a single connection, never forwarded
+HOP_BY_HOP_HEADERS = {
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailer",
+    "transfer-encoding",
+    "upgrade",
+    "host",
+}
+
+
+def forwardable_headers(headers: Iterable[tuple[str, str]]) -> list[tuple[str, str]]:
+    return [(k, v) for k, v in headers if k.lower() not in HOP_BY_HOP_HEADERS]
+
+
+def encode_headers(headers: Iterable[tuple[str, str]]) -> list[tuple[bytes, bytes]]:
+    return [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+
+
+@dataclass
+class BufferedResponse:
+    status_code: int
+    headers: list[tuple[str, str]]
+    body: bytes
+
+
+class Upstream:
+    """
+    One service behind the gateway, with its own keep-alive connection pool.
+    """
+
+    def __init__(self, name: str, route: Route) -> None:
+        self.name = name
+        self.route = route
+        self.client = httpx.AsyncClient(
+            base_url=route.url,
+            timeout=route.timeout,
+            limits=httpx.Limits(
+                max_connections=route.max_concurrency,
+                max_keepalive_connections=route.max_concurrency,
+            ),
+        )
+        self.semaphore = asyncio.Semaphore(route.max_concurrency)
+        # Requests holding or waiting for a semaphore slot
+        self.in_flight = 0
+        self.retired = False
+        self.closing: asyncio.Task | None = None
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    def retire(self):
+        """
+        Close the connection pool once the requests in flight are done, after a
+        config change replaced this upstream.
+        """
+        self.retired = True
+        if self.in_flight == 0 and self.closing is None:
+            self.closing = asyncio.create_task(self.aclose())
+
+    async def _acquire(self):
+        self.in_flight += 1
+        try:
+            async with asyncio.timeout(self.route.timeout):
+                await self.semaphore.acquire()
+        except TimeoutError:
+            self.in_flight -= 1
+            raise HTTPException(503, f"Too many requests in flight to {self.name}")
+        except BaseException:
+            self.in_flight -= 1
+            raise
+
+    def _release(self):
+        self.semaphore.release()
+        self.in_flight -= 1
+        if self.retired:
+            self.retire()
+
+    async def _send(
+        self,
+        request: Request,
+        path: str,
+        params: list[tuple[str, str]] | None = None,
+        headers: list[tuple[str, str]] | None = None,
+    ) -> httpx.Response:
+        """
+        Send request to path on this upstream and return the response before
+        reading its body. The request's headers are forwarded unless headers
+        is given. The caller owns a semaphore slot, and must release it
+        after closing the response. The slot is released here if no response
+        is returned.
+        """
+        try:
+            has_body = "content-length" in request.headers or (
+                "transfer-encoding" in request.headers
+            )
+            if headers is None:
+                headers = forwardable_headers(request.headers.items())
+                if request.client is not None:
+                    headers.append(("x-forwarded-for", request.client.host))
+
+            upstream_request = self.client.build_request(
+                request.method,
+                "/" + path,
+                params=(
+                    params if params is not None else request.query_params.multi_items()
+                ),
+                headers=headers,
+                content=request.stream() if has_body else None,
+            )
+            with upstream_call(self.name, request.method):
+                return await self.client.send(upstream_request, stream=True)
+        except httpx.TimeoutException:
+            self._release()
+            raise HTTPException(504, f"{self.name} did not respond in time")
+        except httpx.RequestError as e:
+            self._release()
+            raise HTTPException(502, f"Could not reach {self.name}: {e!r}")
+        except BaseException:
+            # e.g. cancellation or httpx.InvalidURL, the slot is given back too
+            self._release()
+            raise
+
+    async def fetch(
+        self,
+        request: Request,
+        path: str,
+        params: list[tuple[str, str]],
+        headers: list[tuple[str, str]],
+    ) -> BufferedResponse:
+        """
+        Forward a GET request with only the given headers, and read the whole
+        (raw) response body, for caching.
+        """
+        await self._acquire()
+        response = await self._send(request, path, params, headers)
+        try:
+            body = b"".join([chunk async for chunk in response.aiter_raw()])
+        finally:
+            await response.aclose()
+            self._release()
+        return BufferedResponse(
+            status_code=response.status_code,
+            headers=forwardable_headers(response.headers.multi_items()),
+            body=body,
+        )
+
+    async def forward(self, request: Request, path: str) -> StreamingResponse:
+        """
+        Forward request to path on this upstream. Request and response bodies
+        are streamed through without being buffered in the gateway.
+        """
+        await self._acquire()
+        response = await self._send(request, path)
+
+        closed = False
+
+        async def close():
+            nonlocal closed
+            if not closed:
+                closed = True
+                await response.aclose()
+                self._release()
+
+        async def body() -> AsyncIterator[bytes]:
+            try:
+                async for chunk in response.aiter_raw():
+                    yield chunk
+            finally:
+                await close()
+
+        streaming = StreamingResponse(
+            body(),
+            status_code=response.status_code,
+            background=BackgroundTask(close),
+        )
+        # Raw bytes are forwarded, so content-encoding and content-length still hold
+        streaming.raw_headers = encode_headers(
+            forwardable_headers(response.headers.multi_items())
+        )
+        return streaming
+
+
+def route_prefix(name: str) -> str:
+    return name.replace("_", "-")
+
+
+def create_upstreams(
+    routes: dict[str, Route], current: dict[str, Upstream] | None = None
+) -> dict[str, Upstream]:
+    """
+    Upstreams keyed on their URL prefix. Those of current whose route is
+    unchanged are kept, the others are retired.
+    """
+    current = current or {}
+    upstreams = {}
+    for name, route in routes.items():
+        upstream = current.get(route_prefix(name))
+        if upstream is None or upstream.name != name or upstream.route != route:
+            upstream = Upstream(name, route)
+        upstreams[route_prefix(name)] = upstream
+    for prefix, upstream in current.items():
+        if upstreams.get(prefix) is not upstream:
+            upstream.retire()
+    return upstreams
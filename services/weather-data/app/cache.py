@@ -1,59 +1,245 @@
+"""
+Rainfall cache on disk, shared by every worker and replica mounting CACHE_DIR.
+
+- A coverage is downloaded by a single process at a time: the one that
+  creates its lease file with O_EXCL. The others wait for the lease to go,
+  then read what it wrote.
+- Files are written under a unique temporary name and renamed into place, so
+  readers only ever see complete files.
+- index.db (SQLite) records when each file was fetched and last read, for
+  expiry and LRU eviction across all processes.
+
+Leases work on any shared filesystem. The index relies on SQLite's file
+locks, which network filesystems must support (NFSv4 does).
+"""
+
 import asyncio
+import os
+import socket
+import sqlite3
+import tempfile
 import time
+from datetime import UTC
 from pathlib import Path
-from typing import Dict
 
 import aiofiles
+from floodcast_common.metrics import CACHE_EVENTS
 
 from app.fetch import fetch_rainfall
 from app.models import AvailabilityPeriod
 
-CACHE_DIR = Path(__file__).parents[1] / "cache"
+CACHE_DIR = Path(os.environ.get("CACHE_DIR", Path(__file__).parents[1] / "cache"))
 CACHE_TTL_SECONDS = 60 * 60  # 1 hour
 MAX_CACHE_FILES = 50
-
-lock = asyncio.Lock()
-
-
-def _is_expired(path: Path) -> bool:
-    return (time.time() - path.stat().st_mtime) > CACHE_TTL_SECONDS
-
-
-def _evict_if_needed():
-    files = list(CACHE_DIR.glob("*.tiff"))
-    if len(files) <= MAX_CACHE_FILES:
-        return
-
-    # Sort by last modified (oldest first)
-    files.sort(key=lambda p: p.stat().st_mtime)
-
-    for path in files[: len(files) - MAX_CACHE_FILES]:
+# Longer than a GetCoverage call may take: an older lease was left by a
+# process that crashed, and is taken over
+LEASE_SECONDS = 120
+LEASE_POLL_SECONDS = 0.2
+# Last read times are only updated this often, to keep hits read-only
+ACCESS_RESOLUTION_SECONDS = 60
+
+# Downloads of this process, awaited by its other requests for the same key
+_in_flight: dict[str, asyncio.Task[bytes]] = {}
+
+
+class CacheIndex:
+    """
+    Fetch and last read times of the cached files. Connects on each call, the
+    calls are few and run in threads.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+
+    def connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        return conn
+
+    def fetched_at(self, key: str) -> float | None:
+        """
+        When key was fetched, marking it as read.
+        """
+        now = time.time()
+        conn = self.connect()
+        try:
+            row = conn.execute(
+                "SELECT fetched_at, last_access FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > ACCESS_RESOLUTION_SECONDS:
+                conn.execute(
+                    "UPDATE entries SET last_access = ? WHERE key = ?", (now, key)
+                )
+            return row[0]
+        finally:
+            conn.close()
+
+    def add(self, key: str, size: int) -> list[str]:
+        """
+        Record key as just fetched, and remove the least recently read entries
+        beyond MAX_CACHE_FILES. Returns the keys removed, whose files must be
+        deleted.
+        """
+        now = time.time()
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                (key, size, now, now),
+            )
+            evicted = [
+                row[0]
+                for row in conn.execute(
+                    "SELECT key FROM entries ORDER BY last_access DESC "
+                    "LIMIT -1 OFFSET ?",
+                    (MAX_CACHE_FILES,),
+                )
+            ]
+            conn.executemany(
+                "DELETE FROM entries WHERE key = ?", [(k,) for k in evicted]
+            )
+            conn.execute("COMMIT")
+            return evicted
+        finally:
+            conn.close()
+
+
+index = CacheIndex(CACHE_DIR / "index.db")
+
+
+def cache_key(period: AvailabilityPeriod) -> str:
+    """
+    File name of period's coverage. Naive starts are UTC, aware ones are
+    converted to it, so that the same hour always gets the same file.
+    """
+    start = period.start
+    if start.tzinfo is not None:
+        start = start.astimezone(UTC)
+    return f"{start:%Y%m%dT%H}_{int(period.span.total_seconds()) // 3600}h"
+
+
+def _data_path(key: str) -> Path:
+    return CACHE_DIR / f"{key}.tiff"
+
+
+def _lease_path(key: str) -> Path:
+    return CACHE_DIR / f"{key}.lease"
+
+
+def _acquire_lease(key: str) -> bool:
+    """
+    Take the lease of key, unless another live process holds it.
+    """
+    path = _lease_path(key)
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        try:
+            age = time.time() - path.stat().st_mtime
+        except FileNotFoundError:
+            return False
+        if age < LEASE_SECONDS:
+            return False
+        # Two processes may both take over a stale lease, which only costs a
+        # duplicate download
         path.unlink(missing_ok=True)
-
-
-async def fetch_rainfall_cached(period: AvailabilityPeriod) -> bytes:
-    CACHE_DIR.mkdir(exist_ok=True)
-    path = CACHE_DIR / f"{repr(period)}.tiff"
-    print(path)
-    async with lock:
-        if path.exists() and not _is_expired(path):
-            print("Cache hit")
-            async with aiofiles.open(path, "rb") as f:
-                return await f.read()
-
-        print("Cache miss")
-        # Cache miss or expired
-        data = await fetch_rainfall(period)
-
-        tmp_path = path.with_suffix(".tmp")
-
-        async with aiofiles.open(tmp_path, "wb") as f:
+        return _acquire_lease(key)
+    with os.fdopen(fd, "w") as f:
+        f.write(f"{socket.gethostname()} {os.getpid()}\n")
+    return True
+
+
+async def _read_fresh(key: str) -> bytes | None:
+    fetched_at = await asyncio.to_thread(index.fetched_at, key)
+    if fetched_at is None or time.time() - fetched_at > CACHE_TTL_SECONDS:
+        return None
+    try:
+        async with aiofiles.open(_data_path(key), "rb") as f:
+            return await f.read()
+    except FileNotFoundError:
+        # Evicted meanwhile
+        return None
+
+
+async def _store(key: str, data: bytes):
+    fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, prefix=f".{key}.", suffix=".tmp")
+    try:
+        async with aiofiles.open(fd, "wb") as f:
             await f.write(data)
+        os.replace(tmp, _data_path(key))
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+    for evicted in await asyncio.to_thread(index.add, key, len(data)):
+        _data_path(evicted).unlink(missing_ok=True)
+        CACHE_EVENTS.labels("rainfall", "eviction").inc()
+
+    # Left by processes killed while writing
+    for orphan in CACHE_DIR.glob(".*.tmp"):
+        try:
+            if time.time() - orphan.stat().st_mtime > LEASE_SECONDS:
+                orphan.unlink(missing_ok=True)
+        except FileNotFoundError:
+            pass
+
+
+async def _fetch_shared(key: str, period: AvailabilityPeriod) -> bytes:
+    waited = False
+    while True:
+        data = await _read_fresh(key)
+        if data is not None:
+            CACHE_EVENTS.labels("rainfall", "coalesced" if waited else "hit").inc()
+            return data
+
+        if _acquire_lease(key):
+            try:
+                # Written by the previous lease holder since we last looked
+                data = await _read_fresh(key)
+                if data is not None:
+                    CACHE_EVENTS.labels("rainfall", "coalesced").inc()
+                    return data
+                CACHE_EVENTS.labels("rainfall", "miss").inc()
+                data = await fetch_rainfall(period)
+                await _store(key, data)
+                return data
+            finally:
+                _lease_path(key).unlink(missing_ok=True)
+
+        # Another process is downloading it, wait until it is done. If it
+        # failed, the loop takes the lease and tries again.
+        waited = True
+        while _lease_path(key).exists():
+            await asyncio.sleep(LEASE_POLL_SECONDS)
+            try:
+                if time.time() - _lease_path(key).stat().st_mtime > LEASE_SECONDS:
+                    break
+            except FileNotFoundError:
+                break
 
-        # Atomic replace
-        tmp_path.replace(path)
-
-        # Evict old entries
-        _evict_if_needed()
 
-        return data
+async def fetch_rainfall_cached(period: AvailabilityPeriod) -> bytes:
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    key = cache_key(period)
+    task = _in_flight.get(key)
+    if task is None:
+        task = asyncio.create_task(_fetch_shared(key, period))
+        _in_flight[key] = task
+        task.add_done_callback(lambda _: _in_flight.pop(key, None))
+    else:
+        CACHE_EVENTS.labels("rainfall", "coalesced").inc()
+    # A cancelled request must not cancel the others waiting for the task
+    return await asyncio.shield(task)
@@ -1,24 +1,18 @@
 from typing import Annotated, Literal
 from fastapi import Depends
+from floodcast_common.config import ConfigClient
 from pydantic import BaseModel
-from httpx import AsyncClient
-from async_lru import alru_cache
 
 
 class ConfigModel(BaseModel):
     log_level: Literal["debug"]
 
 
-@alru_cache(maxsize=32)
-async def fetch_config() -> ConfigModel:
-    url = "http://config-service:8000/config/weather-data"
-    async with AsyncClient() as client:
-        r = await client.get(url)
-        r.raise_for_status()
-        data = r.json()
-        return ConfigModel(**data["config"])
+config_client = ConfigClient("weather-data", ConfigModel)
+
 
 async def get_config() -> ConfigModel:
-    return await fetch_config()
+    return config_client.current
+
 
 Config = Annotated[ConfigModel, Depends(get_config)]
@@ -1,3 +1,4 @@
+import bisect
 import os
 import re
 from collections.abc import AsyncIterator, Generator
@@ -9,6 +10,7 @@ from typing import Literal, override
 import httpx
 import isodate  # pyright: ignore[reportMissingTypeStubs]
 from async_lru import alru_cache
+from floodcast_common.metrics import register_lru_cache, upstream_call
 from lxml import (  # pyright: ignore[reportMissingTypeStubs]
     etree,  # pyright: ignore[reportAttributeAccessIssue ]
 )
@@ -20,9 +22,14 @@ from app.models import AvailabilityPeriod
 METEO_FRANCE_AROME_API_KEY = os.environ["METEO_FRANCE_AROME_API_KEY"]
 # Datetime here is the date at which the forecast was published. Period is the time over which it is accumulated.
 COVERAGE_ID = "TOTAL_WATER_PRECIPITATION__GROUND_OR_WATER_SURFACE___{datetime}_{period}"
-BASE_URL = "https://public-api.meteofrance.fr/public/arome/1.0/wcs/MF-NWP-HIGHRES-AROME-0025-FRANCE-WCS"
+BASE_URL = os.environ.get(
+    "METEO_FRANCE_AROME_BASE_URL",
+    "https://public-api.meteofrance.fr/public/arome/1.0/wcs/MF-NWP-HIGHRES-AROME-0025-FRANCE-WCS",
+)
 BASE_PATH = Path(__file__).parent.parent / "comephores"
 FILE_PATTERN = "%Y%m%d%H_ERR.gtif"
+# AROME forecasts end this long after their run
+AROME_HORIZON = timedelta(hours=42)
 
 
 class CoverageQueryParams(BaseModel):
@@ -77,12 +84,13 @@ async def fetch_coverage_ids() -> AsyncIterator[tuple[str, datetime, timedelta]]
         (coverage_id, datetime, period)
     """
     async with httpx.AsyncClient(timeout=60) as client:
-        response = await client.get(
-            BASE_URL + "/GetCapabilities",
-            params=CapabilitiesQueryParams().model_dump(),
-            headers={"apikey": METEO_FRANCE_AROME_API_KEY},
-        )
-        _ = response.raise_for_status()
+        with upstream_call("meteo-france", "GetCapabilities"):
+            response = await client.get(
+                BASE_URL + "/GetCapabilities",
+                params=CapabilitiesQueryParams().model_dump(),
+                headers={"apikey": METEO_FRANCE_AROME_API_KEY},
+            )
+            _ = response.raise_for_status()
 
         # Load the entire XML into memory
         xml_root = etree.fromstring(response.content)
@@ -115,6 +123,38 @@ async def fetch_coverage_ids_cached() -> list[tuple[str, datetime, timedelta]]:
     return res
 
 
+register_lru_cache("coverage_ids", fetch_coverage_ids_cached)
+
+
+async def fetch_latest_run() -> datetime:
+    """
+    Time of the latest AROME run published, as listed by GetCapabilities.
+    """
+    coverage_list = await fetch_coverage_ids_cached()
+    return max(c[1] for c in coverage_list)
+
+
+_local_index: tuple[int, frozenset[datetime]] | None = None
+
+
+def local_index() -> frozenset[datetime]:
+    """
+    Start of the Coméphores files downloaded, listed again only when the
+    directory changed.
+    """
+    global _local_index
+    try:
+        mtime = BASE_PATH.stat().st_mtime_ns
+    except FileNotFoundError:
+        return frozenset()
+    if _local_index is None or _local_index[0] != mtime:
+        _local_index = (
+            mtime,
+            frozenset(p.start for p in fetch_rainfall_availability_local()),
+        )
+    return _local_index[1]
+
+
 def fetch_rainfall_availability_local() -> Generator[AvailabilityPeriod]:
     for file in BASE_PATH.glob("*.gtif"):
         try:
@@ -135,7 +175,11 @@ def select_best_coverage_id(
     coverage_list: list of tuples (coverage_id, dt, period)
     """
     valid_coverages = [
-        c for c in coverage_list if c[1] <= period.start and c[2] == period.span
+        c
+        for c in coverage_list
+        if c[1] <= period.start
+        and c[2] == period.span
+        and period.start + period.span <= c[1] + AROME_HORIZON
     ]
 
     if valid_coverages:
@@ -145,6 +189,27 @@ def select_best_coverage_id(
         return None
 
 
+def serving_runs(
+    starts: list[datetime],
+    span: timedelta,
+    coverage_list: list[tuple[str, datetime, timedelta]],
+) -> list[datetime | None]:
+    """
+    Run of the coverage select_best_coverage_id picks for each period of span
+    starting at starts, or None. The latest run before a period is the only
+    one that can cover it, as older ones end earlier.
+    """
+    runs = sorted(c[1] for c in coverage_list if c[2] == span)
+    serving: list[datetime | None] = []
+    for start in starts:
+        i = bisect.bisect_right(runs, start)
+        if i and start + span <= runs[i - 1] + AROME_HORIZON:
+            serving.append(runs[i - 1])
+        else:
+            serving.append(None)
+    return serving
+
+
 async def fetch_rainfall(period: AvailabilityPeriod) -> bytes:
     # Determine the best coverageId for the period
     # If period is in the past, use the coverageId of that hour
@@ -159,7 +224,7 @@ async def fetch_rainfall(period: AvailabilityPeriod) -> bytes:
     # Determine best coverageId for the period
     best_coverage_id = select_best_coverage_id(period, coverage_list)
     if best_coverage_id is None:
-        raise ValueError("Could not find a coverageId for the requested period.")
+        raise UnavailableData("No AROME run covers the requested period.")
     print(best_coverage_id)
 
     # Create CoverageQueryParams
@@ -168,12 +233,13 @@ async def fetch_rainfall(period: AvailabilityPeriod) -> bytes:
         time=period.start + period.span,
     )
     async with httpx.AsyncClient(timeout=60) as client:
-        response = await client.get(
-            f"{BASE_URL}/GetCoverage",
-            params=params.model_dump(by_alias=True),
-            headers={"apikey": METEO_FRANCE_AROME_API_KEY},
-        )
-        _ = response.raise_for_status()
+        with upstream_call("meteo-france", "GetCoverage"):
+            response = await client.get(
+                f"{BASE_URL}/GetCoverage",
+                params=params.model_dump(by_alias=True),
+                headers={"apikey": METEO_FRANCE_AROME_API_KEY},
+            )
+            _ = response.raise_for_status()
 
         return response.content
 
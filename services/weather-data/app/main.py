@@ -1,18 +1,48 @@
+import asyncio
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from datetime import timedelta
 from typing import Annotated
 
-from fastapi import FastAPI, HTTPException, Query, Response
+from fastapi import FastAPI, Header, HTTPException, Query, Response
 from fastapi.responses import FileResponse
+from floodcast_common.metrics import instrument, stage
+from floodcast_common.raster_codec import (
+    MEDIA_TYPE,
+    accepted_encoding,
+    encode,
+    from_geotiff,
+)
+from floodcast_common.readiness import Readiness
 
 from app.cache import fetch_rainfall_cached
-from app.dependencies.config import Config
+from app.dependencies.config import Config, config_client
 from app.fetch import (
     UnavailableData,
+    fetch_coverage_ids_cached,
+    fetch_latest_run,
     fetch_rainfall_availability_local,
     fetch_rainfall_local,
+    local_index,
+    serving_runs,
+)
+from app.models import (
+    AvailabilityPeriod,
+    AvailabilityQuery,
+    RainfallAvailability,
+    RunInfo,
 )
-from app.models import AvailabilityPeriod
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    async with config_client:
+        yield
+
+
+app = FastAPI(lifespan=lifespan)
+instrument(app)
+Readiness().install(app)
 
 
 @app.get("/")
@@ -20,6 +50,39 @@ async def root(config: Config):
     return {"message": "Hello from weather-data service!", "config": config}
 
 
+@app.get("/availability")
+async def get_availability(
+    query: Annotated[AvailabilityQuery, Query()],
+) -> list[RainfallAvailability]:
+    """
+    Rainfall periods of span starting every hour from start to end, excluded,
+    that /rainfall serves from the AROME coverages listed (and the run it
+    uses), or /rainfall/local from the downloaded Coméphores files.
+    Answered from the cached coverage list, without fetching any coverage.
+    """
+    hours = int((query.end - query.start) / timedelta(hours=1))
+    starts = [query.start + timedelta(hours=h) for h in range(hours)]
+
+    available: list[RainfallAvailability] = []
+    runs = serving_runs(starts, query.span, await fetch_coverage_ids_cached())
+    for start, run in zip(starts, runs):
+        if run is not None:
+            available.append(
+                RainfallAvailability(
+                    start=start, span=query.span, source="arome", run=run
+                )
+            )
+    if query.span == timedelta(hours=1):
+        local = local_index()
+        available += [
+            RainfallAvailability(start=start, span=query.span, source="comephores")
+            for start in starts
+            if start in local
+        ]
+    available.sort(key=lambda a: (a.start, a.source))
+    return available
+
+
 @app.get("/availability/local", response_model=list[AvailabilityPeriod])
 async def get_availability_local():
     """
@@ -28,11 +91,20 @@ async def get_availability_local():
     return list(fetch_rainfall_availability_local())
 
 
+@app.get("/runs/latest")
+async def get_latest_run() -> RunInfo:
+    """
+    Latest AROME run, whose forecasts /rainfall serves for future periods.
+    Coverages are listed at most an hour late.
+    """
+    return RunInfo(run=await fetch_latest_run())
+
+
 @app.get(
     "/rainfall",
     responses={
         200: {
-            "content": {"image/tiff": {}},
+            "content": {"image/tiff": {}, MEDIA_TYPE: {}},
             "description": "TIFF file returned successfully",
         },
         404: {
@@ -43,14 +115,32 @@ async def get_availability_local():
         },
     },
 )
-async def get_rainfall(availability: Annotated[AvailabilityPeriod, Query()]):
+async def get_rainfall(
+    availability: Annotated[AvailabilityPeriod, Query()],
+    accept: Annotated[str | None, Header()] = None,
+):
     """
     Get a TIFF format rainfall map. Unit: ??.
 
     Currently only accepts past dates if downloaded and a one hour span (using comephores).
+
+    Clients accepting floodcast_common.raster_codec.MEDIA_TYPE, with optional
+    dtype=int16 and compression=zlib parameters, get the map in that format.
     """
-    bytes = await fetch_rainfall_cached(availability)
-    return Response(bytes, media_type="image/tiff")
+    try:
+        bytes = await fetch_rainfall_cached(availability)
+    except UnavailableData as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    headers = {"Vary": "Accept"}
+    encoding = accepted_encoding(accept)
+    if encoding is None:
+        return Response(bytes, media_type="image/tiff", headers=headers)
+
+    with stage("encode"):
+        body = await asyncio.to_thread(
+            lambda: encode(from_geotiff(bytes), encoding)
+        )
+    return Response(body, media_type=encoding.media_type, headers=headers)
 
     # except:  # noqa: E722
     #     return HTTPException(status_code=404, detail="No data for this period or span.")
@@ -1,7 +1,7 @@
 from datetime import datetime, timedelta
-from typing import Annotated, override
+from typing import Annotated, Literal, Self, override
 
-from pydantic import AfterValidator, BaseModel, Field
+from pydantic import AfterValidator, BaseModel, Field, model_validator
 
 
 def validate_hour_datetime(v: datetime) -> datetime:
@@ -22,6 +22,10 @@ def validate_hour_timedelta(v: timedelta) -> timedelta:
 HourDelta = Annotated[timedelta, AfterValidator(validate_hour_timedelta)]
 
 
+class RunInfo(BaseModel):
+    run: datetime = Field(title="Time at which the forecast was published.")
+
+
 class AvailabilityPeriod(BaseModel, frozen=True):
     start: HourDatetime = Field(
         title="A datetime with one hour resolution.",
@@ -30,3 +34,34 @@ class AvailabilityPeriod(BaseModel, frozen=True):
     span: HourDelta = Field(
         title="A timedelta with one hour resolution.", examples=[timedelta(hours=1)]
     )
+
+
+# Hours of periods /availability lists at once
+MAX_AVAILABILITY_HOURS = 31 * 24
+
+
+class AvailabilityQuery(BaseModel):
+    start: HourDatetime = Field(title="First period start.")
+    end: HourDatetime = Field(title="Periods start before this datetime.")
+    span: HourDelta = Field(
+        title="A timedelta with one hour resolution.", examples=[timedelta(hours=1)]
+    )
+
+    @model_validator(mode="after")
+    def validate_range(self) -> Self:
+        if self.end <= self.start:
+            raise ValueError("end must be after start")
+        if self.end - self.start > timedelta(hours=MAX_AVAILABILITY_HOURS):
+            raise ValueError(f"at most {MAX_AVAILABILITY_HOURS} hours at once")
+        if self.span <= timedelta(0):
+            raise ValueError("span must be positive")
+        return self
+
+
+class RainfallAvailability(BaseModel):
+    start: datetime
+    span: timedelta
+    # arome: served by /rainfall from the AROME forecast of run.
+    # comephores: served by /rainfall/local.
+    source: Literal["arome", "comephores"]
+    run: datetime | None = None